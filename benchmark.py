@@ -0,0 +1,360 @@
+import os
+import sys
+import time
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+from tabulate import tabulate
+
+
+def benchmark_import(args):
+    # submit tasks one by one (one transaction per task) versus in bulk (one transaction)
+    from database import get_database
+    from client import make_task
+
+    gpu_task_db = get_database(os.path.join(args.tmp_dir, "benchmark.db"))
+    table = []
+    for num_tasks in args.num_tasks:
+        tasks = [make_task(f"python train.py --lr {i}", 1 + i % 4) for i in range(num_tasks)]
+
+        gpu_task_db.remove_all()
+        start = time.perf_counter()
+        gpu_task_db.add_tasks(tasks)
+        bulk_time = time.perf_counter() - start
+
+        single_time = None
+        if num_tasks <= args.max_single:
+            gpu_task_db.remove_all()
+            start = time.perf_counter()
+            for task in tasks:
+                gpu_task_db.add_task(**task)
+            single_time = time.perf_counter() - start
+
+        table.append([num_tasks, f"{single_time:.3f}s" if single_time is not None else "-", f"{bulk_time:.3f}s"])
+
+    print(tabulate(table, headers=["NUM_TASKS", "ADD_TASK", "ADD_TASKS"]))
+
+
+def benchmark_lookup(args):
+    # next-task lookup and state listing with a long history of done tasks, with and without the index
+    from pony import orm
+    from database import get_database, Task
+    from client import make_task
+    from constant import STATE
+
+    gpu_task_db = get_database(os.path.join(args.tmp_dir, "benchmark.db"))
+    first_id, last_id = gpu_task_db.add_tasks([make_task(f"python train.py --seed {i}") for i in range(args.num_done)])
+    with orm.db_session:
+        gpu_task_db.db.execute(f"UPDATE Task SET state = {STATE.DONE} WHERE id <= {last_id}")
+    gpu_task_db.add_tasks([make_task(f"python eval.py --seed {i}") for i in range(args.num_queuing)])
+
+    def measure(func):
+        # a new session each time, pony caches query results within a session
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            with orm.db_session:
+                func()
+        return (time.perf_counter() - start) / args.repeat * 1000
+
+    queries = [
+        ("get_next_task", gpu_task_db.get_next_task),
+        ("find_schedulable_tasks", gpu_task_db.find_schedulable_tasks),
+        ("find_tasks_by_state(running)", lambda: gpu_task_db.find_tasks_by_state(STATE.RUNNING)),
+        ("list_tasks(all states, limit=10)", lambda: gpu_task_db.list_tasks(
+            [STATE.RUNNING, STATE.PENDING, STATE.QUEUING, STATE.DONE], limit=10)),
+    ]
+    with_index = [measure(func) for _, func in queries]
+    with orm.db_session:
+        gpu_task_db.db.execute("DROP INDEX idx_task__state_priority_submit_time")
+    without_index = [measure(func) for _, func in queries]
+
+    table = [[name, f"{a:.3f}ms", f"{b:.3f}ms"] for (name, _), a, b in zip(queries, without_index, with_index)]
+    print(f"{args.num_done} done tasks, {args.num_queuing} queuing tasks")
+    print(tabulate(table, headers=["QUERY", "NO_INDEX", "INDEX"]))
+
+
+def benchmark_startup(args):
+    # end-to-end time of client commands, reading task.db directly versus asking the server through rpc
+    from database import get_database
+    from client import make_task
+    from rpc import RPCServer
+    from server import handle_database_request
+    from util import get_logger
+
+    db_path = os.path.join(args.tmp_dir, "task.db")
+    gpu_task_db = get_database(db_path)
+    gpu_task_db.add_tasks([make_task(f"python train.py --seed {i}") for i in range(args.num_tasks)])
+
+    rpc_path = os.path.join(args.tmp_dir, "server_rpc.sock")
+    rpc_server = RPCServer(rpc_path, lambda method, params, uid: handle_database_request(gpu_task_db, method, params),
+                           get_logger(os.path.join(args.tmp_dir, "benchmark.log")))
+    rpc_server.start()
+
+    client_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "client.py")
+    commands = [
+        ("python -c pass", [sys.executable, "-c", "pass"]),
+        ("show", [sys.executable, client_path, "-m", "20", "--rpc-path", rpc_path]),
+        ("submit", [sys.executable, client_path, "-c", "sleep", "1", "--rpc-path", rpc_path]),
+        ("show --local", [sys.executable, client_path, "-m", "20", "--local", "--db-path", db_path]),
+        ("submit --local", [sys.executable, client_path, "-c", "sleep", "1", "--local", "--db-path", db_path]),
+    ]
+
+    table = []
+    for name, command in commands:
+        elapsed = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+            elapsed.append(time.perf_counter() - start)
+        elapsed.sort()
+        table.append([name, f"{sum(elapsed) / len(elapsed) * 1000:.1f}ms", f"{elapsed[0] * 1000:.1f}ms"])
+
+    rpc_server.stop()
+    print(f"{args.num_tasks} queuing tasks, {args.repeat} runs each")
+    print(tabulate(table, headers=["COMMAND", "MEAN", "MIN"]))
+
+
+def benchmark_stress(args):
+    # many short tasks on fake gpus through the server runtime, delay between the exit of a task and the
+    # launch of the next one on the freed gpu
+    import signal
+    import logging
+    import threading
+    from database import get_database
+    from client import make_task
+    from devices import FakeDeviceProvider
+    from eventlog import EventLog
+    from rpc import connect_server
+    from server import GPUManager, GPUTaskManagerServer
+
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+    # nothing is written next to the real server
+    tasks_dir = os.path.join(args.tmp_dir, "tasks")
+    gpu_manager = GPUManager(logger, FakeDeviceProvider(args.num_gpus), task_status_dir=tasks_dir,
+                             task_log_dir=tasks_dir, telemetry_dir=os.path.join(args.tmp_dir, "telemetry"))
+    rpc_path = os.path.join(args.tmp_dir, "server_rpc.sock")
+    server = GPUTaskManagerServer(get_database(os.path.join(args.tmp_dir, "task.db")), logger, gpu_manager,
+                                  rpc_path=rpc_path, notify_path=os.path.join(args.tmp_dir, "server.sock"),
+                                  event_log=EventLog(os.path.join(args.tmp_dir, "events.jsonl")))
+    events = []
+    submit_times = []
+
+    def submit_and_watch():
+        while not os.path.exists(rpc_path):
+            time.sleep(0.01)
+        watcher = connect_server(rpc_path)
+        events_iter = watcher.watch()
+        submit_client = connect_server(rpc_path)
+        submit_times.append(datetime.datetime.utcnow())
+        submit_client.call("add_tasks", tasks=[make_task(f"sleep {args.runtime}") for _ in range(args.num_tasks)])
+        num_done = 0
+        for event in events_iter:
+            events.append(event)
+            num_done += event["event"] == "done"
+            if num_done == args.num_tasks:
+                break
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=submit_and_watch, daemon=True).start()
+    server.start()
+
+    submit_time = submit_times[0]
+    launch_times = [e["time"] for e in events if e["event"] == "launched"]
+    done_times = [e["time"] for e in events if e["event"] == "done"]
+    # with one gpu per task, the i-th launch after the first wave takes the gpu freed by the i-th exit
+    latencies = sorted((launch - done).total_seconds() * 1000
+                       for launch, done in zip(launch_times[args.num_gpus:], done_times))
+    makespan = (done_times[-1] - submit_time).total_seconds()
+
+    print(f"{args.num_tasks} tasks of {args.runtime}s on {args.num_gpus} fake gpus")
+    print(tabulate([
+        ["first launch", f"{(launch_times[0] - submit_time).total_seconds() * 1000:.1f}ms"],
+        ["exit to next launch, mean", f"{sum(latencies) / len(latencies):.1f}ms"],
+        ["exit to next launch, p50", f"{latencies[len(latencies) // 2]:.1f}ms"],
+        ["exit to next launch, p99", f"{latencies[int(len(latencies) * 0.99)]:.1f}ms"],
+        ["exit to next launch, max", f"{latencies[-1]:.1f}ms"],
+        ["makespan", f"{makespan:.2f}s (ideal {args.num_tasks * args.runtime / args.num_gpus:.2f}s)"],
+    ], headers=["METRIC", "VALUE"]))
+
+
+def benchmark_dag(args):
+    # dependency graph of the server on a random dag: tasks finish in a random order among the ready ones,
+    # some of them fail, the ready and cancelled tasks are checked against a full rescan of the dag
+    import random
+    from dag import DependencyGraph
+
+    rng = random.Random(args.seed)
+    parents = {i: rng.sample(range(i), min(i, rng.randint(0, args.max_parents))) for i in range(args.num_tasks)}
+
+    graph = DependencyGraph()
+    start = time.perf_counter()
+    for task_id, task_parents in parents.items():
+        graph.add(task_id, task_parents)
+    add_time = time.perf_counter() - start
+
+    ready = [task_id for task_id in parents if not graph.is_blocked(task_id)]
+    done, failed, cancelled = set(), set(), set()
+    finish_time = 0
+    errors = 0
+    while len(ready) > 0:
+        task_id = ready.pop(rng.randrange(len(ready)))
+        start = time.perf_counter()
+        if rng.random() < args.failure_rate:
+            failed.add(task_id)
+            newly_cancelled = graph.set_failed(task_id)
+            cancelled.update(newly_cancelled)
+            newly_ready = []
+        else:
+            done.add(task_id)
+            newly_ready = graph.set_done(task_id)
+        finish_time += time.perf_counter() - start
+
+        for child in newly_ready:
+            errors += not all(parent in done for parent in parents[child])
+        ready += newly_ready
+
+    # rescan: a task runs iff all its parents are done, it is cancelled iff one of its ancestors failed
+    expected_cancelled = set()
+    for task_id in range(args.num_tasks):
+        if any(parent in failed or parent in expected_cancelled for parent in parents[task_id]):
+            expected_cancelled.add(task_id)
+    errors += expected_cancelled != cancelled
+    errors += len(done) + len(failed) + len(cancelled) != args.num_tasks
+    errors += len(graph.parents) + len(graph.children) != 0
+
+    num_edges = sum(len(task_parents) for task_parents in parents.values())
+    print(f"{args.num_tasks} tasks, {num_edges} dependencies, {len(done)} done, {len(failed)} failed, "
+          f"{len(cancelled)} cancelled, {'ok' if errors == 0 else f'{errors} errors'}")
+    print(tabulate([
+        ["add all tasks", f"{add_time * 1000:.1f}ms"],
+        ["finish all tasks", f"{finish_time * 1000:.1f}ms"],
+        ["per dependency", f"{(add_time + finish_time) / max(num_edges, 1) * 1e6:.2f}us"],
+    ], headers=["OPERATION", "TIME"]))
+    if errors > 0:
+        sys.exit(1)
+
+
+def benchmark_telemetry(args):
+    # cpu time of the telemetry sampling of the server: `args.num_tasks` sleeping processes, each in its own
+    # session like a launched task, sharing `args.num_gpus` fake gpus, compared with the sampling interval
+    import logging
+    from devices import FakeDeviceProvider
+    from server import GPUManager
+    from telemetry import get_telemetry_path, read_samples
+
+    logger = logging.getLogger("benchmark")
+    provider = FakeDeviceProvider(args.num_gpus)
+    gpu_manager = GPUManager(logger, provider, telemetry_dir=os.path.join(args.tmp_dir, "telemetry"))
+    processes = []
+    try:
+        for task_id in range(args.num_tasks):
+            process = subprocess.Popen(["sleep", "3600"], start_new_session=True)
+            processes.append(process)
+            gpu = task_id % args.num_gpus
+            provider.set_usage(gpu, 0.9, 1024 * (task_id // args.num_gpus + 1))
+            gpu_manager.update_gpu_process([gpu], process, task_id, memory=1024)
+        gpu_manager.refresh()
+
+        start, start_cpu = time.perf_counter(), time.process_time()
+        for _ in range(args.num_samples):
+            gpu_manager.record_telemetry()
+        wall_time = (time.perf_counter() - start) / args.num_samples
+        cpu_time = (time.process_time() - start_cpu) / args.num_samples
+        num_records = sum(len(read_samples(get_telemetry_path(gpu_manager.telemetry.directory, task_id)))
+                          for task_id in range(args.num_tasks))
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+
+    print(f"{args.num_tasks} tasks on {args.num_gpus} fake gpus, {args.num_samples} samples, "
+          f"{num_records} records written, {len(os.listdir('/proc'))} entries in /proc")
+    print(tabulate([
+        ["wall time per sample", f"{wall_time * 1000:.2f}ms"],
+        ["cpu time per sample", f"{cpu_time * 1000:.2f}ms"],
+        [f"cpu overhead at {args.interval}s interval", f"{cpu_time / args.interval * 100:.3f}%"],
+    ], headers=["METRIC", "VALUE"]))
+
+
+def benchmark_simulate(args):
+    # scheduling policies of the server on a simulated cluster, without gpus: `args.days` days of submissions on
+    # `args.num_gpus` virtual gpus, fails if a task never ends or if the simulation takes over `args.max_seconds`
+    import simulator
+
+    workload = simulator.generate_workload(None, args.num_gpus, args.interval, args.seed, args.num_users,
+                                           duration=args.days * 24 * 3600, max_job_gpus=args.max_job_gpus,
+                                           failure_rate=args.failure_rate, urgent_rate=args.urgent_rate)
+    policies = simulator.get_policies(preempt_priority=10)
+    start = time.perf_counter()
+    results = simulator.run_all(policies, workload, args.num_gpus)
+    wall_time = time.perf_counter() - start
+
+    errors = sum(result["unfinished"] for result, _ in results.values())
+    print(f"{len(workload)} tasks in {args.days:g} days on {args.num_gpus} gpus, {len(policies)} policies simulated "
+          f"in {wall_time:.2f}s, {'ok' if errors == 0 else f'{errors} unfinished tasks'}")
+    print(simulator.format_results(results))
+    if errors > 0 or wall_time > args.max_seconds:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("GPU Task Manager Benchmark")
+    parser.add_argument("--tmp-dir", type=str, default=None, help="directory of the benchmark database")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_import = subparsers.add_parser("import", help="task file import")
+    parser_import.add_argument("--num-tasks", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser_import.add_argument("--max-single", type=int, default=10000,
+                               help="skip one by one submission above this number of tasks")
+    parser_import.set_defaults(func=benchmark_import)
+
+    parser_lookup = subparsers.add_parser("lookup", help="task queries on a large history")
+    parser_lookup.add_argument("--num-done", type=int, default=100000)
+    parser_lookup.add_argument("--num-queuing", type=int, default=100)
+    parser_lookup.add_argument("--repeat", type=int, default=20)
+    parser_lookup.set_defaults(func=benchmark_lookup)
+
+    parser_startup = subparsers.add_parser("startup", help="client command latency")
+    parser_startup.add_argument("--num-tasks", type=int, default=1000)
+    parser_startup.add_argument("--repeat", type=int, default=20)
+    parser_startup.set_defaults(func=benchmark_startup)
+
+    parser_stress = subparsers.add_parser("stress", help="scheduling latency of the server with short tasks")
+    parser_stress.add_argument("--num-tasks", type=int, default=500)
+    parser_stress.add_argument("--num-gpus", type=int, default=8)
+    parser_stress.add_argument("--runtime", type=float, default=0.1, help="seconds")
+    parser_stress.set_defaults(func=benchmark_stress)
+
+    parser_dag = subparsers.add_parser("dag", help="dependency graph on a random dag")
+    parser_dag.add_argument("--num-tasks", type=int, default=10000)
+    parser_dag.add_argument("--max-parents", type=int, default=4)
+    parser_dag.add_argument("--failure-rate", type=float, default=0.01)
+    parser_dag.add_argument("--seed", type=int, default=0)
+    parser_dag.set_defaults(func=benchmark_dag)
+
+    parser_telemetry = subparsers.add_parser("telemetry", help="cpu overhead of the task telemetry")
+    parser_telemetry.add_argument("--num-tasks", type=int, default=48)
+    parser_telemetry.add_argument("--num-gpus", type=int, default=16)
+    parser_telemetry.add_argument("--num-samples", type=int, default=100)
+    parser_telemetry.add_argument("--interval", type=float, default=10, help="sampling interval in seconds")
+    parser_telemetry.set_defaults(func=benchmark_telemetry)
+
+    parser_simulate = subparsers.add_parser("simulate", help="scheduling policies on a simulated cluster")
+    parser_simulate.add_argument("--num-gpus", type=int, default=64)
+    parser_simulate.add_argument("--days", type=float, default=7)
+    parser_simulate.add_argument("--interval", type=float, default=240, help="mean seconds between submissions")
+    parser_simulate.add_argument("--max-job-gpus", type=int, default=16)
+    parser_simulate.add_argument("--num-users", type=int, default=4)
+    parser_simulate.add_argument("--failure-rate", type=float, default=0.05)
+    parser_simulate.add_argument("--urgent-rate", type=float, default=0.05)
+    parser_simulate.add_argument("--seed", type=int, default=0)
+    parser_simulate.add_argument("--max-seconds", type=float, default=60, help="fail above this wall time")
+    parser_simulate.set_defaults(func=benchmark_simulate)
+
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        args.tmp_dir = tmp_dir
+        args.func(args)
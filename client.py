@@ -1,16 +1,137 @@
 import os
+import json
 import argparse
-import time
 import sys
+import datetime
 
-from pony import orm
 from termcolor import colored
-from tabulate import tabulate
 
 from config import *
 from constant import *
 
-from database import get_database
+from notify import notify_server
+from rpc import RPCDatabase, RPCError, connect_server, get_user_name
+
+# pony and tabulate are only imported when needed, a client talking to the running server starts
+# without them (see `python benchmark.py startup`)
+ANSI_ESCAPE = "\x1b["
+
+
+def make_task(command, num_gpus=1, runtime=None, memory=None, exclude_gpus=[], after=[], preemptible=False):
+    # validated arguments of `GPUTaskDatabase.add_task`, runtime is given in minutes
+    command = command.strip()
+    if command == '':
+        raise ValueError("empty command")
+    if int(num_gpus) < 1:
+        raise ValueError(f"num_gpus requires positive int, but got {num_gpus}")
+    if runtime is not None and int(runtime) < 0:
+        raise ValueError(f"runtime requires non-negative int, but got {runtime}")
+    if memory is not None and int(memory) < 1:
+        raise ValueError(f"memory requires positive int, but got {memory}")
+
+    return {
+        "command": command,
+        "num_gpus_required": int(num_gpus),
+        "exclude_gpus": [int(gpu) for gpu in exclude_gpus],
+        "estimated_runtime": int(runtime) * 60 if runtime is not None else None,
+        "memory_required": int(memory) if memory is not None else None,
+        "after": [int(task_id) for task_id in after],
+        "preemptible": bool(preemptible),
+    }
+
+
+def get_owner():
+    # tasks are owned by the user submitting them, for the fair share between users, the server only trusts the
+    # user of the process connected to it and this one is for --local
+    return get_user_name(os.getuid())
+
+
+def parse_after(items):
+    # dependencies of a task of a file: task ids, and "#k" for the k-th task of the same file
+    # return the task ids and the indices of the tasks of the file
+    task_ids, indices = [], []
+    for item in items:
+        item = str(item).strip()
+        if item.startswith("#"):
+            indices.append(int(item[1:]) - 1)
+        elif item != '':
+            task_ids.append(int(item))
+    return task_ids, indices
+
+
+def parse_task_line(line):
+    # command(;num_gpus(;runtime(;memory(;after)))), after is a list of ids or "#k" separated by spaces or commas
+    items = [item.strip() for item in line.split(";")]
+    items = items + [''] * (5 - len(items))
+    after, after_tasks = parse_after(items[4].replace(",", " ").split())
+    task = make_task(" ".join(items[0].split()), items[1] or 1, items[2] or None, items[3] or None, after=after)
+    task["after_tasks"] = after_tasks
+    return task
+
+
+def parse_jsonl_line(line):
+    # {"command": "...", "num_gpus": 1, "runtime": 10, "memory": 2048, "exclude_gpus": [0], "after": [12, "#1"],
+    #  "preemptible": true}
+    item = json.loads(line)
+    if not isinstance(item, dict):
+        raise ValueError("requires a json object")
+    after, after_tasks = parse_after(item.get("after", []))
+    task = make_task(item["command"], item.get("num_gpus", 1), item.get("runtime"), item.get("memory"),
+                     item.get("exclude_gpus", []), after, item.get("preemptible", False))
+    task["after_tasks"] = after_tasks
+    return task
+
+
+def parse_sweep(text):
+    # {"command": "python train.py --lr {lr} --bs {bs}", "grid": {"lr": [0.1, 0.01], "bs": [32, 64]},
+    #  "num_gpus": 1, "runtime": 10, "memory": 2048, "exclude_gpus": [0], "preemptible": true,
+    #  "stop_exit_code": 42, "max_failures": 3}
+    # with "list" or "random" instead of "grid", see `sweep.parse_axes`
+    from sweep import parse_axes, check_template, get_size
+
+    item = json.loads(text)
+    if not isinstance(item, dict):
+        raise ValueError("requires a json object")
+    axes = parse_axes(item)
+    sweep = make_task(item["command"], item.get("num_gpus", 1), item.get("runtime"), item.get("memory"),
+                      item.get("exclude_gpus", []), [], item.get("preemptible", False))
+    del sweep["after"]
+    check_template(sweep["command"], axes)
+    stop_exit_code, max_failures = item.get("stop_exit_code"), item.get("max_failures")
+    if stop_exit_code is not None and not 0 < int(stop_exit_code) < 256:
+        raise ValueError(f"stop_exit_code requires an exit code in [1, 255], but got {stop_exit_code}")
+    if max_failures is not None and int(max_failures) < 1:
+        raise ValueError(f"max_failures requires positive int, but got {max_failures}")
+
+    sweep.update(axes=axes, size=get_size(axes),
+                 stop_exit_code=int(stop_exit_code) if stop_exit_code is not None else None,
+                 max_failures=int(max_failures) if max_failures is not None else None)
+    return sweep
+
+
+def get_display_width(text):
+    # length without the color escape sequences
+    width = 0
+    for i, part in enumerate(text.split(ANSI_ESCAPE)):
+        width += len(part) if i == 0 else len(part) - part.find("m") - 1
+    return width
+
+
+def format_table(table, headers):
+    # plain table in the layout of `tabulate`, numbers are aligned right
+    columns = list(zip(headers, *table))
+    cells = [["" if value is None else str(value) for value in row] for row in [headers] + table]
+    widths = [max(get_display_width(row[i]) for row in cells) for i in range(len(headers))]
+    is_numeric = [all(isinstance(value, int) or value is None for value in column[1:]) for column in columns]
+
+    lines = []
+    for row in cells[:1] + [["-" * width for width in widths]] + cells[1:]:
+        items = []
+        for cell, width, right in zip(row, widths, is_numeric):
+            padding = " " * (width - get_display_width(cell))
+            items.append(padding + cell if right else cell + padding)
+        lines.append("  ".join(items).rstrip())
+    return "\n".join(lines)
 
 
 class GPUTaskManagerClient(object):
@@ -18,58 +139,117 @@ class GPUTaskManagerClient(object):
         self.db = database
     
 
-    def submit(self, command, num_gpus_required, exclude_gpus=[]):
+    def submit(self, command, num_gpus_required, exclude_gpus=[], runtime=None, memory=None, after=[],
+               preemptible=False):
         command = " ".join([c for c in command])
-        self.db.add_task(command=command, num_gpus_required=num_gpus_required, exclude_gpus=exclude_gpus)
-        print(f"successfully add task `{command}`")
+        task_id = self.db.add_task(**make_task(command, num_gpus_required, runtime, memory, exclude_gpus, after,
+                                               preemptible), owner=get_owner())
+        notify_server(NOTIFY_PATH)
+        print(f"successfully add task `{command}` with id {task_id}")
     
-    def submit_from_file(self, filepath, exclude_gpus=[]):
-        if not os.path.exists(filepath):
-            raise ValueError(f"`{filepath}` does not exit!")
-
-        with open(filepath, 'r') as f:
-            for line in f.readlines():
-                line = line.strip()
-                if line.startswith("#") or line == '':
-                    # ignore comment or blank line
-                    continue
-                
-                items = line.split(";")
+    def submit_from_file(self, filepath, exclude_gpus=[], is_jsonl=False, preemptible=False):
+        # "-" reads tasks from stdin, the whole file is validated before submitting anything
+        if filepath == "-":
+            lines = sys.stdin.readlines()
+        else:
+            if not os.path.exists(filepath):
+                raise ValueError(f"`{filepath}` does not exit!")
+            with open(filepath, 'r') as f:
+                lines = f.readlines()
+
+        parse_line = parse_jsonl_line if is_jsonl else parse_task_line
+        tasks = []
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if line.startswith("#") or line == '':
+                # ignore comment or blank line
+                continue
+            
+            try:
+                task = parse_line(line)
+                if any(i < 0 or i >= len(tasks) for i in task["after_tasks"]):
+                    raise ValueError("only earlier tasks of the file can be referenced with #k")
+            except (ValueError, TypeError, KeyError) as e:
+                raise ValueError(f"{filepath}:{line_no}: invalid task `{line}`: {e}")
+            task["exclude_gpus"] = sorted(set(task.get("exclude_gpus", [])) | set(exclude_gpus))
+            task["preemptible"] = task["preemptible"] or preemptible
+            tasks.append(task)
         
-                cmd = items[0].split()
-                num_gpus = 1
-                if len(items) > 1:
-                    num_gpus = int(items[1])
-                
-                # submit task
-                self.submit(command=cmd, num_gpus_required=num_gpus, exclude_gpus=exclude_gpus)
+        self.submit_tasks(tasks)
+
+    def submit_sweep(self, filepath, exclude_gpus=[], preemptible=False):
+        # one sweep of a json file, "-" reads it from stdin, its points are expanded by the server
+        if filepath == "-":
+            text = sys.stdin.read()
+        else:
+            if not os.path.exists(filepath):
+                raise ValueError(f"`{filepath}` does not exit!")
+            with open(filepath, 'r') as f:
+                text = f.read()
+
+        try:
+            sweep = parse_sweep(text)
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError(f"{filepath}: invalid sweep: {e}")
+        sweep["exclude_gpus"] = sorted(set(sweep["exclude_gpus"]) | set(exclude_gpus))
+        sweep["preemptible"] = sweep["preemptible"] or preemptible
+        sweep_id = self.db.add_sweep(**sweep, owner=get_owner())
+        notify_server(NOTIFY_PATH)
+        print(f"successfully add sweep `{sweep['command']}` of {sweep['size']} points with id {sweep_id}")
+
+    def stop_sweep(self, sweep_id):
+        deleted = self.db.stop_sweep(sweep_id)
+        if deleted is None:
+            print(f"no sweep found by id {sweep_id}")
+            return
+
+        notify_server(NOTIFY_PATH)
+        print(f"successfully stop sweep id {sweep_id}, delete its {len(deleted)} queued tasks")
+
+    def sweeps(self, active=False):
+        # progress of the sweeps, their points are not listed
+        table = []
+        for sweep in self.db.list_sweeps(active):
+            table.append([sweep["id"], sweep["state"], sweep["owner"], sweep["priority"],
+                          sweep["submit_time"].strftime("%Y-%m-%d %H:%M:%S"), sweep["size"], sweep["expanded"],
+                          sweep["queued"], sweep["running"], sweep["done"], sweep["failed"], sweep["stop_reason"],
+                          sweep["command"]])
+        if len(table) > 0 or not active:
+            print(format_table(table, ["SWEEP", "STATE", "OWNER", "PRIORITY", "SUBMIT_TIME", "POINTS", "EXPANDED",
+                                       "QUEUING", "RUNNING", "DONE", "FAILED", "STOP_REASON", "COMMAND"]))
+
+    def submit_tasks(self, tasks):
+        owner = get_owner()
+        for task in tasks:
+            task["owner"] = owner
+        ids = self.db.add_tasks(tasks)
+        if ids is None:
+            print("no task to submit")
+            return
+
+        notify_server(NOTIFY_PATH)
+        print(f"successfully add {len(tasks)} tasks with id {ids[0]} to {ids[1]}")
     
-    @orm.db_session
     def delete(self, task_id):
-        task = self.db.get_task_by_id(task_id)
-        
-        if task is None:
+        state = self.db.remove_queuing_task(task_id)
+        if state is None:
             print(f"no task found by id {task_id}")
-            return
-        
-        if task.state == STATE.QUEUING:
-            self.db.remove_task(task_id)
+        elif state in (STATE.QUEUING, STATE.RETRYING):
+            # with --local, so that the server cancels the tasks depending on it
+            notify_server(NOTIFY_PATH)
             print(f"successfully delete task id {task_id}")
         else:
-            print(f"task in {STATE.get_state_str(task.state)} state can not be deleted")
+            print(f"task in {STATE.get_state_str(state)} state can not be deleted")
     
 
     def delete_all(self):
-        self.db.remove_all()
+        # the queued tasks of the user, of all users for the admins or with --local
+        deleted = self.db.remove_all()
+        notify_server(NOTIFY_PATH)
+        print(f"successfully delete {len(deleted)} queued tasks")
 
     
-    @orm.db_session
     def update_priority(self, task_id, new_priority):
-        task = self.db.get_task_by_id(task_id)
-        if task is None:
-            print(f"no task found by id {task_id}")
-            return
-        
         try:
             new_priority = int(new_priority)
         except:
@@ -77,40 +257,170 @@ class GPUTaskManagerClient(object):
             return
         
         if new_priority > 0:
-            old_priority = task.priority
-            task.priority = new_priority
+            old_priority = self.db.update_task_priority(int(task_id), new_priority)
+            if old_priority is None:
+                print(f"no task found by id {task_id}")
+                return
+
+            notify_server(NOTIFY_PATH)
             print(f"successfully update priority of task id {task_id} from {old_priority} to {new_priority}")
         else:
             print(f"priority requires positive int, but got {new_priority}")
 
-    @orm.db_session
-    def show(self, limit=None, state=[]):
-        all_tasks = []
+    def show(self, limit=None, state=[], history=False, offset=0, since=None, until=None, command=None,
+             sweep_id=None):
+        # finished tasks are read from the history only when asked for, the points of the sweeps are only listed
+        # with `sweep_id` or while they run, the sweeps going on are summed up instead
         if len(state) == 0:
-            allowed_states = [STATE.RUNNING, STATE.PENDING, STATE.QUEUING, STATE.DONE]
+            allowed_states = [STATE.RUNNING, STATE.PENDING, STATE.QUEUING, STATE.RETRYING]
+            if history:
+                allowed_states += STATE.FINISHED
         else:
             allowed_states = [STATE.get_state_from_str(s) for s in state]
 
-        for state in allowed_states:
-            tasks = self.db.find_tasks_by_state(state)
-            all_tasks.extend(tasks)
-        self.__formatted_print(all_tasks, limit)
+        tasks = self.db.list_tasks(allowed_states, limit=limit, offset=offset, since=since, until=until,
+                                   command=command, sweep_id=sweep_id, hide_sweep_points=sweep_id is None)
+        self.__formatted_print(tasks, limit)
+        if sweep_id is None:
+            self.sweeps(active=True)
+
+
+    def monitor(self, interval, limit=None, state=[]):
+        # live view of the active tasks, finished tasks are not shown
+        if len(state) == 0:
+            allowed_states = [STATE.RUNNING, STATE.PENDING, STATE.QUEUING, STATE.RETRYING]
+        else:
+            allowed_states = [STATE.get_state_from_str(s) for s in state if s not in ["done", "failed"]]
+
+        from monitor import TaskMonitor
+
+        try:
+            TaskMonitor(self.db, STATUS_PATH, allowed_states, limit).run(interval)
+        except KeyboardInterrupt:
+            sys.exit()
+
+    def watch(self):
+        # print the changes of the tasks as the server makes them, requires the running server
+        if not isinstance(self.db, RPCDatabase):
+            print("server is not running")
+            return
+
+        try:
+            for event in self.db.watch():
+                task_ids = event.get("task_ids", [])
+                details = " ".join(f"{key}={value}" for key, value in event.items()
+                                   if key not in ["event", "time", "task_ids"])
+                print(f"{event['time'].strftime('%Y-%m-%d %H:%M:%S')} {event['event']} "
+                      f"{' '.join(str(task_id) for task_id in task_ids)} {details}".rstrip(), flush=True)
+        except KeyboardInterrupt:
+            sys.exit()
+
+    def tail(self, task_id, num_lines):
+        # print the last lines of the output of the task, then follow it until the task is finished
+        task = self.db.get_task_log(task_id)
+        if task is None:
+            print(f"no task found by id {task_id}")
+            return
+
+        state, log_path = task
+        if log_path is None:
+            print(f"task {task_id} in {STATE.get_state_str(state)} state has no output yet")
+            return
+
+        from tasklog import follow_log
 
+        def is_finished():
+            task = self.db.get_task_log(task_id)
+            return task is None or task[0] in STATE.FINISHED
+
+        try:
+            for data in follow_log(log_path, num_lines, is_finished):
+                sys.stdout.buffer.write(data)
+                sys.stdout.buffer.flush()
+        except KeyboardInterrupt:
+            sys.exit()
+
+    def stats(self, task_id, num_rows):
+        # gpu time of the task, and its resource usage sampled by the server, downsampled to `num_rows` rows
+        usage = self.db.get_task_usage(task_id)
+        if usage is None:
+            print(f"no task found by id {task_id}")
+            return
+
+        import math
+        from telemetry import get_telemetry_path, read_samples, downsample, summarize
+
+        def format_time(value):
+            return value.strftime("%Y-%m-%d %H:%M:%S") if value is not None else None
+
+        state = colored(STATE.get_state_str(usage["state"]), STATE.get_state_color(usage["state"]))
+        print(f"task {usage['id']} `{usage['command']}` of {usage['owner']}, {state}")
+        print(format_table([
+            ["submit time", format_time(usage["submit_time"])],
+            ["execute time", format_time(usage["execute_time"])],
+            ["finish time", format_time(usage["finish_time"])],
+            ["gpus", usage["occupied_gpus"]],
+            ["retries", usage["num_retries"]],
+            ["gpu hours", f"{usage['gpu_time'] / 3600:.2f}"],
+        ], ["", ""]))
+
+        samples = read_samples(get_telemetry_path(TELEMETRY_DIR, task_id))
+        summary = summarize(samples)
+        if summary is None:
+            print("no telemetry sampled on this host")
+            return
+
+        def format_sample(load, gpu_memory, cpu, rss):
+            # nan if not sampled
+            values = [(load * 100, "{:.1f}%"), (gpu_memory, "{:.0f}MB"), (cpu, "{:.2f}"), (rss, "{:.0f}MB")]
+            return ["" if math.isnan(value) else fmt.format(value) for value, fmt in values]
+
+        print()
+        print(f"{summary['num_samples']} samples, mean gpu load, peak gpu memory, mean cpu cores, peak rss:")
+        table = [["all"] + format_sample(summary["gpu_load"], summary["gpu_memory"], summary["cpu"], summary["rss"])]
+        if num_rows > 0:
+            for sample in downsample(samples, math.ceil(len(samples) / num_rows)):
+                table.append([datetime.datetime.fromtimestamp(sample.time).strftime("%Y-%m-%d %H:%M:%S")] +
+                             format_sample(sample.gpu_load, sample.gpu_memory, sample.cpu, sample.rss))
+        print(format_table(table, ["TIME", "GPU_LOAD", "GPU_MEMORY", "CPU", "RSS"]))
+
+    def usage(self, since=None, until=None):
+        # gpu hours of each user over the tasks submitted between since and until
+        rows = self.db.list_user_usage(since, until)
+        total = sum(gpu_time for _, _, gpu_time in rows)
+        table = [[owner, num_tasks, f"{gpu_time / 3600:.2f}", f"{gpu_time / total * 100 if total > 0 else 0:.1f}%"]
+                 for owner, num_tasks, gpu_time in rows]
+        print(format_table(table, ["OWNER", "TASKS", "GPU_HOURS", "SHARE"]))
+
+    def events(self, task_id=None, since=None, until=None, limit=None):
+        # the first `limit` events of the server as JSON lines, of the task `task_id` if given, between since and
+        # until (utc), read from the event log through its index
+        import itertools
+        from eventlog import read_events
+
+        def to_timestamp(value):
+            return None if value is None else value.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+        events = read_events(EVENT_LOG_PATH, task_id, to_timestamp(since), to_timestamp(until),
+                             EVENT_LOG_BACKUP_COUNT)
+        for event in itertools.islice(events, limit):
+            print(json.dumps(event))
 
     def __formatted_print(self, tasks, limit):
-        headers = ["ID", "STATE", "PRIORITY", "SUBMIT_TIME", "EXECUTE_TIME", "SYSTEM_PID", 
-                    "OCCUPIED_GPUS", "EXCLUDE_GPUS", "NUM_GPUS", "COMMAND"]
+        headers = ["ID", "STATE", "OWNER", "PRIORITY", "SUBMIT_TIME", "EXECUTE_TIME", "SYSTEM_PID", 
+                    "OCCUPIED_GPUS", "EXCLUDE_GPUS", "NUM_GPUS", "EXIT_CODE", "COMMAND"]
         
         table = []
         for idx, t in enumerate(tasks):
             if limit is not None and limit == idx:
                 break
-            table.append([t.id, colored(STATE.get_state_str(t.state), STATE.get_state_color(t.state)), t.priority,
+            table.append([t.id, colored(STATE.get_state_str(t.state), STATE.get_state_color(t.state)), t.owner, t.priority,
                             t.submit_time.strftime("%Y-%m-%d %H:%M:%S") if t.submit_time is not None else None, 
                             t.execute_time.strftime("%Y-%m-%d %H:%M:%S") if t.execute_time is not None else None, 
-                            t.system_pid, t.occupied_gpus, t.exclude_gpus, t.num_gpus_required, t.command])
+                            t.system_pid, t.occupied_gpus, t.exclude_gpus, t.num_gpus_required, t.exit_code,
+                            t.command])
         
-        print(tabulate(table, headers=headers))
+        print(format_table(table, headers))
 
 
 if __name__ == "__main__":
@@ -119,9 +429,31 @@ if __name__ == "__main__":
     parser.add_argument("--loop", "-l", type=int, default=None)
     parser.add_argument("--limit", "-m", type=int, default=None)
     parser.add_argument("--state", "-s", nargs='+', default=[])
+    parser.add_argument("--history", action="store_true")
+    parser.add_argument("--offset", type=int, default=0)
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, default=None)
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, default=None)
+    parser.add_argument("--grep", "-g", type=str, default=None)
+    # sweeps: progress of all of them, the tasks of one of them
+    parser.add_argument("--sweeps", action="store_true")
+    parser.add_argument("--sweep-id", type=int, default=None)
+    parser.add_argument("--watch", "-w", action="store_true")
+    # output of a task
+    parser.add_argument("--tail", type=int, default=None)
+    parser.add_argument("--lines", type=int, default=10)
+    # accounting: gpu time and sampled resource usage of a task, gpu hours of each user
+    parser.add_argument("--stats", type=int, default=None)
+    parser.add_argument("--usage", action="store_true")
+    # events of the server, of a task if an id is given, filtered by --since and --until
+    parser.add_argument("--events", type=int, nargs="?", const=0, default=None)
+    # open task.db directly instead of asking the running server
+    parser.add_argument("--local", action="store_true")
+    parser.add_argument("--rpc-path", type=str, default=RPC_PATH)
+    parser.add_argument("--db-path", type=str, default="task.db")
     
     # delete
     parser.add_argument("--delete", "-d", type=int, default=None)
+    parser.add_argument("--stop-sweep", type=int, default=None)
     parser.add_argument("--delete-all", action="store_true")
 
     # update priority
@@ -130,37 +462,68 @@ if __name__ == "__main__":
     # command line
     parser.add_argument("--command", "-c", nargs="+", default=None)
     parser.add_argument("--num-gpus", "-n", type=int, default=1)
+    parser.add_argument("--runtime", "-t", type=int, default=None)
+    parser.add_argument("--memory", "-M", type=int, default=None)
+    parser.add_argument("--after", "-a", nargs="+", type=int, default=[])
+    # the task may be stopped for tasks of higher priority and run again later
+    parser.add_argument("--preemptible", action="store_true")
     # file
     parser.add_argument("--file-path", "-f", type=str, default=None)
+    # json file of a sweep, expanded into tasks by the server
+    parser.add_argument("--sweep", type=str, default=None)
+    parser.add_argument("--jsonl", action="store_true")
     parser.add_argument("--exclude-gpus", "-e", nargs="*", type=int, default=[])
 
     args = parser.parse_args()
 
-    client = GPUTaskManagerClient(get_database())
-
-    if args.command is not None:
-        client.submit(args.command, args.num_gpus, args.exclude_gpus)
-    elif args.file_path is not None:
-        client.submit_from_file(args.file_path, args.exclude_gpus)
-    elif args.delete is not None:
-        client.delete(args.delete)
-    elif args.delete_all:
-        client.delete_all()
-    elif args.update_priority is not None:
-        if len(args.update_priority) > 0 and len(args.update_priority) % 2 == 0:
-            for i in range(len(args.update_priority) // 2):
-                task_id = args.update_priority[2 * i]
-                priority = args.update_priority[2 * i + 1]
-                client.update_priority(task_id, priority)
-        else:
-            print("update priority with key value pairs: task_id_1 new_priority_1 task_id_2 new_priority_2 ...")
-    elif args.loop is not None:
-        while True:
-            try:
-                os.system('clear')
-                client.show(args.limit, args.state)
-                time.sleep(args.loop)
-            except KeyboardInterrupt:
-                sys.exit()
+    rpc_client = None if args.local else connect_server(args.rpc_path)
+    if rpc_client is not None:
+        database = RPCDatabase(rpc_client)
     else:
-        client.show(args.limit, args.state)
+        from database import get_database
+        database = get_database(args.db_path)
+    client = GPUTaskManagerClient(database)
+
+    # invalid tasks and the errors sent back by the server are shown without traceback
+    try:
+        if args.command is not None:
+            client.submit(args.command, args.num_gpus, args.exclude_gpus, args.runtime, args.memory, args.after,
+                          args.preemptible)
+        elif args.file_path is not None:
+            client.submit_from_file(args.file_path, args.exclude_gpus, args.jsonl, args.preemptible)
+        elif args.sweep is not None:
+            client.submit_sweep(args.sweep, args.exclude_gpus, args.preemptible)
+        elif args.delete is not None:
+            client.delete(args.delete)
+        elif args.delete_all:
+            client.delete_all()
+        elif args.stop_sweep is not None:
+            client.stop_sweep(args.stop_sweep)
+        elif args.update_priority is not None:
+            if len(args.update_priority) > 0 and len(args.update_priority) % 2 == 0:
+                for i in range(len(args.update_priority) // 2):
+                    task_id = args.update_priority[2 * i]
+                    priority = args.update_priority[2 * i + 1]
+                    client.update_priority(task_id, priority)
+            else:
+                print("update priority with key value pairs: task_id_1 new_priority_1 task_id_2 new_priority_2 ...")
+        elif args.watch:
+            client.watch()
+        elif args.tail is not None:
+            client.tail(args.tail, args.lines)
+        elif args.stats is not None:
+            client.stats(args.stats, args.lines)
+        elif args.usage:
+            client.usage(args.since, args.until)
+        elif args.events is not None:
+            client.events(args.events or None, args.since, args.until, args.limit)
+        elif args.sweeps:
+            client.sweeps()
+        elif args.loop is not None:
+            client.monitor(args.loop, args.limit, args.state)
+        else:
+            client.show(args.limit, args.state, args.history, args.offset, args.since, args.until, args.grep,
+                        args.sweep_id)
+    except (ValueError, RPCError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,583 @@
+import os
+import hmac
+import json
+import time
+import socket
+import signal
+import asyncio
+import hashlib
+import secrets
+import argparse
+
+from config import *
+from constant import *
+
+from devices import FakeDeviceProvider, get_device_provider
+from retry import FAILURE_LOST
+from rpc import encode, decode
+from scheduler import Job, first_fit
+from server import GPUManager, GPUTaskManagerServer, write_status
+from util import get_logger
+
+
+# Cluster mode: a coordinator holds the global queue in its task.db and assigns tasks to the agents of the
+# hosts, which run them on their local gpus. Agents connect to the coordinator over tcp and exchange one
+# json object per line:
+# - agent to coordinator: register (with the signed challenge), heartbeat (free gpus and memory, running tasks),
+#   started, exited (exit code and error), failed
+# - coordinator to agent: challenge (a nonce the agent signs with the shared secret), run, signal (forwarded to a
+#   running task, e.g. to preempt it)
+# the coordinator is a `GPUTaskManagerServer` with a `ClusterManager` in place of the local `GPUManager`
+
+# gpu i of the n-th registered host has the global id n * HOST_GPU_STRIDE + i, e.g. 103 is gpu 3 of host 1
+HOST_GPU_STRIDE = 100
+# exit code of the tasks of a lost agent
+LOST_EXIT_CODE = -1
+
+
+def read_secret(path):
+    # the secret shared by the coordinator and the agents, see CLUSTER_SECRET_PATH
+    try:
+        with open(path, 'r') as f:
+            secret = f.read().strip()
+    except OSError as e:
+        raise ValueError(f"cluster mode requires a shared secret in {path}: {e}")
+    if len(secret) == 0:
+        raise ValueError(f"cluster mode requires a shared secret in {path}, it is empty")
+    return secret
+
+
+def sign(secret, nonce):
+    # proves that an agent knows the secret without sending it
+    return hmac.new(secret.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+
+def best_fit_host(job, free_gpus, free_memory):
+    # all gpus of a task are on one host, choose the host left with the fewest free gpus, or the least free
+    # memory on the chosen gpus for tasks declaring their memory, so that large holes stay free for large tasks
+    best = None
+    hosts = sorted(set(gpu // HOST_GPU_STRIDE for gpu in list(free_gpus) + list(free_memory)))
+    for host in hosts:
+        host_gpus = [gpu for gpu in free_gpus if gpu // HOST_GPU_STRIDE == host]
+        host_memory = {gpu: memory for gpu, memory in free_memory.items() if gpu // HOST_GPU_STRIDE == host}
+        gpu_ids = first_fit(job, host_gpus, host_memory)
+        if gpu_ids is None:
+            continue
+
+        if job.memory is None:
+            left = len(host_gpus) - len(gpu_ids)
+        else:
+            left = sum(host_memory[gpu] - job.memory for gpu in gpu_ids)
+        if best is None or left < best[0]:
+            best = (left, gpu_ids)
+
+    return None if best is None else best[1]
+
+
+class RemoteProcess(object):
+    # a task run by an agent, in place of the local asyncio subprocess
+    def __init__(self, host, task_id, gpu_ids, memory):
+        self.host = host
+        self.task_id = task_id
+        self.gpu_ids = gpu_ids
+        self.memory = memory
+        self.pid = None
+        self.start_time = None
+        # on the host of the agent
+        self.log_path = None
+        self.returncode = None
+        # error reported by the launcher on the agent, or FAILURE_LOST
+        self.error = None
+        self.started = asyncio.get_running_loop().create_future()
+        self.exited = asyncio.Event()
+
+    async def wait(self):
+        await self.exited.wait()
+        return self.returncode
+
+    def set_exited(self, exit_code, error=None):
+        if not self.started.done():
+            self.started.set_exception(OSError(f"the agent of task {self.task_id} is lost"))
+            # not retrieved by launch once the server is stopping
+            self.started.exception()
+        self.returncode = exit_code
+        self.error = error
+        self.exited.set()
+
+
+class HostState(object):
+    # last heartbeat of an agent and the tasks assigned to it
+    def __init__(self, name, index, gpus, writer):
+        self.name = name
+        self.index = index
+        self.gpus = gpus
+        self.writer = writer
+        self.free_gpus = []
+        self.free_memory = {}
+        self.running_task_ids = set()
+        self.status = []
+        self.last_heartbeat = time.time()
+        # task id -> RemoteProcess
+        self.processes = {}
+
+    def to_global(self, gpu):
+        return self.index * HOST_GPU_STRIDE + gpu
+
+    def get_starting_processes(self):
+        # assigned tasks that the agent did not report yet, their gpus may still be reported free
+        return [p for p in self.processes.values() if p.task_id not in self.running_task_ids]
+
+
+class ClusterManager(object):
+    # the gpus of all agents for the coordinator, with the interface of `GPUManager`
+    # agents are accepted on `host`:`port` once they signed the challenge with `secret`
+    # the tasks of an agent which disconnected or missed its heartbeats are lost if it does not report them
+    # running within `reconnect_grace` seconds
+    def __init__(self, logger, secret, host=CLUSTER_HOST, port=CLUSTER_PORT, heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                 reconnect_grace=CLUSTER_RECONNECT_GRACE, on_change=None, status_path=None):
+        self.logger = logger
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_grace = reconnect_grace
+        self.on_change = on_change
+        self.status_path = status_path
+        self.last_status = None
+
+        self.hosts = {}
+        # task id -> (RemoteProcess, time it is lost) of the tasks running before a restart of the coordinator or on
+        # a disconnected agent, until an agent reports them
+        self.orphans = {}
+        self.start_time = time.time()
+        # host name -> index, kept when an agent reconnects so that its gpus keep their ids
+        self.host_indices = {}
+        self.is_started = False
+
+    def start(self):
+        self.is_started = True
+        self.__write_status()
+
+    def stop(self):
+        # running tasks are left running, the agents report them to the next coordinator
+        for host in list(self.hosts.values()):
+            host.writer.close()
+        self.hosts = {}
+        if self.is_started and self.status_path is not None and os.path.exists(self.status_path):
+            os.remove(self.status_path)
+
+    async def sample_loop(self):
+        # accept agents and drop the ones whose heartbeats stopped
+        server = await asyncio.start_server(self.__serve_agent, host=self.host, port=self.port)
+        self.logger.info(f"listen for agents on {self.host}:{self.port}")
+        try:
+            while True:
+                await asyncio.sleep(min(self.heartbeat_timeout, self.reconnect_grace) / 4)
+                now = time.time()
+                for task_id, (process, lost_time) in list(self.orphans.items()):
+                    if now > lost_time:
+                        self.logger.error(f"task {task_id} is lost, no agent reported it")
+                        del self.orphans[task_id]
+                        process.set_exited(LOST_EXIT_CODE, FAILURE_LOST)
+
+                for host in list(self.hosts.values()):
+                    if now - host.last_heartbeat > self.heartbeat_timeout:
+                        self.logger.error(f"agent {host.name} missed its heartbeats for {self.heartbeat_timeout}s")
+                        self.__disconnect_host(host)
+        finally:
+            server.close()
+
+    async def telemetry_loop(self):
+        # the tasks are sampled by the agents, in TELEMETRY_DIR of their hosts
+        pass
+
+    @property
+    def all_gpus(self):
+        return sorted(host.to_global(gpu) for host in self.hosts.values() for gpu in host.gpus)
+
+    def load_topology(self):
+        # tasks are placed on the gpus of a single host by `best_fit_host`
+        pass
+
+    def get_placement(self):
+        return best_fit_host
+
+    def get_available_gpus(self):
+        free_gpus = []
+        for host in self.hosts.values():
+            starting_gpus = set(gpu for p in host.get_starting_processes() for gpu in p.gpu_ids)
+            free_gpus += [host.to_global(gpu) for gpu in host.free_gpus if gpu not in starting_gpus]
+        return sorted(free_gpus)
+
+    def get_free_memory(self):
+        free_memory = {}
+        for host in self.hosts.values():
+            host_memory = dict(host.free_memory)
+            for process in host.get_starting_processes():
+                for gpu in process.gpu_ids:
+                    if process.memory is None:
+                        host_memory.pop(gpu, None)
+                    elif gpu in host_memory:
+                        host_memory[gpu] -= process.memory
+            free_memory.update({host.to_global(gpu): memory for gpu, memory in host_memory.items()})
+        return free_memory
+
+    async def launch(self, job, command, gpu_ids):
+        # ask the agent of the gpus to run the task, return once it is started
+        host = [h for h in self.hosts.values() if h.index == gpu_ids[0] // HOST_GPU_STRIDE][0]
+        local_gpu_ids = [gpu % HOST_GPU_STRIDE for gpu in gpu_ids]
+        process = RemoteProcess(host, job.id, local_gpu_ids, job.memory)
+        host.processes[job.id] = process
+        self.__send(host, {"type": "run", "task_id": job.id, "command": command, "gpu_ids": local_gpu_ids,
+                           "memory": job.memory})
+
+        try:
+            await process.started
+        except OSError:
+            host.processes.pop(job.id, None)
+            raise
+        self.logger.info(f"task {job.id} started on {host.name} gpus {local_gpu_ids} with pid {process.pid}")
+        return process
+
+    def adopt(self, job, pid, start_time):
+        # a task started before the coordinator restarted, claimed by the agent which reports it running,
+        # lost if no agent reports it within the heartbeat timeout
+        process = RemoteProcess(None, job.id, [gpu % HOST_GPU_STRIDE for gpu in job.gpu_ids], job.memory)
+        process.pid = pid
+        process.start_time = start_time
+        process.started.set_result(pid)
+        self.orphans[job.id] = (process, self.start_time + self.heartbeat_timeout)
+        return process
+
+    def read_exit_status(self, task_id):
+        # only adopted tasks are recovered in cluster mode
+        return None
+
+    def remove_exit_status(self, task_id):
+        # the status files are on the hosts of the agents, removed once the exit is read
+        pass
+
+    def read_exit(self, process, exit_code):
+        # as reported by the agent
+        return exit_code, process.error
+
+    def send_signal(self, process, signum):
+        # adopted tasks not claimed by an agent yet are left running
+        if process.host is not None:
+            self.__send(process.host, {"type": "signal", "task_id": process.task_id, "signal": int(signum)})
+
+    def get_domain(self, gpu):
+        # tasks run on the gpus of a single host
+        return gpu // HOST_GPU_STRIDE
+
+    def update_gpu_process(self, gpu_ids, process, task_id=None, memory=None):
+        # already recorded by launch
+        pass
+
+    def release_gpus(self, process):
+        if process.host is not None:
+            process.host.processes.pop(process.task_id, None)
+        self.__write_status()
+
+    async def __serve_agent(self, reader, writer):
+        # the first message must be the registration signed with the secret
+        host = None
+        nonce = secrets.token_hex(16)
+        try:
+            writer.write(encode({"type": "challenge", "nonce": nonce}))
+            while True:
+                line = await reader.readline()
+                if line == b'':
+                    break
+
+                message = decode(line)
+                if host is not None:
+                    self.__handle_message(host, message)
+                elif message["type"] == "register" and hmac.compare_digest(str(message.get("auth")),
+                                                                           sign(self.secret, nonce)):
+                    host = self.__add_host(message["host"], message["gpus"], writer)
+                else:
+                    peer = writer.get_extra_info("peername")
+                    self.logger.error(f"reject connection from {peer}: not registered with the cluster secret")
+                    break
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.error(f"connection of agent {host.name if host else '?'} failed: {e}")
+        finally:
+            if host is not None and self.hosts.get(host.name) is host:
+                self.logger.error(f"agent {host.name} disconnected")
+                self.__disconnect_host(host)
+            writer.close()
+
+    def __handle_message(self, host, message):
+        if message["type"] == "heartbeat":
+            host.last_heartbeat = time.time()
+            before = (host.free_gpus, host.free_memory)
+            host.free_gpus = message["free_gpus"]
+            host.free_memory = {int(gpu): memory for gpu, memory in message["free_memory"].items()}
+            host.running_task_ids = set(message["running"])
+            for task_id in host.running_task_ids & set(self.orphans.keys()):
+                self.__claim(host, task_id)
+            for task_id in host.running_task_ids - set(host.processes.keys()):
+                # e.g. lost after the grace period and queued again, it must not run twice
+                self.logger.error(f"task {task_id} is not assigned to {host.name} anymore, stop it")
+                self.__send(host, {"type": "signal", "task_id": task_id, "signal": int(signal.SIGTERM)})
+            host.status = message["status"]
+            if before != (host.free_gpus, host.free_memory):
+                self.__notify_change()
+            self.__write_status()
+        elif message["type"] == "started":
+            if message["task_id"] in self.orphans:
+                # started before the agent disconnected
+                self.__claim(host, message["task_id"])
+            process = host.processes.get(message["task_id"])
+            if process is not None and not process.started.done():
+                process.pid = message["pid"]
+                process.start_time = message["start_time"]
+                process.log_path = message.get("log_path")
+                process.started.set_result(process.pid)
+        elif message["type"] == "failed":
+            process = host.processes.pop(message["task_id"], None)
+            if process is not None and not process.started.done():
+                process.started.set_exception(OSError(message["error"]))
+        elif message["type"] == "exited":
+            process = host.processes.get(message["task_id"])
+            if process is None and message["task_id"] in self.orphans:
+                process, _ = self.orphans.pop(message["task_id"])
+            if process is not None:
+                process.set_exited(message["exit_code"], message.get("error"))
+
+    def __add_host(self, name, gpus, writer):
+        if name in self.hosts:
+            self.logger.error(f"agent {name} registered again")
+            self.__disconnect_host(self.hosts[name])
+
+        if name not in self.host_indices:
+            self.host_indices[name] = len(self.host_indices)
+        host = HostState(name, self.host_indices[name], gpus, writer)
+        self.hosts[name] = host
+        self.logger.info(f"agent {name} registered with gpus {[host.to_global(gpu) for gpu in gpus]}")
+        return host
+
+    def __disconnect_host(self, host):
+        # the tasks of the host wait for the agent to reconnect and report them, they are reported as exited with
+        # LOST_EXIT_CODE after the grace period, like the tasks adopted after a restart
+        del self.hosts[host.name]
+        host.writer.close()
+        lost_time = time.time() + self.reconnect_grace
+        for process in host.processes.values():
+            self.logger.error(f"task {process.task_id} is lost with agent {host.name} "
+                              f"unless it reconnects within {self.reconnect_grace}s")
+            process.host = None
+            self.orphans[process.task_id] = (process, lost_time)
+        host.processes = {}
+        self.__notify_change()
+        self.__write_status()
+
+    def __claim(self, host, task_id):
+        # an orphaned task reported by the agent of `host`
+        process, _ = self.orphans.pop(task_id)
+        process.host = host
+        host.processes[task_id] = process
+        self.logger.info(f"task {task_id} is still running on {host.name}")
+
+    def __notify_change(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def __send(self, host, message):
+        try:
+            host.writer.write(encode(message))
+        except OSError as e:
+            self.logger.error(f"failed to send to agent {host.name}: {e}")
+
+    def __write_status(self):
+        if self.status_path is None or not self.is_started:
+            return
+
+        gpus = []
+        for host in sorted(self.hosts.values(), key=lambda h: h.index):
+            for gpu in host.status:
+                gpus.append(dict(gpu, id=host.to_global(gpu["id"]), host=host.name))
+        status = json.dumps({"pid": os.getpid(), "gpus": gpus})
+        if status != self.last_status:
+            write_status(self.status_path, status)
+            self.last_status = status
+
+
+class ClusterAgent(object):
+    # runs the tasks assigned by the coordinator on the local gpus of a `GPUManager`, and reports the free
+    # gpus every `heartbeat_interval` seconds and as soon as they change
+    def __init__(self, name, coordinator_address, gpu_manager, logger, secret, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.name = name
+        self.coordinator_address = coordinator_address
+        self.secret = secret
+        self.gpu_manager = gpu_manager
+        self.logger = logger
+        self.heartbeat_interval = heartbeat_interval
+
+        self.writer = None
+        self.heartbeat_event = None
+        # task id -> process
+        self.running = {}
+        # task id -> (exit code, error) of the tasks which exited while disconnected from the coordinator
+        self.unreported_exits = {}
+        self.is_stop_requested = False
+
+    def start(self):
+        asyncio.run(self.__run())
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        self.heartbeat_event = asyncio.Event()
+        self.gpu_manager.on_change = lambda: loop.call_soon_threadsafe(self.heartbeat_event.set)
+        stop_event = asyncio.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(sig, stop_event.set)
+
+        self.gpu_manager.start()
+        sampler = asyncio.create_task(self.gpu_manager.sample_loop())
+        telemetry = asyncio.create_task(self.gpu_manager.telemetry_loop())
+        connection = asyncio.create_task(self.__connect_loop())
+        await stop_event.wait()
+
+        # running tasks are left running, the coordinator reports them as lost once its grace period is over
+        self.logger.info("stop requested")
+        for task in [sampler, telemetry, connection]:
+            task.cancel()
+        self.gpu_manager.stop()
+
+    async def __connect_loop(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*self.coordinator_address)
+            except OSError as e:
+                self.logger.error(f"failed to connect to the coordinator: {e}")
+                await asyncio.sleep(self.heartbeat_interval)
+                continue
+
+            heartbeat = None
+            try:
+                challenge = decode(await reader.readline())
+                writer.write(encode({"type": "register", "host": self.name, "gpus": self.gpu_manager.all_gpus,
+                                     "auth": sign(self.secret, challenge["nonce"])}))
+                # messages of the tasks are only sent once registered
+                self.writer = writer
+                self.logger.info(f"connected to the coordinator {self.coordinator_address[0]}:"
+                                 f"{self.coordinator_address[1]}")
+                for task_id, (exit_code, error) in self.unreported_exits.items():
+                    self.__send({"type": "exited", "task_id": task_id, "exit_code": exit_code, "error": error})
+                self.unreported_exits = {}
+                # the coordinator adopts them again, also the ones it did not know started
+                for task_id, process in self.running.items():
+                    self.__send({"type": "started", "task_id": task_id, "pid": process.pid,
+                                 "start_time": process.start_time, "log_path": process.log_path})
+                heartbeat = asyncio.create_task(self.__heartbeat_loop())
+                while True:
+                    line = await reader.readline()
+                    if line == b'':
+                        break
+                    message = decode(line)
+                    if message["type"] == "run":
+                        asyncio.create_task(self.__run_task(message))
+                    elif message["type"] == "signal" and message["task_id"] in self.running:
+                        self.logger.info(f"send signal {message['signal']} to task {message['task_id']}")
+                        self.gpu_manager.send_signal(self.running[message["task_id"]], message["signal"])
+            except (OSError, ValueError, KeyError) as e:
+                self.logger.error(f"connection to the coordinator failed: {e}")
+            finally:
+                if heartbeat is not None:
+                    heartbeat.cancel()
+                writer.close()
+                self.writer = None
+
+            self.logger.error("disconnected from the coordinator")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def __heartbeat_loop(self):
+        while True:
+            self.heartbeat_event.clear()
+            self.__send({
+                "type": "heartbeat",
+                "free_gpus": self.gpu_manager.get_available_gpus(),
+                "free_memory": self.gpu_manager.get_free_memory(),
+                "running": list(self.running.keys()),
+                "status": self.gpu_manager.get_status(),
+            })
+            try:
+                await asyncio.wait_for(self.heartbeat_event.wait(), self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __run_task(self, message):
+        task_id, command, gpu_ids = message["task_id"], message["command"], message["gpu_ids"]
+        job = Job(task_id, len(gpu_ids), [], memory=message["memory"])
+        self.logger.info(f"run task {task_id} `{command}` on gpus {gpu_ids}")
+        try:
+            process = await self.gpu_manager.launch(job, command, gpu_ids)
+            self.gpu_manager.update_gpu_process(gpu_ids, process, task_id, job.memory)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"failed to run task {task_id}: {e}")
+            self.__send({"type": "failed", "task_id": task_id, "error": f"{type(e).__name__}: {e}"})
+            return
+
+        self.running[task_id] = process
+        self.__send({"type": "started", "task_id": task_id, "pid": process.pid, "start_time": process.start_time,
+                     "log_path": process.log_path})
+        self.heartbeat_event.set()
+
+        exit_code, error = self.gpu_manager.read_exit(process, await process.wait())
+        # sent from memory, also after a reconnection, see `unreported_exits`
+        self.gpu_manager.remove_exit_status(task_id)
+        self.logger.info(f"task {task_id} is done with exit code {exit_code}")
+        del self.running[task_id]
+        self.gpu_manager.release_gpus(process)
+        if self.writer is None:
+            self.unreported_exits[task_id] = (exit_code, error)
+        self.__send({"type": "exited", "task_id": task_id, "exit_code": exit_code, "error": error})
+        self.heartbeat_event.set()
+
+    def __send(self, message):
+        # dropped while disconnected, the coordinator reports the tasks as lost
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(encode(message))
+        except OSError as e:
+            self.logger.error(f"failed to send to the coordinator: {e}")
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "localhost", int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("GPU Task Manager Cluster")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    parser_coordinator = subparsers.add_parser("coordinator", help="global queue, started in place of the server")
+    parser_coordinator.add_argument("--host", type=str, default=CLUSTER_HOST, help="address to listen on for agents")
+    parser_coordinator.add_argument("--port", type=int, default=CLUSTER_PORT)
+
+    parser_agent = subparsers.add_parser("agent", help="runs tasks on the gpus of this host")
+    parser_agent.add_argument("--coordinator", type=str, default=f"localhost:{CLUSTER_PORT}", help="host:port")
+    parser_agent.add_argument("--name", type=str, default=socket.gethostname())
+    parser_agent.add_argument("--fake-gpus", type=int, default=0, help="simulate this number of gpus")
+
+    args = parser.parse_args()
+    secret = read_secret(CLUSTER_SECRET_PATH)
+
+    if args.mode == "coordinator":
+        from database import get_database
+
+        logger = get_logger(LOG_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN)
+        cluster_manager = ClusterManager(logger, secret, args.host, args.port, status_path=STATUS_PATH)
+        GPUTaskManagerServer(get_database(), logger, cluster_manager).start()
+    else:
+        logger = get_logger(os.path.join(os.path.dirname(LOG_PATH), f"agent_{args.name}.log"), LOG_MAX_BYTES,
+                            LOG_BACKUP_COUNT, LOG_ROTATE_WHEN)
+        if args.fake_gpus > 0:
+            provider = FakeDeviceProvider(args.fake_gpus)
+        else:
+            provider = get_device_provider(GPU_BACKEND, NUM_FAKE_GPUS, logger)
+        ClusterAgent(args.name, parse_address(args.coordinator), GPUManager(logger, provider), logger, secret).start()
@@ -3,3 +3,100 @@ import os
 
 DELAY = 60
 LOG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs", "server.log")
+# the log is written by a background thread, rotated every LOG_ROTATE_WHEN (e.g. "midnight") if set, otherwise at
+# LOG_MAX_BYTES, into LOG_BACKUP_COUNT backups
+LOG_MAX_BYTES = 100 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_ROTATE_WHEN = None
+# structured events of the tasks (submitted, launched, done...) as JSON lines with a sidecar index, read by
+# `client.py --events`, rotated at EVENT_LOG_MAX_BYTES into EVENT_LOG_BACKUP_COUNT backups
+EVENT_LOG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs", "events.jsonl")
+EVENT_LOG_MAX_BYTES = 100 * 1024 * 1024
+EVENT_LOG_BACKUP_COUNT = 5
+# unix datagram socket used by clients to wake up the server, lives next to task.db
+NOTIFY_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "server.sock")
+# unix stream socket of the local api of the running server, used by the client instead of task.db
+RPC_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "server_rpc.sock")
+# exit codes of the tasks written by launcher.py, read by the server for tasks it adopted after a restart
+TASK_STATUS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs", "tasks")
+# output of the tasks, TASK_LOG_DIR/<id>.log rotated at TASK_LOG_MAX_BYTES into TASK_LOG_BACKUP_COUNT backups,
+# gzipped if TASK_LOG_COMPRESS
+TASK_LOG_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs", "tasks")
+TASK_LOG_MAX_BYTES = 100 * 1024 * 1024
+TASK_LOG_BACKUP_COUNT = 3
+TASK_LOG_COMPRESS = True
+# resource usage of the running tasks sampled every TELEMETRY_INTERVAL seconds (None to disable) into
+# TELEMETRY_DIR/<id>.bin, downsampled by 2 once a task has 2 * TELEMETRY_MAX_SAMPLES samples
+TELEMETRY_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs", "telemetry")
+TELEMETRY_INTERVAL = 10
+TELEMETRY_MAX_SAMPLES = 4096
+# gpu occupancy published by the server for the client
+STATUS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "server_status.json")
+# scheduling policy: "backfill" (EASY backfilling) or "fifo" (strict queue order)
+SCHEDULER = "backfill"
+# runtime in seconds assumed for tasks submitted without an estimate
+DEFAULT_ESTIMATED_RUNTIME = 24 * 3600
+# gpu probe backend: "nvml" (libnvidia-ml in-process, falls back to gputil), "gputil" (nvidia-smi)
+# or "fake" (NUM_FAKE_GPUS simulated idle devices)
+GPU_BACKEND = "nvml"
+NUM_FAKE_GPUS = 8
+# seconds between two background samples of the gpus, and minimum seconds between two probes
+GPU_SAMPLE_INTERVAL = 5
+GPU_MIN_PROBE_INTERVAL = 1
+# saved output of `nvidia-smi topo -m` used for multi-gpu placement, None to query it when the server starts with
+# the nvml backend
+GPU_TOPOLOGY_PATH = None
+# failed tasks run at most RETRY_MAX_ATTEMPTS times, the first retry waits RETRY_BACKOFF seconds, doubled at each
+# retry up to RETRY_MAX_BACKOFF, and at most RETRY_MAX_PER_MINUTE retries start per minute
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 30
+RETRY_MAX_BACKOFF = 3600
+RETRY_MAX_PER_MINUTE = 10
+# retry of the tasks out of gpu memory: "more_gpus" (twice the gpus), "exclude_gpus" (avoid the gpus they failed on)
+# or None (unchanged), tasks which shared their gpus are first retried on whole gpus
+RETRY_ON_OOM = "exclude_gpus"
+# fair share between the users: the queue is ordered by priority, then by the gpu time used by each user,
+# decayed with a half life of FAIR_SHARE_HALF_LIFE seconds and divided by their share in USER_SHARES (default 1),
+# users run at most their gpus in USER_GPU_QUOTAS (DEFAULT_GPU_QUOTA by default, None for no limit)
+FAIR_SHARE = True
+FAIR_SHARE_HALF_LIFE = 7 * 24 * 3600
+USER_SHARES = {}
+USER_GPU_QUOTAS = {}
+DEFAULT_GPU_QUOTA = None
+# users who change the tasks and sweeps of all users through the server and give tasks a priority above the default
+# one (100), the other users only change their own ones
+ADMIN_USERS = ["root"]
+# tasks of priority at most PREEMPT_PRIORITY which do not fit stop preemptible tasks of a lower priority:
+# they receive PREEMPT_SIGNAL to checkpoint, SIGTERM after PREEMPT_GRACE_PERIOD seconds, SIGKILL after another
+# PREEMPT_GRACE_PERIOD seconds, and are queued again
+PREEMPTION = False
+PREEMPT_PRIORITY = 10
+PREEMPT_SIGNAL = "SIGUSR1"
+PREEMPT_GRACE_PERIOD = 60
+# metrics of the server in the Prometheus format at http://METRICS_HOST:METRICS_PORT/metrics, None to disable
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+# on PROFILE_SIGNAL the server profiles the next PROFILE_TICKS scheduling passes with cProfile, the stats are
+# dumped to PROFILE_DIR/server-<pid>-<time>.prof
+PROFILE_SIGNAL = "SIGUSR2"
+PROFILE_TICKS = 100
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs", "profile")
+# milliseconds to wait for a lock on task.db before failing
+DB_BUSY_TIMEOUT = 10000
+# seconds between two attempts to write the task changes which failed because task.db was locked, and the number of
+# attempts when the server stops
+DB_RETRY_DELAY = 1
+DB_STOP_RETRIES = 10
+# days to keep finished tasks in the history, None to keep them forever
+HISTORY_RETENTION_DAYS = None
+# seconds between two compactions of task.db, run while the server is idle
+COMPACTION_INTERVAL = 24 * 3600
+# cluster mode: address the coordinator listens on for agents, file of the secret shared by the coordinator and the
+# agents (required), seconds between two heartbeats of an agent, seconds without heartbeat after which an agent is
+# disconnected, and seconds a disconnected agent has to reconnect before its running tasks are considered lost
+CLUSTER_HOST = "127.0.0.1"
+CLUSTER_PORT = 7710
+CLUSTER_SECRET_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cluster.secret")
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 20
+CLUSTER_RECONNECT_GRACE = 120
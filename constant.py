@@ -3,6 +3,13 @@ class STATE:
     PENDING = 1
     QUEUING = 2
     DONE = 3
+    # finished with an error and not retried anymore
+    FAILED = 4
+    # failed, waiting for its backoff before it is queued again
+    RETRYING = 5
+
+    # states of the tasks moved to the history
+    FINISHED = [DONE, FAILED]
 
     @staticmethod
     def get_state_str(state):
@@ -12,6 +19,10 @@ class STATE:
             return "pending"
         elif state == STATE.QUEUING:
             return "queuing"
+        elif state == STATE.FAILED:
+            return "failed"
+        elif state == STATE.RETRYING:
+            return "retrying"
         else:
             return "done"
     
@@ -25,6 +36,10 @@ class STATE:
             return STATE.QUEUING
         elif state_str == "done":
             return STATE.DONE
+        elif state_str == "failed":
+            return STATE.FAILED
+        elif state_str == "retrying":
+            return STATE.RETRYING
         else:
             raise ValueError(f"Unknown state: {state_str}")
     
@@ -36,6 +51,10 @@ class STATE:
             color = "cyan"
         elif state == STATE.PENDING:
             color = "yellow"
+        elif state == STATE.RETRYING:
+            color = "blue"
+        elif state == STATE.FAILED:
+            color = "magenta"
         else:
             color = "red"
         
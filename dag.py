@@ -0,0 +1,57 @@
+# Dependencies between tasks: a task submitted with `after` ids is blocked until all of them are done, and
+# can never run once one of them failed or was deleted
+# the graph only holds the edges from unfinished tasks to the blocked tasks waiting for them, finishing a task
+# visits its own edges only
+
+
+class DependencyGraph(object):
+    def __init__(self):
+        # blocked task id -> ids of its unfinished parents
+        self.parents = {}
+        # task id -> ids of the blocked tasks waiting for it
+        self.children = {}
+
+    def add(self, task_id, unfinished_parents):
+        # `unfinished_parents` are the parents which are not done yet
+        if len(unfinished_parents) == 0:
+            return
+
+        self.parents[task_id] = set(unfinished_parents)
+        for parent in unfinished_parents:
+            self.children.setdefault(parent, set()).add(task_id)
+
+    def is_blocked(self, task_id):
+        return task_id in self.parents
+
+    def set_done(self, task_id):
+        # return the tasks which are not blocked anymore
+        ready = []
+        for child in self.children.pop(task_id, ()):
+            parents = self.parents[child]
+            parents.discard(task_id)
+            if len(parents) == 0:
+                del self.parents[child]
+                ready.append(child)
+        return ready
+
+    def set_failed(self, task_id):
+        # return the tasks blocked by `task_id` directly or not, removed from the graph since they can never run
+        self.__remove_parents(task_id)
+        cancelled = []
+        stack = [task_id]
+        while len(stack) > 0:
+            for child in self.children.pop(stack.pop(), ()):
+                # a child with several failed parents is reached more than once
+                if child in self.parents:
+                    self.__remove_parents(child)
+                    cancelled.append(child)
+                    stack.append(child)
+        return cancelled
+
+    def __remove_parents(self, task_id):
+        for parent in self.parents.pop(task_id, ()):
+            children = self.children.get(parent)
+            if children is not None:
+                children.discard(task_id)
+                if len(children) == 0:
+                    del self.children[parent]
@@ -1,14 +1,59 @@
+import json
+import sqlite3
 import datetime
+from collections import namedtuple
 
 from pony.orm import *
 
+from config import *
 from constant import *
+from sweep import check_template, get_point, get_size, parse_axes, render
 
 # set_sql_debug(True)
 
 db = Database()
 
 
+@db.on_connect(provider='sqlite')
+def set_sqlite_pragmas(db, connection):
+    # WAL lets clients read while the server writes, and writers wait instead of failing with "database is locked"
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+
+
+# columns added to existing tables after their creation: (table, column, sqlite type)
+MIGRATIONS = [
+    ("Task", "estimated_runtime", "INTEGER"),
+    ("Task", "memory_required", "INTEGER"),
+    ("Task", "update_time", "DATETIME"),
+    ("Task", "process_start_time", "INTEGER"),
+    ("Task", "finish_time", "DATETIME"),
+    ("Task", "exit_code", "INTEGER"),
+    ("Task", "failure_reason", "TEXT"),
+    ("Task", "num_retries", "INTEGER"),
+    ("Task", "retry_time", "DATETIME"),
+    ("TaskHistory", "exit_code", "INTEGER"),
+    ("TaskHistory", "failure_reason", "TEXT"),
+    ("TaskHistory", "num_retries", "INTEGER"),
+    ("Task", "log_path", "TEXT"),
+    ("TaskHistory", "log_path", "TEXT"),
+    ("Task", "after", "INT[] NOT NULL DEFAULT '[]'"),
+    ("TaskHistory", "after", "INT[] NOT NULL DEFAULT '[]'"),
+    ("Task", "owner", "TEXT"),
+    ("TaskHistory", "owner", "TEXT"),
+    ("Task", "preemptible", "BOOLEAN NOT NULL DEFAULT 0"),
+    ("TaskHistory", "preemptible", "BOOLEAN NOT NULL DEFAULT 0"),
+    ("Task", "gpu_time", "REAL"),
+    ("TaskHistory", "gpu_time", "REAL"),
+    ("Task", "sweep_id", "INTEGER"),
+    ("Task", "sweep_index", "INTEGER"),
+    ("TaskHistory", "sweep_id", "INTEGER"),
+    ("TaskHistory", "sweep_index", "INTEGER"),
+]
+
+
 class Task(db.Entity):
     id = PrimaryKey(int, auto=True)
     state = Required(int, default=STATE.QUEUING)
@@ -16,10 +61,97 @@ class Task(db.Entity):
     submit_time = Required(datetime.datetime, default=datetime.datetime.utcnow)
     execute_time = Optional(datetime.datetime)
     system_pid = Optional(int)
+    # start time of the process `system_pid` in clock ticks since boot, to recognize it after a restart
+    process_start_time = Optional(int)
+    occupied_gpus = Optional(IntArray)
+    exclude_gpus = Optional(IntArray)
+    command = Required(str)
+    # user who submitted the task
+    owner = Optional(str, nullable=True)
+    num_gpus_required = Required(int, default=1)
+    estimated_runtime = Optional(int)
+    memory_required = Optional(int)
+    # ids of the tasks which must be done before this one starts
+    after = Optional(IntArray)
+    # the task can be stopped and queued again for tasks of higher priority
+    preemptible = Required(bool, default=False)
+    # outcome of the last run: end time, exit code and failure reason, None if it succeeded
+    finish_time = Optional(datetime.datetime)
+    exit_code = Optional(int)
+    failure_reason = Optional(str, nullable=True)
+    # runs of the task which failed and were retried, and when a retrying task is queued again
+    num_retries = Optional(int)
+    retry_time = Optional(datetime.datetime)
+    # gpu seconds used by the finished runs of the task
+    gpu_time = Optional(float)
+    # output of the task, appended by its retries
+    log_path = Optional(str, nullable=True)
+    # the sweep the task is a point of, and the index of the point
+    sweep_id = Optional(int, index=True)
+    sweep_index = Optional(int)
+    # last change of the task, lets monitors only read changed tasks
+    update_time = Optional(datetime.datetime, index=True)
+    # queue lookups by state in scheduling order, created on existing databases by generate_mapping
+    composite_index(state, priority, submit_time)
+
+    def before_insert(self):
+        self.update_time = datetime.datetime.utcnow()
+
+    def before_update(self):
+        self.update_time = datetime.datetime.utcnow()
+
+
+class TaskHistory(db.Entity):
+    # finished tasks, moved out of Task so that queue queries do not depend on the size of the history
+    id = PrimaryKey(int)
+    state = Required(int, default=STATE.DONE)
+    priority = Required(int)
+    submit_time = Required(datetime.datetime)
+    execute_time = Optional(datetime.datetime)
+    finish_time = Optional(datetime.datetime, index=True)
+    system_pid = Optional(int)
     occupied_gpus = Optional(IntArray)
     exclude_gpus = Optional(IntArray)
     command = Required(str)
+    owner = Optional(str, nullable=True)
+    num_gpus_required = Required(int)
+    estimated_runtime = Optional(int)
+    memory_required = Optional(int)
+    after = Optional(IntArray)
+    preemptible = Required(bool, default=False)
+    exit_code = Optional(int)
+    failure_reason = Optional(str, nullable=True)
+    num_retries = Optional(int)
+    log_path = Optional(str, nullable=True)
+    gpu_time = Optional(float)
+    sweep_id = Optional(int)
+    sweep_index = Optional(int)
+
+
+class Sweep(db.Entity):
+    # parameter sweep: the points are expanded into tasks with the requirements of the sweep, see sweep.py
+    id = PrimaryKey(int, auto=True)
+    # template of the commands and json of its axes
+    command = Required(str)
+    axes = Required(str)
+    size = Required(int)
+    priority = Required(int, default=100)
+    submit_time = Required(datetime.datetime, default=datetime.datetime.utcnow)
+    owner = Optional(str, nullable=True)
     num_gpus_required = Required(int, default=1)
+    exclude_gpus = Optional(IntArray)
+    estimated_runtime = Optional(int)
+    memory_required = Optional(int)
+    preemptible = Required(bool, default=False)
+    # early stopping: a point exiting with `stop_exit_code`, or `max_failures` failed points stop the sweep
+    stop_exit_code = Optional(int)
+    max_failures = Optional(int)
+    # points expanded so far, the next one has this index, and the finished ones
+    num_expanded = Required(int, default=0)
+    num_done = Required(int, default=0)
+    num_failed = Required(int, default=0)
+    # why the remaining points are not expanded anymore, None while the sweep goes on
+    stop_reason = Optional(str, nullable=True)
 
 
 class Server(db.Entity):
@@ -29,23 +161,372 @@ class Server(db.Entity):
     stop_time = Optional(datetime.datetime)
 
 
+# columns shown by the client
+LIST_COLUMNS = ["id", "state", "owner", "priority", "submit_time", "execute_time", "system_pid", "occupied_gpus",
+                "exclude_gpus", "num_gpus_required", "exit_code", "command"]
+DATETIME_COLUMNS = ["submit_time", "execute_time", "finish_time", "update_time", "retry_time"]
+INT_ARRAY_COLUMNS = ["occupied_gpus", "exclude_gpus"]
+
+
+def to_db_datetime(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def check_int(name, value, minimum):
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f"{name} requires int of at least {minimum}, but got {value!r}")
+
+
+def check_task(command, num_gpus_required=1, exclude_gpus=[], estimated_runtime=None, memory_required=None, after=[],
+               **kwargs):
+    # the checks of `client.make_task` again, the server also serves clients which did not make them
+    # e.g. a negative number of gpus would take all the gpus but one
+    if not isinstance(command, str) or command.strip() == '':
+        raise ValueError("empty command")
+    check_int("num_gpus_required", num_gpus_required, 1)
+    if estimated_runtime is not None:
+        check_int("estimated_runtime", estimated_runtime, 0)
+    if memory_required is not None:
+        check_int("memory_required", memory_required, 1)
+    for name, values, minimum in [("exclude_gpus", exclude_gpus, 0), ("after", after, 1)]:
+        if not isinstance(values or [], list):
+            raise ValueError(f"{name} requires a list, but got {values!r}")
+        for value in values or []:
+            check_int(name, value, minimum)
+
+
+def check_owner(item, owner):
+    # tasks and sweeps are changed by their owner, any of them if `owner` is None (admins and --local)
+    if owner is not None and item.owner != owner:
+        raise ValueError(f"{type(item).__name__.lower()} {item.id} is owned by {item.owner}")
+
+
+def from_db_value(column, value):
+    # raw sqlite values to python values
+    if value is None:
+        return None
+    if column in DATETIME_COLUMNS:
+        return datetime.datetime.fromisoformat(value)
+    if column in INT_ARRAY_COLUMNS:
+        return json.loads(value)
+    return value
+
+
 class GPUTaskDatabase(object):
-    def __init__(self, database):
+    def __init__(self, database, filename='task.db'):
         self.db = database
-        self.db.bind(provider='sqlite', filename='task.db', create_db=True)
+        self.db.bind(provider='sqlite', filename=filename, create_db=True)
+        self.__migrate()
         self.db.generate_mapping(create_tables=True)
     
     @db_session
-    def add_task(self, command, num_gpus_required, exclude_gpus):
-        Task(command=command, num_gpus_required=num_gpus_required, exclude_gpus=exclude_gpus)
+    def __migrate(self):
+        tables = self.db.select("name from sqlite_master where type = 'table'")
+        for table, column, sql_type in MIGRATIONS:
+            if table not in tables:
+                # will be created by generate_mapping
+                continue
+
+            columns = [c[1] for c in self.db.select(f"* from pragma_table_info('{table}')")]
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {sql_type}')
+    
+    @db_session
+    def add_task(self, command, num_gpus_required, exclude_gpus, estimated_runtime=None, memory_required=None,
+                 after=[], owner=None, preemptible=False):
+        # return the id of the new task
+        check_task(command, num_gpus_required, exclude_gpus, estimated_runtime, memory_required, after)
+        self.__check_task_ids(after)
+        task = Task(command=command, num_gpus_required=num_gpus_required, exclude_gpus=exclude_gpus,
+                    estimated_runtime=estimated_runtime, memory_required=memory_required, after=after, owner=owner,
+                    preemptible=preemptible)
+        flush()
+        return task.id
     
+    @db_session
+    def add_tasks(self, tasks):
+        # insert all tasks in a single transaction, `tasks` are dicts with the arguments of `add_task`,
+        # and "after_tasks": indices of earlier tasks of `tasks` it depends on, in addition to "after"
+        # return the ids of the first and the last inserted task
+        if len(tasks) == 0:
+            return None
+
+        for index, t in enumerate(tasks):
+            try:
+                check_task(**t)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"task {index + 1}: {e}")
+            if any(i < 0 or i >= index for i in t.get("after_tasks", [])):
+                raise ValueError(f"task {index + 1} can only depend on earlier tasks")
+        self.__check_task_ids(set(task_id for t in tasks for task_id in t.get("after", [])))
+        submit_time = to_db_datetime(datetime.datetime.utcnow())
+        rows = [(Task.state.default, Task.priority.default, submit_time, submit_time, "[]",
+                 json.dumps(list(t.get("exclude_gpus", [])), separators=(',', ':')), t["command"],
+                 t.get("num_gpus_required", 1), t.get("estimated_runtime"), t.get("memory_required"),
+                 json.dumps(list(t.get("after", [])), separators=(',', ':')), t.get("owner"),
+                 bool(t.get("preemptible", False)))
+                for t in tasks]
+
+        cursor = self.db.get_connection().cursor()
+        cursor.executemany(
+            'INSERT INTO "Task" ("state", "priority", "submit_time", "update_time", "occupied_gpus", "exclude_gpus", '
+            '"command", "num_gpus_required", "estimated_runtime", "memory_required", "after", "owner", '
+            '"preemptible") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows)
+        # ids are consecutive since sqlite has a single writer
+        last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        first_id = last_id - len(rows) + 1
+
+        # dependencies within the batch are known once the ids are
+        updates = []
+        for index, t in enumerate(tasks):
+            after_tasks = t.get("after_tasks", [])
+            if len(after_tasks) > 0:
+                after = list(t.get("after", [])) + [first_id + i for i in after_tasks]
+                updates.append((json.dumps(after, separators=(',', ':')), first_id + index))
+        cursor.executemany('UPDATE "Task" SET "after" = ? WHERE "id" = ?', updates)
+        return first_id, last_id
+
+    @db_session
+    def add_sweep(self, command, axes, size, num_gpus_required, exclude_gpus, estimated_runtime=None,
+                  memory_required=None, owner=None, preemptible=False, stop_exit_code=None, max_failures=None):
+        # return the id of the new sweep, its points are expanded by the server
+        # checked like `client.parse_sweep`, a sweep which can not be expanded would fail each scheduling pass
+        check_task(command, num_gpus_required, exclude_gpus, estimated_runtime, memory_required)
+        try:
+            axes = parse_axes(axes)
+            check_template(command, axes)
+        except (TypeError, KeyError) as e:
+            raise ValueError(f"invalid axes: {e}")
+        if size != get_size(axes):
+            raise ValueError(f"sweep has {get_size(axes)} points, but got size {size!r}")
+        if stop_exit_code is not None:
+            check_int("stop_exit_code", stop_exit_code, 1)
+            if stop_exit_code > 255:
+                raise ValueError(f"stop_exit_code requires an exit code in [1, 255], but got {stop_exit_code}")
+        if max_failures is not None:
+            check_int("max_failures", max_failures, 1)
+        sweep = Sweep(command=command, axes=json.dumps(axes), size=size, num_gpus_required=num_gpus_required,
+                      exclude_gpus=exclude_gpus, estimated_runtime=estimated_runtime,
+                      memory_required=memory_required, owner=owner, preemptible=preemptible,
+                      stop_exit_code=stop_exit_code, max_failures=max_failures)
+        flush()
+        return sweep.id
+
+    def __check_task_ids(self, task_ids):
+        task_ids = [int(task_id) for task_id in task_ids]
+        if len(task_ids) == 0:
+            return
+
+        ids = ", ".join(str(task_id) for task_id in task_ids)
+        known = set(self.db.select(f'"id" FROM "Task" WHERE "id" IN ({ids}) '
+                                   f'UNION SELECT "id" FROM "TaskHistory" WHERE "id" IN ({ids})'))
+        unknown = sorted(set(task_ids) - known)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown tasks: {unknown}")
+    
+    def find_task_ids(self, task_ids):
+        # the ids of `task_ids` which are still in Task, neither finished nor deleted
+        return list(select(t.id for t in Task if t.id in task_ids))
+
     def find_tasks_by_state(self, state):
-        tasks = select(t for t in Task if t.state==state).order_by(Task.priority, Task.submit_time)
+        tasks = select(t for t in Task if t.state==state).order_by(Task.priority, Task.submit_time, Task.id)
+        return list(tasks)
+    
+    def find_schedulable_tasks(self):
+        # queuing tasks and the pending task waiting for its reservation, in scheduling order
+        tasks = select(t for t in Task if t.state in (STATE.QUEUING, STATE.PENDING))
+        tasks = tasks.order_by(Task.priority, Task.submit_time, Task.id)
         return list(tasks)
     
+    @db_session
+    def list_tasks(self, states, limit=None, offset=0, since=None, until=None, command=None, columns=LIST_COLUMNS,
+                   updated_since=None, sweep_id=None, hide_sweep_points=False):
+        # filters, ordering and paging are done by sqlite, return named tuples of `columns`
+        # active tasks are ordered by state then scheduling order, followed by finished tasks most recently finished
+        # first, since and until filter the submit time, command filters by substring of the command,
+        # updated_since only returns active tasks changed since then, sweep_id only returns the points of a sweep,
+        # hide_sweep_points leaves out the points of sweeps which are not running, counted by `list_sweeps`
+        for column in columns:
+            if column not in Task._adict_:
+                raise ValueError(f"Unknown column: {column}")
+
+        conditions, params = [], {}
+        if since is not None:
+            conditions.append('"submit_time" >= $since')
+            params["since"] = to_db_datetime(since)
+        if until is not None:
+            conditions.append('"submit_time" < $until')
+            params["until"] = to_db_datetime(until)
+        if command is not None:
+            conditions.append('"command" LIKE $command ESCAPE \'!\'')
+            params["command"] = "%" + command.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+        if sweep_id is not None:
+            conditions.append('"sweep_id" = $sweep_id')
+            params["sweep_id"] = int(sweep_id)
+        elif hide_sweep_points:
+            conditions.append(f'("sweep_id" IS NULL OR "state" = {STATE.RUNNING})')
+
+        select_columns = ", ".join(f'"{c}"' for c in columns)
+        rows = []
+
+        active_states = [int(state) for state in states if state not in STATE.FINISHED]
+        if len(active_states) > 0:
+            active_conditions = list(conditions)
+            if updated_since is not None:
+                active_conditions.append('"update_time" >= $updated_since')
+                params["updated_since"] = to_db_datetime(updated_since)
+            where = " AND ".join([f'"state" IN ({", ".join(str(s) for s in active_states)})'] + active_conditions)
+            rows = self.__select_page(f'{select_columns} FROM "Task" WHERE {where} '
+                                      f'ORDER BY "state", "priority", "submit_time", "id"', limit, offset, params)
+
+            # the history starts after all active tasks
+            if offset > 0:
+                offset = max(0, offset - self.db.select(f'COUNT(*) FROM "Task" WHERE {where}', params)[0])
+            if limit is not None:
+                limit -= len(rows)
+
+        finished_states = [int(state) for state in states if state in STATE.FINISHED]
+        if len(finished_states) > 0 and updated_since is None and (limit is None or limit > 0):
+            where = " AND ".join([f'"state" IN ({", ".join(str(s) for s in finished_states)})'] + conditions)
+            rows += self.__select_page(f'{select_columns} FROM "TaskHistory" WHERE {where} '
+                                       f'ORDER BY "finish_time" DESC, "id" DESC', limit, offset, params)
+
+        row_type = namedtuple("TaskRow", columns)
+        if len(columns) == 1:
+            rows = [(row,) for row in rows]
+        return [row_type(*[from_db_value(c, v) for c, v in zip(columns, row)]) for row in rows]
+
+    def __select_page(self, sql, limit, offset, params):
+        limit = -1 if limit is None else int(limit)
+        return list(self.db.select(f'{sql} LIMIT {limit} OFFSET {int(offset)}', params))
+
+    def requeue_retrying_tasks(self, now):
+        # queue again the retrying tasks whose backoff is over, return their ids and the earliest retry time
+        # of the others, None if no other task is retrying
+        requeued, next_retry_time = [], None
+        for task in self.find_tasks_by_state(STATE.RETRYING):
+            if task.retry_time is None or task.retry_time <= now:
+                task.state = STATE.QUEUING
+                task.retry_time = None
+                requeued.append(task.id)
+            elif next_retry_time is None or task.retry_time < next_retry_time:
+                next_retry_time = task.retry_time
+        return requeued, next_retry_time
+
+    def expand_sweeps(self, num_free_gpus, free_memory={}):
+        # expand the next points of the sweeps going on into queued tasks: enough to fill `num_free_gpus` gpus, or
+        # the gpus with `free_memory` (gpu -> free MB, see `GPUManager.get_free_memory`) for the sweeps declaring
+        # their memory, and at least one queued (or retrying) point per sweep so that it keeps its place in the queue
+        # the points are queued with the submit time of their sweep, return the ids of the new tasks by sweep id
+        expanded = {}
+        for sweep in select(s for s in Sweep if s.stop_reason is None and s.num_expanded < s.size):
+            num_queued = count(t for t in Task if t.sweep_id == sweep.id
+                               and t.state in (STATE.QUEUING, STATE.PENDING, STATE.RETRYING))
+            num_runnable = num_free_gpus // sweep.num_gpus_required
+            if sweep.memory_required is not None:
+                # packed on the shared gpus too
+                num_slots = sum(int(memory // sweep.memory_required) for memory in free_memory.values())
+                num_runnable = max(num_runnable, num_slots // sweep.num_gpus_required)
+            num_points = min(max(1, num_runnable) - num_queued, sweep.size - sweep.num_expanded)
+            if num_points <= 0:
+                continue
+
+            axes = json.loads(sweep.axes)
+            tasks = []
+            for index in range(sweep.num_expanded, sweep.num_expanded + num_points):
+                tasks.append(Task(command=render(sweep.command, get_point(axes, index)), priority=sweep.priority,
+                                  submit_time=sweep.submit_time, owner=sweep.owner,
+                                  num_gpus_required=sweep.num_gpus_required,
+                                  exclude_gpus=list(sweep.exclude_gpus or []),
+                                  estimated_runtime=sweep.estimated_runtime, memory_required=sweep.memory_required,
+                                  preemptible=sweep.preemptible, after=[], sweep_id=sweep.id, sweep_index=index))
+            sweep.num_expanded += num_points
+            flush()
+            expanded[sweep.id] = [task.id for task in tasks]
+        return expanded
+
+    def is_sweep_stop_code(self, sweep_id, exit_code):
+        # the point exited with the code stopping its sweep early, it is done then
+        sweep = Sweep.get(id=sweep_id)
+        return sweep is not None and sweep.stop_exit_code is not None and exit_code == sweep.stop_exit_code
+
+    def finish_sweep_point(self, task, is_done):
+        # count the finished point `task` for its sweep, which stops on its stop exit code or too many failures
+        # return (reason, ids of the deleted queued points) if the sweep stops, None otherwise
+        sweep = Sweep.get(id=task.sweep_id)
+        if sweep is None:
+            return None
+        if is_done:
+            sweep.num_done += 1
+        else:
+            sweep.num_failed += 1
+        if sweep.stop_reason is not None:
+            return None
+
+        if sweep.stop_exit_code is not None and task.exit_code == sweep.stop_exit_code:
+            reason = f"point {task.sweep_index} (task {task.id}) exited with code {task.exit_code}"
+        elif sweep.max_failures is not None and sweep.num_failed >= sweep.max_failures:
+            reason = f"{sweep.num_failed} points failed"
+        else:
+            return None
+        return reason, self.__stop_sweep(sweep, reason)
+
+    @db_session
+    def stop_sweep(self, sweep_id, reason="stopped by user", owner=None):
+        # no more point of the sweep is expanded, its queued points are deleted, running ones go on
+        # return the ids of the deleted points, None if there is no such sweep
+        sweep = Sweep.get(id=sweep_id)
+        if sweep is None:
+            return None
+        check_owner(sweep, owner)
+        if sweep.stop_reason is not None:
+            return []
+        return self.__stop_sweep(sweep, reason)
+
+    def __stop_sweep(self, sweep, reason):
+        sweep.stop_reason = reason
+        queued = list(select(t for t in Task if t.sweep_id == sweep.id
+                             and t.state in (STATE.QUEUING, STATE.PENDING, STATE.RETRYING)))
+        for task in queued:
+            task.delete()
+        return [task.id for task in queued]
+
+    @db_session
+    def list_sweeps(self, active=True):
+        # progress of the sweeps, most recent first, only those with points left to run if `active`
+        # state: "stopped" (early or by the user), "done" once all points finished, otherwise "running" if a
+        # point is running or "queuing"
+        num_tasks = {}
+        for sweep_id, state, num in self.db.select('"sweep_id", "state", COUNT(*) FROM "Task" '
+                                                   'WHERE "sweep_id" IS NOT NULL GROUP BY "sweep_id", "state"'):
+            num_tasks.setdefault(sweep_id, {})[state] = num
+
+        if active:
+            ids = list(num_tasks)
+            sweeps = select(s for s in Sweep if (s.stop_reason is None and s.num_expanded < s.size) or s.id in ids)
+        else:
+            sweeps = select(s for s in Sweep)
+        result = []
+        for sweep in sweeps.order_by(desc(Sweep.id)):
+            counts = num_tasks.get(sweep.id, {})
+            num_running = counts.get(STATE.RUNNING, 0)
+            num_queued = sum(counts.values()) - num_running
+            if sweep.stop_reason is not None:
+                state = "stopped"
+            elif sweep.num_expanded == sweep.size and len(counts) == 0:
+                state = "done"
+            else:
+                state = "running" if num_running > 0 else "queuing"
+            result.append({"id": sweep.id, "state": state, "owner": sweep.owner, "priority": sweep.priority,
+                           "submit_time": sweep.submit_time, "size": sweep.size, "expanded": sweep.num_expanded,
+                           "queued": num_queued, "running": num_running, "done": sweep.num_done,
+                           "failed": sweep.num_failed, "command": sweep.command, "stop_reason": sweep.stop_reason})
+        return result
+
     def get_next_task(self):
         # highest priority (smallest value), most early submity_time
-        task = select(t for t in Task if t.state == STATE.QUEUING).order_by(Task.priority, Task.submit_time)[:1]
+        task = select(t for t in Task if t.state == STATE.QUEUING).order_by(Task.priority, Task.submit_time, Task.id)[:1]
         task = list(task)
         
         if len(task) == 1:
@@ -59,6 +540,112 @@ class GPUTaskDatabase(object):
         
         return None
     
+    def get_history_by_id(self, task_id):
+        if TaskHistory.exists(id=task_id):
+            return TaskHistory[task_id]
+        
+        return None
+    
+    @db_session
+    def get_task_log(self, task_id):
+        # (state, log path) of the task, None if there is no such task
+        task = self.get_task_by_id(task_id)
+        if task is None:
+            task = self.get_history_by_id(task_id)
+        if task is None:
+            return None
+        return task.state, task.log_path
+
+    @db_session
+    def get_task_usage(self, task_id):
+        # accounting of the task, None if there is no such task, the gpu time includes the current run
+        task = self.get_task_by_id(task_id)
+        if task is None:
+            task = self.get_history_by_id(task_id)
+        if task is None:
+            return None
+
+        gpu_time = task.gpu_time or 0
+        if task.state == STATE.RUNNING and task.execute_time is not None:
+            run_time = (datetime.datetime.utcnow() - task.execute_time).total_seconds()
+            gpu_time += len(task.occupied_gpus or []) * max(0, run_time)
+        return {"id": task.id, "state": task.state, "owner": task.owner, "command": task.command,
+                "occupied_gpus": list(task.occupied_gpus or []), "submit_time": task.submit_time,
+                "execute_time": task.execute_time, "finish_time": task.finish_time,
+                "num_retries": task.num_retries or 0, "gpu_time": gpu_time}
+
+    @db_session
+    def list_user_usage(self, since=None, until=None):
+        # (owner, number of tasks, gpu seconds) of each user, over the tasks submitted between since and until,
+        # running tasks count up to now
+        conditions, params = ['"gpu_time" IS NOT NULL OR "state" = $running'], {"running": STATE.RUNNING}
+        if since is not None:
+            conditions.append('"submit_time" >= $since')
+            params["since"] = to_db_datetime(since)
+        if until is not None:
+            conditions.append('"submit_time" < $until')
+            params["until"] = to_db_datetime(until)
+        where = " AND ".join(f"({condition})" for condition in conditions)
+
+        usage = {}
+        now = datetime.datetime.utcnow()
+        for table in ["Task", "TaskHistory"]:
+            rows = self.db.select(f'"owner", "state", "gpu_time", "occupied_gpus", "execute_time" FROM "{table}" '
+                                  f'WHERE {where}', params)
+            for owner, state, gpu_time, gpus, execute_time in rows:
+                gpu_time = gpu_time or 0
+                if state == STATE.RUNNING and execute_time is not None:
+                    run_time = (now - from_db_value("execute_time", execute_time)).total_seconds()
+                    gpu_time += len(json.loads(gpus or "[]")) * max(0, run_time)
+                num_tasks, total = usage.get(owner, (0, 0))
+                usage[owner] = (num_tasks + 1, total + gpu_time)
+        return sorted([(owner, num_tasks, gpu_time) for owner, (num_tasks, gpu_time) in usage.items()],
+                      key=lambda x: -x[2])
+
+    @db_session
+    def count_tasks(self, states):
+        return count(t for t in Task if t.state in states)
+    
+    def archive_task(self, task):
+        data = {key: value for key, value in task.to_dict().items() if key in TaskHistory._adict_}
+        if data.get("finish_time") is None:
+            data["finish_time"] = datetime.datetime.utcnow()
+        task.delete()
+        TaskHistory(**data)
+    
+    @db_session
+    def archive_done_tasks(self):
+        # move finished tasks left in Task by older versions, return the number of archived tasks
+        columns = ", ".join(f'"{attr.name}"' for attr in Task._attrs_ if attr.name in TaskHistory._adict_)
+        finished = ", ".join(str(state) for state in STATE.FINISHED)
+        self.db.execute(f'INSERT INTO "TaskHistory" ({columns}) SELECT {columns} FROM "Task" WHERE "state" IN ({finished})')
+        return self.db.get_connection().execute(f'DELETE FROM "Task" WHERE "state" IN ({finished})').rowcount
+    
+    @db_session
+    def list_usage(self, since):
+        # (owner, number of gpus, execute time, finish time) of the tasks finished since then, in finish order
+        rows = self.db.select('"owner", "occupied_gpus", "execute_time", "finish_time" FROM "TaskHistory" '
+                              'WHERE "finish_time" >= $since AND "execute_time" IS NOT NULL ORDER BY "finish_time"',
+                              {"since": to_db_datetime(since)})
+        return [(owner, len(json.loads(gpus or "[]")), from_db_value("execute_time", execute_time),
+                 from_db_value("finish_time", finish_time)) for owner, gpus, execute_time, finish_time in rows]
+    
+    @db_session
+    def remove_expired_history(self, retention_days):
+        # return the number of removed tasks
+        expire_time = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+        return delete(t for t in TaskHistory if t.finish_time < expire_time
+                      or (t.finish_time is None and t.submit_time < expire_time))
+    
+    def compact(self):
+        # reclaim space of deleted rows, VACUUM can not run inside a transaction of pony
+        connection = sqlite3.connect(self.db.provider.pool.filename, timeout=DB_BUSY_TIMEOUT / 1000)
+        try:
+            connection.execute("VACUUM")
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            connection.close()
+    
     def get_last_server(self):
         server = select(s for s in Server).order_by(desc(Server.start_time))[:1]
         server = list(server)
@@ -97,12 +684,58 @@ class GPUTaskDatabase(object):
         task.delete()
 
     @db_session
-    def remove_all(self):
-        delete(t for t in Task)
+    def remove_queuing_task(self, task_id, owner=None):
+        # only queuing and retrying tasks can be deleted, by `owner` if given
+        # return the state of the task, None if there is no such task
+        task = self.get_task_by_id(task_id)
+        if task is None:
+            task = self.get_history_by_id(task_id)
+        if task is None:
+            return None
+
+        state = task.state
+        if state in (STATE.QUEUING, STATE.RETRYING):
+            check_owner(task, owner)
+            task.delete()
+        return state
+
+    @db_session
+    def update_task_priority(self, task_id, priority, owner=None):
+        # return the old priority, None if there is no such task
+        # `owner` only changes the priority of its own tasks, and can not put them before the default priority since
+        # priorities come before the fair share
+        check_int("priority", priority, 1)
+        task = self.get_task_by_id(task_id)
+        if task is None:
+            return None
+        check_owner(task, owner)
+        if owner is not None and priority < Task.priority.default:
+            raise ValueError(f"priority {priority} is only allowed to admins, "
+                                  f"the highest priority of users is {Task.priority.default}")
+
+        old_priority = task.priority
+        task.priority = priority
+        return old_priority
+
+    @db_session
+    def remove_all(self, owner=None):
+        # delete the queuing and retrying tasks and stop the sweeps, only those of `owner` if given, running and
+        # pending tasks go on, return the ids of the deleted tasks
+        tasks = select(t for t in Task if t.state in (STATE.QUEUING, STATE.RETRYING))
+        sweeps = select(s for s in Sweep if s.stop_reason is None)
+        if owner is not None:
+            tasks = tasks.filter(lambda t: t.owner == owner)
+            sweeps = sweeps.filter(lambda s: s.owner == owner)
+
+        for sweep in sweeps:
+            sweep.stop_reason = "deleted"
+        deleted = sorted(task.id for task in tasks)
+        tasks.delete(bulk=True)
+        return deleted
     
 
-def get_database():
-    gpu_task_db = GPUTaskDatabase(db)
+def get_database(filename='task.db'):
+    gpu_task_db = GPUTaskDatabase(db, filename)
     return gpu_task_db
 
 if __name__ == '__main__':
@@ -123,13 +756,4 @@ if __name__ == '__main__':
     with db_session:
         tasks = gpu_task_db.find_tasks_by_state(state=STATE.PENDING)
         for task in tasks:
-            # print(task)
             task_id = task.id
-    
-    # gpu_task_db.update_task_state(task_id, STATE.RUNNING)
-
-    # # gpu_task_db.remove_task(1)
-
-    # with db_session:
-    #     task = gpu_task_db.get_next_task()
-    #     print(task.id, task.submit_time, task.command)
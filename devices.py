@@ -0,0 +1,178 @@
+import math
+import ctypes
+from collections import namedtuple
+
+import GPUtil
+
+
+# one probe of a device, memory in MB and load in [0, 1]
+# processes: list of (pid, used memory in MB) running on the device, None if not supported by the backend
+DeviceSample = namedtuple("DeviceSample", ["id", "load", "memory_used", "memory_total", "processes"],
+                          defaults=[None])
+
+
+class GPUtilProvider(object):
+    # query devices through nvidia-smi
+    def probe(self):
+        return [DeviceSample(gpu.id, gpu.load, gpu.memoryUsed, gpu.memoryTotal) for gpu in GPUtil.getGPUs()]
+
+    def close(self):
+        pass
+
+
+NVML_SUCCESS = 0
+NVML_ERROR_INSUFFICIENT_SIZE = 7
+
+
+class NVMLError(RuntimeError):
+    pass
+
+
+class NVMLUtilization(ctypes.Structure):
+    _fields_ = [("gpu", ctypes.c_uint), ("memory", ctypes.c_uint)]
+
+
+class NVMLMemory(ctypes.Structure):
+    _fields_ = [("total", ctypes.c_ulonglong), ("free", ctypes.c_ulonglong), ("used", ctypes.c_ulonglong)]
+
+
+class NVMLProcessInfo(ctypes.Structure):
+    _fields_ = [("pid", ctypes.c_uint), ("usedGpuMemory", ctypes.c_ulonglong),
+                ("gpuInstanceId", ctypes.c_uint), ("computeInstanceId", ctypes.c_uint)]
+
+
+class NVMLProvider(object):
+    # query devices in-process through libnvidia-ml, the library is initialized once and kept open
+    # `lib` can be any object exposing the NVML functions, e.g. a stub library on machines without gpus
+    def __init__(self, lib=None):
+        if lib is None:
+            lib = ctypes.CDLL("libnvidia-ml.so.1")
+            lib.nvmlErrorString.restype = ctypes.c_char_p
+        self.lib = lib
+
+        self.__check(self.lib.nvmlInit_v2())
+        count = ctypes.c_uint()
+        self.__check(self.lib.nvmlDeviceGetCount_v2(ctypes.byref(count)))
+
+        self.handles = []
+        for idx in range(count.value):
+            handle = ctypes.c_void_p()
+            self.__check(self.lib.nvmlDeviceGetHandleByIndex_v2(idx, ctypes.byref(handle)))
+            self.handles.append(handle)
+
+    def probe(self):
+        samples = []
+        for idx, handle in enumerate(self.handles):
+            utilization = NVMLUtilization()
+            self.__check(self.lib.nvmlDeviceGetUtilizationRates(handle, ctypes.byref(utilization)))
+            memory = NVMLMemory()
+            self.__check(self.lib.nvmlDeviceGetMemoryInfo(handle, ctypes.byref(memory)))
+
+            samples.append(DeviceSample(idx, utilization.gpu / 100, memory.used / 1024 ** 2,
+                                        memory.total / 1024 ** 2, self.__get_processes(handle)))
+        return samples
+
+    def close(self):
+        self.__check(self.lib.nvmlShutdown())
+
+    def __get_processes(self, handle):
+        # ask for the number of processes first, retry if processes are started in between
+        count = ctypes.c_uint(0)
+        ret = self.lib.nvmlDeviceGetComputeRunningProcesses_v2(handle, ctypes.byref(count), None)
+        while ret == NVML_ERROR_INSUFFICIENT_SIZE:
+            count = ctypes.c_uint(count.value + 4)
+            infos = (NVMLProcessInfo * count.value)()
+            ret = self.lib.nvmlDeviceGetComputeRunningProcesses_v2(handle, ctypes.byref(count), infos)
+            if ret == NVML_SUCCESS:
+                return [(infos[i].pid, infos[i].usedGpuMemory / 1024 ** 2) for i in range(count.value)]
+
+        if ret != NVML_SUCCESS:
+            # e.g. not supported by the driver
+            return None
+        return []
+
+    def __check(self, ret):
+        if ret != NVML_SUCCESS:
+            message = self.lib.nvmlErrorString(ret)
+            if isinstance(message, bytes):
+                message = message.decode()
+            raise NVMLError(f"NVML error {ret}: {message}")
+
+
+class FakeDeviceProvider(object):
+    # simulated devices for machines without gpus, e.g. tests and benchmarks
+    def __init__(self, num_gpus, memory_total=81920):
+        self.samples = [DeviceSample(gpu, 0.0, 0.0, memory_total) for gpu in range(num_gpus)]
+        self.num_probes = 0
+
+    def probe(self):
+        self.num_probes += 1
+        return list(self.samples)
+
+    def close(self):
+        pass
+
+    def set_usage(self, gpu, load, memory_used):
+        self.samples[gpu] = self.samples[gpu]._replace(load=load, memory_used=memory_used)
+
+
+def get_device_provider(name, num_fake_gpus=0, logger=None):
+    if name == "nvml":
+        try:
+            return NVMLProvider()
+        except (OSError, AttributeError, NVMLError) as e:
+            if logger is not None:
+                logger.warning(f"NVML is not available ({e}), fall back to GPUtil")
+            return GPUtilProvider()
+    elif name == "gputil":
+        return GPUtilProvider()
+    elif name == "fake":
+        return FakeDeviceProvider(num_fake_gpus)
+    else:
+        raise ValueError(f"Unknown gpu backend: {name}")
+
+
+# a task running on a device, process is its asyncio subprocess, memory is None if the task uses the whole device
+Occupant = namedtuple("Occupant", ["task_id", "process", "memory"])
+
+
+class DeviceState(object):
+    # cached state of a device: last sample and the tasks running on it
+    def __init__(self, gpu_id):
+        self.id = gpu_id
+        self.load = math.nan
+        self.memory_used = math.nan
+        self.memory_total = math.nan
+        # (pid, memory) of the processes on the device, None if not reported by the backend
+        self.processes = None
+        self.sample_time = None
+
+        self.occupants = []
+
+    def update(self, sample, sample_time):
+        self.load = sample.load
+        self.memory_used = sample.memory_used
+        self.memory_total = sample.memory_total
+        self.processes = sample.processes
+        self.sample_time = sample_time
+
+    def is_idle(self, max_load, max_memory):
+        # nan values (e.g. unsupported by the driver) are treated as busy
+        if math.isnan(self.load) or math.isnan(self.memory_used) or not self.memory_total:
+            return False
+        return self.load < max_load and self.memory_used / self.memory_total < max_memory
+
+    def is_occupied(self):
+        return len(self.get_running_occupants()) > 0
+
+    def is_shareable(self):
+        # only shared with tasks which declared their memory
+        return all(o.memory is not None for o in self.get_running_occupants())
+
+    def get_running_occupants(self):
+        return [o for o in self.occupants if o.process.returncode is None]
+
+    def get_free_memory(self):
+        # memory reserved by tasks may not be allocated yet
+        reserved = sum(o.memory for o in self.get_running_occupants() if o.memory is not None)
+        return self.memory_total - max(self.memory_used, reserved)
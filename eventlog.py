@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import queue
+import struct
+import threading
+
+
+# Structured events of the server: one JSON object per line appended to EVENT_LOG_PATH, e.g.
+# {"time": 1760000000.5, "event": "launched", "task_ids": [3], "gpus": [0, 1], "wait": 12.5}
+# with the events published to the watching clients, see `GPUTaskManagerServer.__publish`
+# the sidecar index EVENT_LOG_PATH.idx holds a record per block of about `block_size` bytes of events, so that
+# `client.py --events` only reads the blocks of the requested time range and task, and the last unindexed block
+# only the standard library is imported, it is loaded by the client
+
+# offset and size of a block, time of its first and last event, smallest and largest task id of its events
+INDEX_RECORD = struct.Struct("<QQddQQ")
+NO_TASK_ID = 2 ** 64 - 1
+
+
+def get_index_path(path):
+    return f"{path}.idx"
+
+
+def get_task_ids(event):
+    # ids of the tasks of an event, a submission of many tasks gives the range of their ids
+    task_ids = list(event.get("task_ids", []))
+    if "first_id" in event:
+        task_ids += [event["first_id"], event["last_id"]]
+    return task_ids
+
+
+def has_task(event, task_id):
+    if "first_id" in event and event["first_id"] <= task_id <= event["last_id"]:
+        return True
+    return task_id in event.get("task_ids", [])
+
+
+def read_index(path):
+    # the index records of the event log `path`, [] if there is none
+    try:
+        with open(get_index_path(path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    return list(INDEX_RECORD.iter_unpack(data[:len(data) - len(data) % INDEX_RECORD.size]))
+
+
+class EventLogWriter(object):
+    # append events to `path` and index them by blocks, once the file would exceed `max_bytes` it is renamed
+    # to `path.1` with its index and older backups are shifted up to `path.<backup_count>`, 0 never rotates
+    def __init__(self, path, max_bytes=0, backup_count=0, block_size=64 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.block_size = block_size
+        self.__open()
+
+    def write(self, line, event_time, task_ids):
+        # line: encoded event ending with a newline
+        if self.max_bytes > 0 and self.size > 0 and self.size + len(line) > self.max_bytes:
+            self.rotate()
+
+        written = 0
+        while written < len(line):
+            written += os.write(self.fd, line[written:])
+        self.size += len(line)
+        self.__add_to_block(event_time, task_ids)
+        if self.size - self.block[0] >= self.block_size:
+            self.close_block()
+
+    def close_block(self):
+        # index the events written since the last block
+        offset, first_time, last_time, min_id, max_id = self.block
+        if self.size > offset:
+            with open(get_index_path(self.path), 'ab') as f:
+                f.write(INDEX_RECORD.pack(offset, self.size - offset, first_time, last_time, min_id, max_id))
+        self.block = (self.size, None, None, NO_TASK_ID, 0)
+
+    def rotate(self):
+        self.close_block()
+        os.close(self.fd)
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                backup_path = f"{self.path}.{index}"
+                if os.path.exists(backup_path):
+                    self.__move(backup_path, f"{self.path}.{index + 1}")
+            self.__move(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+            if os.path.exists(get_index_path(self.path)):
+                os.remove(get_index_path(self.path))
+        self.__open()
+
+    def close(self):
+        self.close_block()
+        os.close(self.fd)
+
+    def __open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        # the events after the last indexed block, e.g. written before a crash, start the current block
+        records = read_index(self.path)
+        offset = records[-1][0] + records[-1][1] if len(records) > 0 else 0
+        self.block = (offset, None, None, NO_TASK_ID, 0)
+        if self.size > offset:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # partially written
+                        continue
+                    self.__add_to_block(event["time"], get_task_ids(event))
+
+    def __move(self, src, dst):
+        # a log with its index, a stale index of `dst` is removed
+        os.replace(src, dst)
+        if os.path.exists(get_index_path(src)):
+            os.replace(get_index_path(src), get_index_path(dst))
+        elif os.path.exists(get_index_path(dst)):
+            os.remove(get_index_path(dst))
+
+    def __add_to_block(self, event_time, task_ids):
+        offset, first_time, _, min_id, max_id = self.block
+        self.block = (offset, event_time if first_time is None else first_time, event_time,
+                      min([min_id] + task_ids), max([max_id] + task_ids))
+
+
+class EventLog(object):
+    # events are queued by `emit` and encoded and written by a background thread, the callers never wait for the
+    # disk, pending events are written by `stop`
+    def __init__(self, path, max_bytes=0, backup_count=0, block_size=64 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.block_size = block_size
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.thread.start()
+
+    def emit(self, event, **fields):
+        self.queue.put((time.time(), event, fields))
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __write_loop(self):
+        writer = EventLogWriter(self.path, self.max_bytes, self.backup_count, self.block_size)
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                event_time, event, fields = item
+                message = dict(time=event_time, event=event, **fields)
+                line = (json.dumps(message, separators=(",", ":"), default=str) + "\n").encode()
+                writer.write(line, event_time, get_task_ids(message))
+        finally:
+            writer.close()
+
+
+def read_events(path, task_id=None, since=None, until=None, backup_count=0):
+    # events of the log `path` and its backups in time order, of the task `task_id` if given, with a time
+    # (unix timestamp) within [since, until], None for no bound
+    # only the blocks which may hold matching events are read, according to the indexes
+    paths = [f"{path}.{index}" for index in range(backup_count, 0, -1)] + [path]
+    for log_path in paths:
+        try:
+            f = open(log_path, 'rb')
+        except FileNotFoundError:
+            continue
+        with f:
+            records = read_index(log_path)
+            end = records[-1][0] + records[-1][1] if len(records) > 0 else 0
+            # the last block is not indexed yet
+            blocks = [(offset, size) for offset, size, first_time, last_time, min_id, max_id in records
+                      if (since is None or last_time >= since) and (until is None or first_time <= until)
+                      and (task_id is None or min_id <= task_id <= max_id)]
+            blocks.append((end, None))
+
+            for offset, size in blocks:
+                f.seek(offset)
+                data = f.read() if size is None else f.read(size)
+                for line in data.splitlines():
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # partially written
+                        continue
+                    if since is not None and event["time"] < since:
+                        continue
+                    if until is not None and event["time"] > until:
+                        continue
+                    if task_id is None or has_task(event, task_id):
+                        yield event
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import signal
+import subprocess
+
+
+# Runs a task for the server and writes its exit code to a status file when it exits, so that a restarted
+# server learns how the tasks it adopted ended:
+#   python launcher.py [--log PATH [--max-bytes N] [--backups N] [--compress]] STATUS_PATH COMMAND [ARGS...]
+# stdout and stderr of the task are written to the rotating log file at PATH (to our stderr without --log),
+# and scanned for out of gpu memory errors, reported in the status
+# the launcher exits like the task (same exit code or killed by the same signal, with exit code 128 + signal for
+# the signals which can not be raised again, e.g. SIGKILL), the status has the exit code of the task
+# only the standard library is imported, it is started for every task
+
+# errors printed by cuda and the frameworks when a gpu is out of memory
+OOM_PATTERNS = [b"CUDA out of memory", b"CUDA_ERROR_OUT_OF_MEMORY", b"cudaErrorMemoryAllocation",
+                b"OutOfMemoryError", b"RESOURCE_EXHAUSTED: Out of memory"]
+OOM_ERROR = "oom"
+
+
+def write_status(status_path, exit_code, error=None):
+    # replaced atomically, the server may read it as soon as the launcher exits
+    tmp_path = f"{status_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"exit_code": exit_code, "error": error}, f)
+    os.replace(tmp_path, status_path)
+
+
+def read_status(status_path):
+    # (exit code, error) written by the launcher, None if it did not write them (not finished or killed)
+    try:
+        with open(status_path, 'r') as f:
+            status = json.load(f)
+        return status["exit_code"], status.get("error")
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class StderrWriter(object):
+    # output of the tasks run without log file
+    def write(self, data):
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(sys.stderr.fileno(), data[written:])
+        except OSError:
+            # e.g. the server which started us is gone, keep draining so that the task is not blocked
+            pass
+
+    def close(self):
+        pass
+
+
+def forward_output(stream, output):
+    # copy the output of the task until it is closed, return whether it reported out of gpu memory
+    is_oom = False
+    tail = b""
+    max_pattern_length = max(len(pattern) for pattern in OOM_PATTERNS)
+    while True:
+        data = os.read(stream.fileno(), 65536)
+        if data == b"":
+            return is_oom
+
+        output.write(data)
+        if not is_oom:
+            # patterns may be split between two reads
+            window = tail + data
+            is_oom = any(pattern in window for pattern in OOM_PATTERNS)
+            tail = window[-max_pattern_length:]
+
+
+def parse_args(args):
+    # [--log PATH [--max-bytes N] [--backups N] [--compress]] STATUS_PATH COMMAND...
+    options = {"log": None, "max-bytes": "0", "backups": "0", "compress": False}
+    while len(args) > 0 and args[0].startswith("--"):
+        name = args.pop(0)[2:]
+        options[name] = True if name == "compress" else args.pop(0)
+    return options, args[0], args[1:]
+
+
+def main(status_path, command, log_path=None, max_bytes=0, backup_count=0, compress=False):
+    if log_path is None:
+        output = StderrWriter()
+    else:
+        from tasklog import RotatingLogWriter
+        output = RotatingLogWriter(log_path, max_bytes, backup_count, compress)
+
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        output.write(f"failed to run `{' '.join(command)}`: {e}\n".encode())
+        output.close()
+        write_status(status_path, 127)
+        sys.exit(127)
+
+    # stop requests sent to the launcher are meant for the task
+    # as well as the preemption signals, see PREEMPT_SIGNAL
+    for sig in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1, signal.SIGUSR2]:
+        signal.signal(sig, lambda sig, frame: process.send_signal(sig))
+
+    is_oom = forward_output(process.stdout, output)
+    exit_code = process.wait()
+    output.close()
+    write_status(status_path, exit_code, OOM_ERROR if is_oom and exit_code != 0 else None)
+
+    if exit_code < 0:
+        sig = -exit_code
+        # the handlers of SIGKILL and SIGSTOP can not be changed, e.g. for a task killed by the oom killer
+        if sig not in [signal.SIGKILL, signal.SIGSTOP]:
+            signal.signal(sig, signal.SIG_DFL)
+            os.kill(os.getpid(), sig)
+        # signals which do not terminate by default
+        os._exit(128 + sig)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    options, status_path, command = parse_args(sys.argv[1:])
+    main(status_path, command, options["log"], int(options["max-bytes"]), int(options["backups"]),
+         options["compress"])
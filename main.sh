@@ -5,7 +5,7 @@ CMD=$1
 SCRIPT_DIR="$( cd -- "$( dirname -- "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )"
 
 PY_PATH="${SCRIPT_DIR}/server.py"
-LOG_PATH="${SCRIPT_DIR}/logs/server.log"
+# the server writes logs/server.log itself, its output only holds unexpected errors
 ERR_PATH="${SCRIPT_DIR}/logs/server.error"
 
 source ~/miniconda3/etc/profile.d/conda.sh
@@ -16,13 +16,13 @@ then
     echo "please provide argument: [start | stop | restart]"
 else
     case "${CMD}" in 
-        "start") nohup python "${PY_PATH}" start  1>>"${LOG_PATH}" 2>>"${ERR_PATH}" &
+        "start") nohup python "${PY_PATH}" start 1>>"${ERR_PATH}" 2>&1 &
             echo "started"
         ;;
         "stop") python "${PY_PATH}" stop
         ;;
         "restart") python "${PY_PATH}" stop
-                nohup python "${PY_PATH}" start 1>>"${LOG_PATH}" 2>>"${ERR_PATH}" &
+                nohup python "${PY_PATH}" start 1>>"${ERR_PATH}" 2>&1 &
                 echo "started"
         ;;
         "show") python "${PY_PATH}" show
@@ -0,0 +1,175 @@
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Metrics of the server in the Prometheus text format, served at http://METRICS_HOST:METRICS_PORT/metrics
+# only the standard library is imported, the metrics are updated from the event loop and the worker threads
+
+# seconds, from 1ms to 10s
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# seconds, from 1s to 3 days
+WAIT_BUCKETS = [1, 10, 60, 300, 900, 3600, 4 * 3600, 12 * 3600, 24 * 3600, 3 * 24 * 3600]
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+               for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    # values by labels, e.g. inc(state="done"), labels are sorted by name
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    # set explicitly, or read from `function` when scraped
+    kind = "gauge"
+
+    def __init__(self, name, description, function=None):
+        super().__init__(name, description)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def set_all(self, values, label):
+        # replace all the values, e.g. the number of tasks of each state
+        with self.lock:
+            self.values = {((label, key),): value for key, value in values.items()}
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = list(buckets) + [math.inf]
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{le="{format_value(bound)}"}} {cumulative}')
+            lines.append(f"{self.name}_sum {format_value(self.sum)}")
+            lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class ServerMetrics(object):
+    # everything measured on the hot paths of `GPUTaskManagerServer` and `GPUManager`
+    def __init__(self, get_num_free_gpus=None):
+        self.queue_wait = Histogram("gpu_task_queue_wait_seconds", "Time from submission to launch of the tasks",
+                                    WAIT_BUCKETS)
+        self.schedule_duration = Histogram("gpu_task_schedule_duration_seconds",
+                                           "Duration of the scheduling passes, including the launches")
+        self.probe_duration = Histogram("gpu_task_gpu_probe_duration_seconds", "Duration of the gpu probes")
+        self.db_write_duration = Histogram("gpu_task_db_write_duration_seconds",
+                                           "Duration of the transactions writing task changes to task.db")
+        self.wakeups = Counter("gpu_task_schedule_wakeups_total",
+                               "Scheduling passes by cause: event (submission, exit, gpu change) or timeout")
+        self.launches = Counter("gpu_task_launches_total", "Tasks launched")
+        self.launch_failures = Counter("gpu_task_launch_failures_total", "Tasks which failed to launch")
+        self.exits = Counter("gpu_task_exits_total", "Runs of tasks ended, by outcome: done, preempted or the kind of failure")
+        self.free_gpus = Gauge("gpu_task_free_gpus", "Idle gpus not occupied by tasks", get_num_free_gpus)
+        self.tasks = Gauge("gpu_task_tasks", "Active tasks by state")
+
+    def render(self):
+        lines = []
+        for metric in [self.queue_wait, self.schedule_duration, self.probe_duration, self.db_write_duration,
+                       self.wakeups, self.launches, self.launch_failures, self.exits, self.free_gpus, self.tasks]:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object):
+    # plain http server in a background thread, answers GET /metrics only
+    def __init__(self, host, port, metrics, logger):
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        self.logger = logger
+        self.httpd = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.logger.error(f"failed to serve metrics on {self.host}:{self.port}: {e}")
+            return
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.logger.info(f"serve metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
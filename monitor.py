@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+
+from termcolor import colored
+from tabulate import tabulate
+
+from constant import *
+
+
+TASK_COLUMNS = ["id", "state", "priority", "submit_time", "execute_time", "system_pid", "occupied_gpus",
+                "num_gpus_required", "command", "update_time"]
+
+# re-read rows changed slightly before the last seen change, a writer may commit an older update_time late
+UPDATE_OVERLAP = datetime.timedelta(seconds=5)
+
+CLEAR_SCREEN = "\x1b[2J\x1b[H"
+CLEAR_LINE = "\x1b[K"
+CLEAR_BELOW = "\x1b[J"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+
+
+def move_cursor(row):
+    return f"\x1b[{row + 1};1H"
+
+
+class TaskMonitor(object):
+    # live view of the active tasks and the gpus, only changed tasks are read from the database
+    # and only changed lines are redrawn
+    def __init__(self, database, status_path, states, limit=None, out=sys.stdout):
+        self.db = database
+        self.status_path = status_path
+        self.states = states
+        self.limit = limit
+        self.out = out
+
+        self.tasks = {}
+        self.last_update_time = None
+        self.status_mtime = None
+        self.gpu_lines = []
+        self.lines = []
+
+    def run(self, interval):
+        self.out.write(HIDE_CURSOR + CLEAR_SCREEN)
+        try:
+            while True:
+                self.update()
+                self.draw()
+                time.sleep(interval)
+        finally:
+            self.out.write(move_cursor(len(self.lines)) + SHOW_CURSOR)
+            self.out.flush()
+
+    def update(self):
+        if self.last_update_time is None:
+            rows = self.db.list_tasks(self.states, columns=TASK_COLUMNS)
+            self.tasks = {row.id: row for row in rows}
+        else:
+            rows = self.db.list_tasks(self.states, columns=TASK_COLUMNS,
+                                      updated_since=self.last_update_time - UPDATE_OVERLAP)
+            for row in rows:
+                self.tasks[row.id] = row
+
+            # tasks which left the watched states, e.g. finished or deleted
+            if self.db.count_tasks(self.states) != len(self.tasks):
+                ids = set(row.id for row in self.db.list_tasks(self.states, columns=["id"]))
+                self.tasks = {task_id: row for task_id, row in self.tasks.items() if task_id in ids}
+
+        update_times = [row.update_time for row in rows if row.update_time is not None]
+        if len(update_times) > 0:
+            self.last_update_time = max(update_times + [self.last_update_time or update_times[0]])
+        elif self.last_update_time is None:
+            self.last_update_time = datetime.datetime.utcnow()
+
+        self.__update_gpus()
+
+    def draw(self):
+        lines = self.gpu_lines + [''] + self.__format_tasks()
+        height = shutil.get_terminal_size().lines - 1
+        lines = lines[:height]
+
+        output = []
+        for row, line in enumerate(lines):
+            if row >= len(self.lines) or self.lines[row] != line:
+                output.append(move_cursor(row) + line + CLEAR_LINE)
+        if len(lines) < len(self.lines):
+            output.append(move_cursor(len(lines)) + CLEAR_BELOW)
+
+        self.lines = lines
+        if len(output) > 0:
+            self.out.write("".join(output))
+            self.out.flush()
+
+    def __update_gpus(self):
+        # the status file is only read when the server rewrote it
+        try:
+            mtime = os.stat(self.status_path).st_mtime_ns
+        except FileNotFoundError:
+            self.status_mtime = None
+            self.gpu_lines = ["server is not running"]
+            return
+
+        if mtime == self.status_mtime:
+            return
+
+        try:
+            with open(self.status_path, 'r') as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.status_mtime = mtime
+        table = [[gpu["id"], f"{gpu['load'] * 100:.0f}%", f"{gpu['memory_used']:.0f}/{gpu['memory_total']:.0f}MB",
+                  " ".join(str(task_id) for task_id in gpu["tasks"])] for gpu in status["gpus"]]
+        self.gpu_lines = tabulate(table, headers=["GPU", "LOAD", "MEMORY", "TASKS"]).splitlines()
+
+    def __format_tasks(self):
+        tasks = sorted(self.tasks.values(), key=lambda t: (t.state, t.priority, t.submit_time, t.id))
+        if self.limit is not None:
+            tasks = tasks[:self.limit]
+
+        table = [[t.id, colored(STATE.get_state_str(t.state), STATE.get_state_color(t.state)), t.priority,
+                  t.submit_time.strftime("%Y-%m-%d %H:%M:%S") if t.submit_time is not None else None,
+                  t.execute_time.strftime("%Y-%m-%d %H:%M:%S") if t.execute_time is not None else None,
+                  t.system_pid, t.occupied_gpus, t.num_gpus_required, t.command] for t in tasks]
+        return tabulate(table, headers=["ID", "STATE", "PRIORITY", "SUBMIT_TIME", "EXECUTE_TIME", "SYSTEM_PID",
+                                        "OCCUPIED_GPUS", "NUM_GPUS", "COMMAND"]).splitlines()
@@ -0,0 +1,41 @@
+import os
+import socket
+
+
+# Unix datagram socket the clients send a notification to when tasks have changed, read by the event
+# loop of the server to schedule immediately instead of waiting for the fallback polling
+class NotifyListener(object):
+    def __init__(self, notify_path):
+        self.notify_path = notify_path
+
+        if os.path.exists(notify_path):
+            os.remove(notify_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(notify_path)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def drain(self):
+        try:
+            while self.sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.notify_path):
+            os.remove(self.notify_path)
+
+
+def notify_server(notify_path):
+    # tell the server that tasks have changed, do nothing if the server is not running
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(b"1", notify_path)
+    except OSError:
+        pass
+    finally:
+        sock.close()
@@ -0,0 +1,80 @@
+import signal
+from collections import namedtuple
+
+
+# Retry policy of the failed tasks: a failed run is classified by `describe_failure`, then `RetryPolicy`
+# decides whether and when the task runs again, and with which gpus
+
+# kinds of failures
+FAILURE_EXIT = "exit"
+FAILURE_SIGNAL = "signal"
+FAILURE_OOM = "oom"
+FAILURE_LOST = "lost"
+FAILURE_LAUNCH = "launch"
+# the command can not run (not executable, not found), retrying does not help
+FAILURE_COMMAND = "command"
+
+# exit codes of the shell and of launcher.py for commands which can not run
+COMMAND_EXIT_CODES = [126, 127]
+
+# next run of a failed task: unix time it is queued again and its changed requirements
+Retry = namedtuple("Retry", ["retry_time", "num_gpus", "exclude_gpus", "memory"])
+
+
+def describe_failure(exit_code, error=None):
+    # (kind, reason) of a finished run, (None, None) if it succeeded
+    # error: "oom" and "lost" reported for the process, or the message of a launch failure
+    if error == FAILURE_LOST:
+        return FAILURE_LOST, "lost with its agent"
+    if exit_code is None:
+        return FAILURE_LAUNCH, f"failed to launch: {error}"
+    if exit_code == 0:
+        return None, None
+    if error == FAILURE_OOM:
+        return FAILURE_OOM, f"out of gpu memory, exit code {exit_code}"
+    if exit_code < 0:
+        try:
+            name = signal.Signals(-exit_code).name
+        except ValueError:
+            name = f"signal {-exit_code}"
+        return FAILURE_SIGNAL, f"killed by {name}"
+    if exit_code in COMMAND_EXIT_CODES:
+        return FAILURE_COMMAND, f"command can not run, exit code {exit_code}"
+    return FAILURE_EXIT, f"exit code {exit_code}"
+
+
+class RetryPolicy(object):
+    # failed tasks run at most `max_attempts` times, the n-th retry waits `backoff * 2 ** (n - 1)` seconds
+    # up to `max_backoff`, and at most `max_per_minute` retries start per minute over all tasks so that
+    # tasks failing fast do not keep the scheduler busy
+    # tasks out of gpu memory are retried on whole gpus if they shared them, otherwise according to `on_oom`:
+    # "more_gpus" with twice the gpus, "exclude_gpus" away from the gpus they failed on, None unchanged
+    def __init__(self, max_attempts, backoff, max_backoff, max_per_minute, on_oom=None):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_per_minute = max_per_minute
+        self.on_oom = on_oom
+        # earliest time the next retry can start
+        self.next_slot = 0
+
+    def decide(self, job, kind, num_retries, now, all_gpus):
+        # `Retry` of the failed `job`, None if it is not retried
+        if kind == FAILURE_COMMAND or num_retries + 1 >= self.max_attempts:
+            return None
+
+        retry_time = max(now + min(self.backoff * 2 ** num_retries, self.max_backoff), self.next_slot)
+        self.next_slot = retry_time + 60 / self.max_per_minute
+
+        num_gpus, exclude_gpus, memory = job.num_gpus, list(job.exclude_gpus), job.memory
+        if kind == FAILURE_OOM:
+            if memory is not None:
+                memory = None
+            elif self.on_oom == "more_gpus":
+                num_gpus = min(num_gpus * 2, len(all_gpus))
+            elif self.on_oom == "exclude_gpus":
+                excluded = sorted(set(exclude_gpus + list(job.gpu_ids or [])))
+                # unless too few gpus would be left to ever run it
+                if len([gpu for gpu in all_gpus if gpu not in excluded]) >= num_gpus:
+                    exclude_gpus = excluded
+        return Retry(retry_time, num_gpus, exclude_gpus, memory)
@@ -0,0 +1,295 @@
+import os
+import pwd
+import json
+import queue
+import socket
+import struct
+import datetime
+import threading
+from collections import namedtuple
+
+
+# Local API of the running server over a unix stream socket, one json object per line:
+# - request:  {"id": 1, "method": "add_tasks", "params": {...}}
+# - response: {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+# - after a "watch" request the server pushes {"event": "...", ...} until the client disconnects
+# requests are handled on behalf of the user running the client process, as told by the kernel
+# only the standard library is imported so that the client starts fast
+
+
+class RPCError(Exception):
+    pass
+
+
+def encode(message):
+    return (json.dumps(message, default=encode_value, separators=(',', ':')) + "\n").encode()
+
+
+def decode(line):
+    return json.loads(line, object_hook=decode_value)
+
+
+def encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not serializable")
+
+
+def decode_value(value):
+    if len(value) == 1 and "$datetime" in value:
+        return datetime.datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+def get_user_name(uid):
+    # the uid itself if it has no passwd entry, e.g. in a container
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def get_peer_uid(conn):
+    # uid of the process at the other end of a unix socket, the client can not pretend to be another user
+    pid, uid, gid = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+    return uid
+
+
+class Watcher(object):
+    # a client watching the events: they are queued and sent by its own thread so that a client which does not
+    # read them (e.g. piped into `less`) never blocks the publishers, `send` fails once `max_queued` are waiting
+    def __init__(self, conn, max_queued):
+        self.conn = conn
+        self.queue = queue.Queue(max_queued)
+        threading.Thread(target=self.__send_loop, daemon=True).start()
+
+    def send(self, message):
+        # False if the client is too slow
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        # stop the sender, the connection is shut down so that a blocked send and the reading thread return
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __send_loop(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            try:
+                self.conn.sendall(message)
+            except OSError:
+                # disconnected, or closed by `close`
+                break
+
+
+class RPCServer(object):
+    # serve each connection in its own thread, `handle_request(method, params, uid)` returns the result
+    # or raises, errors are sent back to the client, uid is the user of the client process
+    # at most `max_queued` events wait for each watching client, slower clients are dropped
+    def __init__(self, path, handle_request, logger, max_queued=10000):
+        self.path = path
+        self.handle_request = handle_request
+        self.logger = logger
+        self.max_queued = max_queued
+
+        self.sock = None
+        # only held to change the watchers and to queue the events, never while sending
+        self.watchers = []
+        self.watchers_lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(16)
+        threading.Thread(target=self.__accept_loop, daemon=True).start()
+
+    def stop(self):
+        if self.sock is None:
+            return
+
+        try:
+            # wake up the accept loop
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        with self.watchers_lock:
+            watchers, self.watchers = self.watchers, []
+        for watcher in watchers:
+            watcher.close()
+
+    def publish(self, event, **data):
+        # queue an event for all watching clients, the ones too slow to read them are dropped
+        # the events are queued under the lock so that all clients receive them in the same order
+        message = encode(dict(event=event, time=datetime.datetime.utcnow(), **data))
+        dropped = []
+        with self.watchers_lock:
+            for watcher in list(self.watchers):
+                if not watcher.send(message):
+                    self.watchers.remove(watcher)
+                    dropped.append(watcher)
+        for watcher in dropped:
+            self.logger.error(f"drop a watching client, {self.max_queued} events are waiting to be sent")
+            watcher.close()
+
+    def __accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                # closed by stop
+                break
+            threading.Thread(target=self.__serve, args=(conn,), daemon=True).start()
+
+    def __serve(self, conn):
+        watcher = None
+        try:
+            uid = get_peer_uid(conn)
+            with conn, conn.makefile('rb') as f:
+                for line in f:
+                    request = decode(line)
+                    if request.get("method") == "watch":
+                        # the reply is the first message sent by the watcher
+                        watcher = Watcher(conn, self.max_queued)
+                        watcher.send(encode({"id": request.get("id"), "result": True}))
+                        with self.watchers_lock:
+                            self.watchers.append(watcher)
+                        continue
+
+                    try:
+                        response = {"result": self.handle_request(request["method"], request.get("params", {}), uid)}
+                    except Exception as e:
+                        response = {"error": f"{type(e).__name__}: {e}"}
+                    response["id"] = request.get("id")
+                    conn.sendall(encode(response))
+        except (OSError, ValueError) as e:
+            self.logger.error(f"rpc connection closed: {e}")
+        finally:
+            if watcher is not None:
+                with self.watchers_lock:
+                    if watcher in self.watchers:
+                        self.watchers.remove(watcher)
+                watcher.close()
+
+
+class RPCClient(object):
+    def __init__(self, path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rb')
+        self.next_id = 0
+
+    def call(self, method, **params):
+        self.next_id += 1
+        self.sock.sendall(encode({"id": self.next_id, "method": method, "params": params}))
+        response = self.__read()
+        if "error" in response:
+            raise RPCError(response["error"])
+        return response["result"]
+
+    def watch(self):
+        # yield the events published by the server, the connection can not be used for calls anymore
+        self.call("watch")
+        self.sock.settimeout(None)
+        while True:
+            yield self.__read()
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __read(self):
+        line = self.file.readline()
+        if line == b'':
+            raise RPCError("connection closed by the server")
+        return decode(line)
+
+
+def connect_server(path, timeout=None):
+    # the client of the running server, None if it is not running
+    try:
+        return RPCClient(path, timeout)
+    except OSError:
+        return None
+
+
+class RPCDatabase(object):
+    # the part of `GPUTaskDatabase` used by the client, answered by the running server
+    def __init__(self, client):
+        self.client = client
+
+    def add_task(self, command, num_gpus_required, exclude_gpus, estimated_runtime=None, memory_required=None,
+                 after=[], owner=None, preemptible=False):
+        return self.client.call("add_task", command=command, num_gpus_required=num_gpus_required,
+                                exclude_gpus=exclude_gpus, estimated_runtime=estimated_runtime,
+                                memory_required=memory_required, after=after, owner=owner, preemptible=preemptible)
+
+    def add_tasks(self, tasks):
+        return self.client.call("add_tasks", tasks=tasks)
+
+    def add_sweep(self, command, axes, size, num_gpus_required, exclude_gpus, estimated_runtime=None,
+                  memory_required=None, owner=None, preemptible=False, stop_exit_code=None, max_failures=None):
+        return self.client.call("add_sweep", command=command, axes=axes, size=size,
+                                num_gpus_required=num_gpus_required, exclude_gpus=exclude_gpus,
+                                estimated_runtime=estimated_runtime, memory_required=memory_required, owner=owner,
+                                preemptible=preemptible, stop_exit_code=stop_exit_code, max_failures=max_failures)
+
+    def list_tasks(self, states, limit=None, offset=0, since=None, until=None, command=None, columns=None,
+                   updated_since=None, sweep_id=None, hide_sweep_points=False):
+        params = dict(states=states, limit=limit, offset=offset, since=since, until=until, command=command,
+                      updated_since=updated_since, sweep_id=sweep_id, hide_sweep_points=hide_sweep_points)
+        if columns is not None:
+            params["columns"] = columns
+        result = self.client.call("list_tasks", **params)
+
+        row_type = namedtuple("TaskRow", result["columns"])
+        return [row_type(*row) for row in result["rows"]]
+
+    def count_tasks(self, states):
+        return self.client.call("count_tasks", states=states)
+
+    def get_task_log(self, task_id):
+        result = self.client.call("get_task_log", task_id=task_id)
+        return None if result is None else tuple(result)
+
+    def get_task_usage(self, task_id):
+        return self.client.call("get_task_usage", task_id=task_id)
+
+    def list_user_usage(self, since=None, until=None):
+        return [tuple(row) for row in self.client.call("list_user_usage", since=since, until=until)]
+
+    def list_sweeps(self, active=True):
+        return self.client.call("list_sweeps", active=active)
+
+    def stop_sweep(self, sweep_id):
+        return self.client.call("stop_sweep", sweep_id=sweep_id)
+
+    def remove_queuing_task(self, task_id):
+        return self.client.call("remove_queuing_task", task_id=task_id)
+
+    def update_task_priority(self, task_id, priority):
+        return self.client.call("update_task_priority", task_id=task_id, priority=priority)
+
+    def remove_all(self):
+        return self.client.call("remove_all")
+
+    def watch(self):
+        return self.client.watch()
@@ -0,0 +1,283 @@
+import math
+import heapq
+from collections import namedtuple
+
+
+# lightweight view of a task used by the schedulers, times are unix timestamps in seconds
+# - estimated_runtime: user-supplied runtime estimate in seconds, None if unknown
+# - start_time, gpu_ids: only set for running jobs
+# - memory: gpu memory in MB required on each device, None if the job needs whole devices
+# - owner: user who submitted the job, priority: smaller values first, used by `FairShare`
+# - preemptible: the job can be stopped and queued again for a job of higher priority, see `select_victims`
+Job = namedtuple("Job", ["id", "num_gpus", "exclude_gpus", "estimated_runtime", "start_time", "gpu_ids", "memory",
+                         "owner", "priority", "preemptible"],
+                 defaults=[None, None, None, None, None, 100, False])
+
+# the job at the head of the queue that does not fit now, it will start at `start_time` on `gpu_ids`
+Reservation = namedtuple("Reservation", ["job", "start_time", "gpu_ids"])
+
+
+def first_fit(job, free_gpus, free_memory):
+    # jobs without memory requirement take the first `num_gpus` idle devices which are not excluded,
+    # jobs with memory requirement are packed with best fit on the free memory of shareable devices
+    if job.memory is None:
+        candidates = [gpu for gpu in free_gpus if gpu not in job.exclude_gpus]
+        if len(candidates) < job.num_gpus:
+            return None
+        return candidates[:job.num_gpus]
+
+    candidates = sorted((memory - job.memory, gpu) for gpu, memory in free_memory.items()
+                        if gpu not in job.exclude_gpus and memory >= job.memory)
+    if len(candidates) < job.num_gpus:
+        return None
+    return sorted(gpu for _, gpu in candidates[:job.num_gpus])
+
+
+def allocate(job, gpu_ids, free_gpus, free_memory):
+    # remaining free devices and memory after launching `job` on `gpu_ids`
+    free_gpus = [gpu for gpu in free_gpus if gpu not in gpu_ids]
+    free_memory = dict(free_memory)
+    for gpu in gpu_ids:
+        if job.memory is None:
+            free_memory.pop(gpu, None)
+        elif gpu in free_memory:
+            free_memory[gpu] -= job.memory
+    return free_gpus, free_memory
+
+
+class FIFOScheduler(object):
+    # launch jobs in queue order and stop at the first job that does not fit
+    def __init__(self, placement=first_fit):
+        self.placement = placement
+
+    def schedule(self, queue, running, free_gpus, now, free_memory=None):
+        free_gpus = list(free_gpus)
+        free_memory = dict(free_memory or {})
+        launches = []
+        for job in queue:
+            gpu_ids = self.placement(job, free_gpus, free_memory)
+            if gpu_ids is None:
+                return launches, Reservation(job, math.inf, [])
+
+            launches.append((job, gpu_ids))
+            free_gpus, free_memory = allocate(job, gpu_ids, free_gpus, free_memory)
+
+        return launches, None
+
+
+class EasyBackfillScheduler(object):
+    # EASY backfilling:
+    # 1. launch jobs in queue order while they fit
+    # 2. the first job that does not fit gets a reservation at the earliest time enough gpus are released,
+    #    according to the runtime estimates of running jobs
+    # 3. later jobs are backfilled on free gpus if they do not delay that reservation, i.e. they either
+    #    finish before the reserved start time or only use gpus which are not reserved
+    # jobs without runtime estimate are assumed to run `default_runtime` seconds
+    def __init__(self, default_runtime, placement=first_fit):
+        self.default_runtime = default_runtime
+        self.placement = placement
+
+    def schedule(self, queue, running, free_gpus, now, free_memory=None):
+        # free_gpus: idle devices, free_memory: free memory of the devices that can be shared
+        free_gpus = list(free_gpus)
+        free_memory = dict(free_memory or {})
+        running = list(running)
+        launches = []
+        reservation = None
+
+        for job in queue:
+            candidate_gpus, candidate_memory = free_gpus, free_memory
+            if reservation is not None and now + self.__runtime(job) > reservation.start_time:
+                candidate_gpus = [gpu for gpu in free_gpus if gpu not in reservation.gpu_ids]
+                candidate_memory = {gpu: memory for gpu, memory in free_memory.items()
+                                    if gpu not in reservation.gpu_ids}
+
+            gpu_ids = self.placement(job, candidate_gpus, candidate_memory)
+            if gpu_ids is not None:
+                launches.append((job, gpu_ids))
+                running.append(job._replace(start_time=now, gpu_ids=gpu_ids))
+                free_gpus, free_memory = allocate(job, gpu_ids, free_gpus, free_memory)
+            elif reservation is None:
+                reservation = self.__reserve(job, running, free_gpus, now)
+
+        return launches, reservation
+
+    def __runtime(self, job):
+        if job.estimated_runtime is None:
+            return self.default_runtime
+        return job.estimated_runtime
+
+    def __reserve(self, job, running, free_gpus, now):
+        # a device is released when all jobs running on it are expected to end,
+        # release devices in that order until the job fits on whole devices
+        release_times = {}
+        for r in running:
+            end_time = max(now, r.start_time + self.__runtime(r))
+            for gpu in r.gpu_ids:
+                release_times[gpu] = max(release_times.get(gpu, end_time), end_time)
+
+        available = list(free_gpus)
+        for gpu, end_time in sorted(release_times.items(), key=lambda x: x[1]):
+            available.append(gpu)
+            reserved_gpus = self.placement(job._replace(memory=None), available, {})
+            if reserved_gpus is not None:
+                return Reservation(job, end_time, reserved_gpus)
+
+        # never fits with the managed jobs only (e.g. gpus used by other users), do not block others
+        return Reservation(job, math.inf, [])
+
+
+class FairShare(object):
+    # orders the queue between users by their usage: gpu seconds decayed with a half life of `half_life`
+    # seconds, divided by their share (`shares`, 1 by default)
+    # the queue is taken in priority order, the order of the jobs of each user is kept and the next job is
+    # taken from the user with the smallest priority then the smallest usage, using a heap of the users,
+    # the usage of a user grows with the expected gpu time of each job taken for it
+    # jobs beyond the gpu quota of their user (`quotas`, `default_quota` by default, None for no limit)
+    # are left out
+    def __init__(self, half_life, default_runtime, shares=None, quotas=None, default_quota=None):
+        self.half_life = half_life
+        self.default_runtime = default_runtime
+        self.shares = shares or {}
+        self.quotas = quotas or {}
+        self.default_quota = default_quota
+        # owner -> usage at `last_decay_time`
+        self.usage = {}
+        self.last_decay_time = 0
+
+    def charge(self, owner, gpu_seconds, now):
+        # add the gpu time of a finished job, at its finish time
+        self.__decay(now)
+        self.usage[owner] = self.usage.get(owner, 0) + gpu_seconds
+
+    def get_usage(self, owner, now):
+        return self.usage.get(owner, 0) * 0.5 ** ((now - self.last_decay_time) / self.half_life)
+
+    def order(self, queue, running, now):
+        # queue: jobs waiting, in priority order, running: jobs running with their start time and gpus
+        used_gpus = {}
+        usage = {}
+        for job in running:
+            used_gpus[job.owner] = used_gpus.get(job.owner, 0) + len(job.gpu_ids)
+            usage[job.owner] = usage.get(job.owner, 0) + len(job.gpu_ids) * max(0, now - job.start_time)
+
+        jobs = {}
+        for index, job in enumerate(queue):
+            jobs.setdefault(job.owner, []).append((index, job))
+
+        heap = []
+        for owner, owner_jobs in jobs.items():
+            usage[owner] = self.get_usage(owner, now) + usage.get(owner, 0)
+            index, job = owner_jobs[0]
+            heapq.heappush(heap, (job.priority, self.__normalize(owner, usage[owner]), index, owner, 0))
+
+        ordered = []
+        while len(heap) > 0:
+            _, _, _, owner, position = heapq.heappop(heap)
+            _, job = jobs[owner][position]
+            quota = self.quotas.get(owner, self.default_quota)
+            if quota is not None and used_gpus.get(owner, 0) + job.num_gpus > quota:
+                # later jobs of the owner wait for this one
+                continue
+
+            ordered.append(job)
+            used_gpus[owner] = used_gpus.get(owner, 0) + job.num_gpus
+            usage[owner] += job.num_gpus * self.__runtime(job)
+            if position + 1 < len(jobs[owner]):
+                index, job = jobs[owner][position + 1]
+                heapq.heappush(heap, (job.priority, self.__normalize(owner, usage[owner]), index, owner, position + 1))
+        return ordered
+
+    def __normalize(self, owner, usage):
+        return usage / self.shares.get(owner, 1)
+
+    def __runtime(self, job):
+        if job.estimated_runtime is None:
+            return self.default_runtime
+        return job.estimated_runtime
+
+    def __decay(self, now):
+        for owner in self.usage:
+            self.usage[owner] = self.get_usage(owner, now)
+        self.last_decay_time = now
+
+
+def select_victims(job, running, free_gpus, now, get_domain=None):
+    # running jobs to preempt so that `job` fits on whole devices, None if it can not fit
+    # victims are preemptible jobs of a lower priority (larger value) on whole devices, chosen to lose the least
+    # gpu time since they started: a knapsack over the devices they free, solved for each domain of devices
+    # which can be allocated together (e.g. the hosts of a cluster, see `get_domain`)
+    if get_domain is None:
+        get_domain = lambda gpu: None
+
+    free = {}
+    for gpu in free_gpus:
+        if gpu not in job.exclude_gpus:
+            free[get_domain(gpu)] = free.get(get_domain(gpu), 0) + 1
+
+    candidates = {}
+    for r in running:
+        if not r.preemptible or r.priority <= job.priority or r.memory is not None or len(r.gpu_ids) == 0:
+            continue
+        num_gpus = len([gpu for gpu in r.gpu_ids if gpu not in job.exclude_gpus])
+        if num_gpus > 0:
+            lost_time = len(r.gpu_ids) * max(0, now - r.start_time)
+            candidates.setdefault(get_domain(r.gpu_ids[0]), []).append((r, num_gpus, lost_time))
+
+    best = None
+    for domain, jobs in candidates.items():
+        needed = job.num_gpus - free.get(domain, 0)
+        if needed <= 0:
+            # fits without preemption, e.g. on gpus used by other processes now
+            return []
+
+        # cost[n]: (lost gpu time, number of victims, victims) to free at least n devices
+        cost = [(0, 0, [])] + [None] * needed
+        for r, num_gpus, lost_time in jobs:
+            for n in range(needed, -1, -1):
+                if cost[n] is None:
+                    continue
+                m = min(needed, n + num_gpus)
+                option = (cost[n][0] + lost_time, cost[n][1] + 1, cost[n][2] + [r])
+                if cost[m] is None or option[:2] < cost[m][:2]:
+                    cost[m] = option
+        if cost[needed] is not None and (best is None or cost[needed][:2] < best[:2]):
+            best = cost[needed]
+
+    return None if best is None else best[2]
+
+
+# decisions of a scheduling pass: the jobs to launch with their gpus, the reservation of the first job which does
+# not fit (None if all fit) and the running jobs to preempt for it
+Plan = namedtuple("Plan", ["launches", "reservation", "victims"])
+
+
+class SchedulingPolicy(object):
+    # a scheduling pass of the server, also run by simulator.py on a virtual clock:
+    # 1. the queue, in priority order, is ordered between users by `fair_share` if any
+    # 2. `scheduler` launches the jobs which fit and reserves gpus for the first one which does not
+    # 3. running jobs are preempted for the reserved job if its priority is at most `preempt_priority`
+    #    (None never preempts), see `select_victims`
+    def __init__(self, scheduler, fair_share=None, preempt_priority=None, get_domain=None):
+        self.scheduler = scheduler
+        self.fair_share = fair_share
+        self.preempt_priority = preempt_priority
+        self.get_domain = get_domain
+
+    def plan(self, queue, running, free_gpus, now, free_memory=None, can_preempt=True):
+        # `can_preempt` False when a preemption is still in progress
+        if self.fair_share is not None:
+            queue = self.fair_share.order(queue, running, now)
+        launches, reservation = self.scheduler.schedule(queue, running, free_gpus, now, free_memory)
+
+        victims = []
+        if can_preempt and self.preempt_priority is not None and reservation is not None \
+                and reservation.job.priority <= self.preempt_priority:
+            # on the gpus left after the launches
+            running = list(running)
+            free_memory = dict(free_memory or {})
+            for job, gpu_ids in launches:
+                running.append(job._replace(start_time=now, gpu_ids=gpu_ids))
+                free_gpus, free_memory = allocate(job, gpu_ids, free_gpus, free_memory)
+            victims = select_victims(reservation.job, running, free_gpus, now, self.get_domain) or []
+        return Plan(launches, reservation, victims)
@@ -1,146 +1,442 @@
+import math
 from math import inf
 import os
+import sys
+import json
 import time
-import subprocess
+import asyncio
 import argparse
 import datetime
 import signal
+import cProfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import GPUtil
 from pony import orm
 
 from config import *
 from constant import *
 
-from database import get_database
-from util import is_pid_alive, get_logger
+from dag import DependencyGraph
+from eventlog import EventLog
+from database import LIST_COLUMNS, get_database
+from devices import DeviceState, NVMLProvider, Occupant, get_device_provider
+from launcher import read_status
+from metrics import MetricsServer, ServerMetrics
+from notify import NotifyListener
+from retry import RetryPolicy, describe_failure
+from rpc import RPCServer, get_user_name
+from scheduler import Job, FIFOScheduler, EasyBackfillScheduler, FairShare, SchedulingPolicy, first_fit
+from telemetry import TelemetryRecorder
+from topology import TopologyPlacement, load_topology
+from util import is_pid_alive, get_logger, get_process_start_time, get_process_cmdline
+
+
+# wrapper of the task processes, see launcher.py
+LAUNCHER_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "launcher.py")
+
+
+def write_status(status_path, status):
+    # replaced atomically so that readers never see a partial file
+    tmp_path = f"{status_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(status)
+    os.replace(tmp_path, status_path)
+
+
+class AdoptedProcess(object):
+    # a task started by a previous run of the server, it is not a child of this one: its exit is noticed
+    # through a pidfd (polled where not supported) and its exit code is read from the launcher status file
+    def __init__(self, pid, start_time, status_path):
+        self.pid = pid
+        self.start_time = start_time
+        self.status_path = status_path
+        self.returncode = None
+
+    async def wait(self):
+        if self.returncode is not None:
+            return self.returncode
+
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+
+        if pidfd is not None:
+            loop = asyncio.get_running_loop()
+            exited = asyncio.Event()
+            loop.add_reader(pidfd, exited.set)
+            try:
+                await exited.wait()
+            finally:
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+        else:
+            while get_process_start_time(self.pid) == self.start_time and is_pid_alive(self.pid):
+                await asyncio.sleep(1)
+
+        status = read_status(self.status_path)
+        # -1 if the launcher was killed before writing the exit code
+        self.returncode = status[0] if status is not None else -1
+        return self.returncode
 
 
 class GPUManager(object):
-    def __init__(self, logger):
+    # keeps an in-memory table of the devices, refreshed by the `sample_loop` coroutine,
+    # so that scheduling decisions never wait for the probe
+    # once started, the device table is published to `status_path` for the client
+    def __init__(self, logger, provider, sample_interval=GPU_SAMPLE_INTERVAL,
+                 min_probe_interval=GPU_MIN_PROBE_INTERVAL, on_change=None, status_path=None,
+                 task_status_dir=TASK_STATUS_DIR, task_log_dir=TASK_LOG_DIR, telemetry_dir=TELEMETRY_DIR,
+                 telemetry_interval=TELEMETRY_INTERVAL):
         self.logger = logger
+        self.provider = provider
+        self.sample_interval = sample_interval
+        self.min_probe_interval = min_probe_interval
+        self.on_change = on_change
+        self.status_path = status_path
+        self.task_status_dir = task_status_dir
+        self.task_log_dir = task_log_dir
+        self.telemetry_interval = telemetry_interval
+        self.telemetry = TelemetryRecorder(telemetry_dir, TELEMETRY_MAX_SAMPLES)
+        self.status_lock = threading.Lock()
+        self.last_status = None
 
-        self.all_gpus = self.__get_all_gpus()
-        self.gpu_process = [None for _ in range(len(self.all_gpus))]
+        # `ServerMetrics` of the server, the probes are timed
+        self.metrics = None
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.last_probe_time = 0
+        self.refresh_event = asyncio.Event()
+        self.is_started = False
+        self.refresh()
+        self.all_gpus = sorted(self.devices.keys())
+        # interconnect of the gpus, read by `load_topology` when the server starts
+        self.topology = None
 
-    def get_gpus(self, num_gpus, exclude_gpus):
-        gpu_ids = self.__find_avaiable_devices(num_gpus, exclude_gpus)
-        # while len(gpu_ids) < num_gpus:
-        #     self.logger.info(f"Avaiable GPU devices are {gpu_ids}, but requires {num_gpus} devices")
-        #     time.sleep(find_gpu_delay)
-        #     gpu_ids = self.__find_avaiable_devices(num_gpus, exclude_gpus)
-        
-        if len(gpu_ids) < num_gpus:
+    def start(self):
+        self.is_started = True
+        self.__write_status()
+
+    def stop(self):
+        if self.is_started and self.status_path is not None and os.path.exists(self.status_path):
+            os.remove(self.status_path)
+        self.provider.close()
+
+    async def sample_loop(self):
+        # resample every `sample_interval` seconds, or when requested but at most once per `min_probe_interval`,
+        # the probe runs in a worker thread so that a slow driver never blocks the event loop
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self.refresh_event.wait(), self.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.refresh_event.clear()
+
+            wait_time = self.last_probe_time + self.min_probe_interval - time.time()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            await loop.run_in_executor(None, self.refresh)
+
+    async def telemetry_loop(self):
+        # sample the running tasks every `telemetry_interval` seconds from the cached device table and /proc,
+        # in a worker thread
+        if self.telemetry_interval is None:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.telemetry_interval)
+            await loop.run_in_executor(None, self.record_telemetry)
+
+    def record_telemetry(self):
+        tasks = {}
+        with self.lock:
+            for gpu, device in sorted(self.devices.items()):
+                occupants = device.get_running_occupants()
+                for occupant in occupants:
+                    # the launcher is the leader of the session of the task
+                    _, devices = tasks.setdefault(occupant.task_id, (occupant.process.pid, []))
+                    devices.append((device.load, device.memory_used, len(occupants), device.processes))
+        try:
+            self.telemetry.record(tasks, time.time())
+        except OSError as e:
+            self.logger.error(f"failed to record telemetry: {e}")
+
+    def load_topology(self):
+        # from the saved output at GPU_TOPOLOGY_PATH, otherwise from `nvidia-smi topo -m` only when the gpus are
+        # probed through NVML, the other backends may not have real gpus behind them
+        if GPU_TOPOLOGY_PATH is not None or isinstance(self.provider, NVMLProvider):
+            self.topology = load_topology(GPU_TOPOLOGY_PATH)
+        if self.topology is None:
+            self.logger.info("gpu topology is not available, use first fit placement")
+
+    def get_placement(self):
+        # how the schedulers choose the devices of a task
+        return first_fit if self.topology is None else TopologyPlacement(self.topology)
+
+    async def launch(self, job, command, gpu_ids):
+        # start the task through launcher.py as an asyncio subprocess which only sees `gpu_ids`, in its own
+        # session so that it keeps running when the server is stopped from a terminal
+        # its output is written to its log file by the launcher, never through the server
+        env = os.environ.copy()
+        env['CUDA_VISIBLE_DEVICES'] = ",".join([str(gpu) for gpu in gpu_ids])
+        status_path = self.__get_task_status_path(job.id)
+        if os.path.exists(status_path):
+            os.remove(status_path)
+
+        os.makedirs(self.task_log_dir, exist_ok=True)
+        log_path = os.path.join(self.task_log_dir, f"{job.id}.log")
+        log_args = ["--log", log_path, "--max-bytes", str(TASK_LOG_MAX_BYTES), "--backups", str(TASK_LOG_BACKUP_COUNT)]
+        if TASK_LOG_COMPRESS:
+            log_args.append("--compress")
+
+        process = await asyncio.create_subprocess_exec(sys.executable, LAUNCHER_PATH, *log_args, status_path,
+                                                       *command.split(), env=env, start_new_session=True)
+        process.start_time = get_process_start_time(process.pid)
+        process.status_path = status_path
+        process.log_path = log_path
+        return process
+
+    def adopt(self, job, pid, start_time):
+        # the process of a task started by a previous run of the server, None if it is gone
+        # the start time and the command line tell it apart from a later process reusing the pid
+        status_path = self.__get_task_status_path(job.id)
+        if start_time is None or get_process_start_time(pid) != start_time:
             return None
-        else:
-            return gpu_ids
+        cmdline = get_process_cmdline(pid)
+        if cmdline is None or LAUNCHER_PATH not in cmdline or status_path not in cmdline:
+            return None
+        return AdoptedProcess(pid, start_time, status_path)
+
+    def read_exit_status(self, task_id):
+        # (exit code, error) of a task which exited while the server was stopped, None if unknown
+        return read_status(self.__get_task_status_path(task_id))
+
+    def remove_exit_status(self, task_id):
+        # once the end of the task is written to task.db, its status file is not needed anymore
+        try:
+            os.remove(self.__get_task_status_path(task_id))
+        except FileNotFoundError:
+            pass
+
+    def read_exit(self, process, exit_code):
+        # (exit code, error) reported by the launcher of an exited task, e.g. -9 and "oom" for a task killed by the
+        # oom killer, read before `release_gpus`, the exit code of the launcher if it did not report them
+        status = read_status(process.status_path)
+        return (exit_code, None) if status is None else status
+
+    def send_signal(self, process, signum):
+        # to the launcher, which forwards it to the task, SIGKILL can not be forwarded: it kills the process group of
+        # the launcher, the task and its launcher (whose status file is not written then)
+        try:
+            if signum == signal.SIGKILL:
+                os.killpg(process.pid, signum)
+            else:
+                os.kill(process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def get_domain(self, gpu):
+        # all local gpus can be allocated together
+        return None
+
+    def get_status(self):
+        with self.lock:
+            return [{
+                "id": gpu,
+                "load": device.load,
+                "memory_used": device.memory_used,
+                "memory_total": device.memory_total,
+                "tasks": [o.task_id for o in device.get_running_occupants()],
+            } for gpu, device in sorted(self.devices.items())]
+
+    def request_refresh(self):
+        # resample as soon as the rate limit allows, e.g. a task has just exited, from the event loop only
+        self.refresh_event.set()
+
+    def refresh(self):
+        start = time.perf_counter()
+        try:
+            samples = self.provider.probe()
+        except Exception as e:
+            self.logger.error(f"failed to probe gpus: {e}")
+            return
+        if self.metrics is not None:
+            self.metrics.probe_duration.observe(time.perf_counter() - start)
+
+        sample_time = time.time()
+        with self.lock:
+            self.last_probe_time = sample_time
+            before = self.__find_avaiable_devices()
+            for sample in samples:
+                if sample.id not in self.devices:
+                    self.devices[sample.id] = DeviceState(sample.id)
+                self.devices[sample.id].update(sample, sample_time)
+            after = self.__find_avaiable_devices()
+
+        if before != after and self.on_change is not None:
+            self.on_change()
+        self.__write_status()
+
+    def get_available_gpus(self):
+        # idle devices which are not occupied by running tasks, answered from the cache
+        with self.lock:
+            return self.__find_avaiable_devices()
+
+    def get_free_memory(self):
+        # free memory of the devices that tasks declaring their memory can be packed on:
+        # idle devices and devices only shared by such tasks
+        with self.lock:
+            free_memory = {}
+            for gpu, device in sorted(self.devices.items()):
+                if device.is_occupied():
+                    if not device.is_shareable() or math.isnan(device.memory_used):
+                        continue
+                elif not device.is_idle(max_load=0.1, max_memory=0.1):
+                    continue
+                free_memory[gpu] = device.get_free_memory()
+            return free_memory
     
-    def update_gpu_process(self, gpu_ids, process):
-        is_success = self.release_gpus(process.pid)
-        if is_success:
+    def update_gpu_process(self, gpu_ids, process, task_id=None, memory=None):
+        with self.lock:
             for gpu in gpu_ids:
-                self.gpu_process[gpu] = process
-        else:
-            raise ValueError(f"Process {self.gpu_process[gpu_ids[0]].pid} on GPU {gpu_ids} is not finished")
-    
-    def release_gpus(self, pid):
-        for idx, _proc in enumerate(self.gpu_process):
-            if _proc is None:
-                continue
+                device = self.devices[gpu]
+                if device.is_occupied() and (memory is None or not device.is_shareable()):
+                    pids = [o.process.pid for o in device.get_running_occupants()]
+                    raise ValueError(f"Process {pids} on GPU {gpu} is not finished")
 
-            if _proc.pid == pid:
-                if _proc.poll() is None:
-                    return False
-                else:
-                    self.gpu_process[idx] = None
-        
-        return True
-
-    def __get_all_gpus(self):
-        return [gpu.id for gpu in GPUtil.getGPUs()]
-
-    def __find_avaiable_devices(self, num_gpus, exclude_gpus):
-        gpu_ids = GPUtil.getAvailable(
-            order='first',
-            limit=inf,
-            maxLoad=0.1,
-            maxMemory=0.1,
-            includeNan=False,
-            excludeID=exclude_gpus,
-            excludeUUID=[]
-            )
-        
-        gpu_ids = [gpu for gpu in gpu_ids if not self.__is_gpu_occupied(gpu)]
+            for gpu in gpu_ids:
+                self.devices[gpu].occupants.append(Occupant(task_id, process, memory))
 
-        return gpu_ids[:num_gpus]
+        self.__write_status()
     
-    def __is_gpu_occupied(self, gpu):
-        _proc = self.gpu_process[gpu]
-        if _proc is None:
-            return False
-        else:
-            return _proc.poll() is None
+    def release_gpus(self, process):
+        # remove the exited process from its devices
+        # its status file is kept until the end of the task is written to task.db: if the server is killed first,
+        # the next start still reads how it exited, see `read_exit_status`
+        with self.lock:
+            for device in self.devices.values():
+                device.occupants = [o for o in device.occupants if o.process is not process]
+
+        self.request_refresh()
+        self.__write_status()
+
+    def __write_status(self):
+        # only rewritten when changed
+        if self.status_path is None or not self.is_started:
+            return
+
+        with self.status_lock:
+            status = json.dumps({"pid": os.getpid(), "gpus": self.get_status()})
+            if status != self.last_status:
+                write_status(self.status_path, status)
+                self.last_status = status
+
+    def __get_task_status_path(self, task_id):
+        os.makedirs(self.task_status_dir, exist_ok=True)
+        return os.path.join(self.task_status_dir, f"{task_id}.json")
+
+    def __find_avaiable_devices(self):
+        return [gpu for gpu, device in sorted(self.devices.items())
+                if device.is_idle(max_load=0.1, max_memory=0.1) and not device.is_occupied()]
+
+
+def get_scheduler(name, placement=first_fit):
+    if name == "backfill":
+        return EasyBackfillScheduler(DEFAULT_ESTIMATED_RUNTIME, placement)
+    elif name == "fifo":
+        return FIFOScheduler(placement)
+    else:
+        raise ValueError(f"Unknown scheduler: {name}")
+
+
+# database methods the client can call through the rpc api
+RPC_METHODS = ["add_task", "add_tasks", "add_sweep", "list_tasks", "list_sweeps", "count_tasks", "get_task_log",
+               "get_task_usage", "list_user_usage", "remove_queuing_task", "update_task_priority", "stop_sweep",
+               "remove_all"]
+
+
+def handle_database_request(database, method, params):
+    # answer a call of `RPCDatabase`, rows are sent as lists
+    if method not in RPC_METHODS:
+        raise ValueError(f"Unknown method: {method}")
+
+    result = getattr(database, method)(**params)
+    if method == "list_tasks":
+        return {"columns": params.get("columns", LIST_COLUMNS), "rows": [list(row) for row in result]}
+    return result
 
 
 class GPUTaskManagerServer(object):
-    def __init__(self, database, logger):
+    # asyncio runtime, each concern is a coroutine of the event loop:
+    # - scheduling: woken up by submissions, exits and gpu changes, launches tasks as asyncio subprocesses
+    # - supervision: one coroutine per running task waits for its exit and captures the exit code
+    # - gpu sampling: `GPUManager.sample_loop`, and the resource usage of the tasks: `GPUManager.telemetry_loop`
+    # - persistence: changes of the tasks are written behind in batches by a single database thread
+    # the server is the only writer of task.db while it is running, clients use the rpc api at `rpc_path`
+    def __init__(self, database, logger, gpu_manager=None, rpc_path=RPC_PATH, notify_path=NOTIFY_PATH, event_log=None):
         self.db = database
         self.logger = logger
-        self.gpu_manager = GPUManager(logger)
+        if gpu_manager is None:
+            gpu_manager = GPUManager(logger, get_device_provider(GPU_BACKEND, NUM_FAKE_GPUS, logger),
+                                     status_path=STATUS_PATH)
+        self.gpu_manager = gpu_manager
+        self.gpu_manager.on_change = self.__request_schedule
+        self.metrics = ServerMetrics(lambda: len(self.gpu_manager.get_available_gpus()))
+        self.gpu_manager.metrics = self.metrics
+        self.metrics_server = None
+        if METRICS_PORT is not None:
+            self.metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT, self.metrics, logger)
+        # cProfile of the next `profile_ticks` scheduling passes, see PROFILE_SIGNAL
+        self.profiler = None
+        self.profile_ticks = 0
+        # created when the server starts, once the placement of the gpus is known, see `__run`
+        self.scheduler = None
+        self.policy = None
+        self.rpc_server = RPCServer(rpc_path, self.__handle_request, logger)
+        if event_log is None:
+            event_log = EventLog(EVENT_LOG_PATH, EVENT_LOG_MAX_BYTES, EVENT_LOG_BACKUP_COUNT)
+        self.event_log = event_log
+        self.notify_path = notify_path
+        self.fair_share = None
+        if FAIR_SHARE:
+            self.fair_share = FairShare(FAIR_SHARE_HALF_LIFE, DEFAULT_ESTIMATED_RUNTIME, USER_SHARES, USER_GPU_QUOTAS,
+                                        DEFAULT_GPU_QUOTA)
+        self.retry_policy = RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BACKOFF, RETRY_MAX_BACKOFF, RETRY_MAX_PER_MINUTE,
+                                        RETRY_ON_OOM)
+        # earliest time a retrying task is queued again, None if no task is retrying
+        self.next_retry_time = None
+        # dependencies of the queued tasks, and the ids of the tasks added to it, only used by the database thread
+        self.dependencies = DependencyGraph()
+        self.dependencies_loaded = set()
+        # set when task.db may have been changed by a client without the server (--local), e.g. a parent of the
+        # blocked tasks deleted, see `__check_parents`
+        self.is_changed_locally = False
 
-        self.is_stop_requested = False
+        self.loop = None
+        self.schedule_event = None
+        self.write_event = None
+        self.db_executor = None
+        # (function, task id, arguments) applied to the tasks by the database thread
+        self.pending_writes = []
+        # writes which failed because task.db was busy, applied before the next ones, only used by the database thread
+        self.failed_writes = []
+        # task id -> (Job, process) and the coroutines waiting for them
+        self.running = {}
+        self.supervisors = {}
+        # preempted task id -> (id of the task it is preempted for, timer sending SIGTERM after the grace period, then
+        # SIGKILL after another one)
+        self.preemptions = {}
 
-        signal.signal(signal.SIGINT, self.__stop)
-        signal.signal(signal.SIGTERM, self.__stop)
+        self.is_stop_requested = False
+        self.last_compaction_time = 0
 
     def __start(self):
-        self.__rollback_tasks()
-
-        while not self.is_stop_requested:
-            self.__check_if_task_done()
-            # read next command from database
-            with orm.db_session:
-                task = self.db.get_next_task()
-                if task is not None:
-                    self.logger.info(f"task: {task.id}, {task.command}")
-                    
-                    # 1. update task's state
-                    self.logger.info(f"change task {task.id} from {STATE.get_state_str(task.state)} to {STATE.get_state_str(STATE.PENDING)}")
-                    task.state = STATE.PENDING
-                    orm.commit()
-                    
-                    # 2. find available gpus
-                    gpu_ids = self.gpu_manager.get_gpus(task.num_gpus_required, task.exclude_gpus)
-                    
-                    # no avaiable gpus
-                    while gpu_ids is None:
-                        if self.is_stop_requested:
-                            break
-                        time.sleep(DELAY)
-                        gpu_ids = self.gpu_manager.get_gpus(task.num_gpus_required, task.exclude_gpus)
-                    
-                    if self.is_stop_requested:
-                        break
-
-                    # update task's occupied_gpus
-                    task.occupied_gpus = gpu_ids
-                    orm.commit()
-                    
-                    # 3. execute in background
-                    self.logger.info(f"run command {task.command} in background")
-                    process = self.__run_background_process(task.command.split(), gpu_ids)
-                    task.state = STATE.RUNNING
-                    task.system_pid = process.pid
-                    task.execute_time = datetime.datetime.utcnow()
-                    orm.commit()
-
-                    self.gpu_manager.update_gpu_process(gpu_ids, process)
-                
-            time.sleep(DELAY)
-        
-        self.logger.info("stop requested")
-        self.__check_if_task_done()
-        # self.__rollback_tasks()
+        running_tasks = self.__rollback_tasks()
+        if self.fair_share is not None:
+            self.__load_usage()
+        asyncio.run(self.__run(running_tasks))
 
         with orm.db_session:
             server = self.db.get_server_by_pid(os.getpid())
@@ -150,38 +446,611 @@ class GPUTaskManagerServer(object):
             else:
                 self.logger.error("internal error when stopping")
 
-        
+    async def __run(self, running_tasks):
+        self.loop = asyncio.get_running_loop()
+        self.schedule_event = asyncio.Event()
+        self.write_event = asyncio.Event()
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self.loop.add_signal_handler(signal.SIGINT, self.__stop)
+        self.loop.add_signal_handler(signal.SIGTERM, self.__stop)
+        self.loop.add_signal_handler(signal.Signals[PROFILE_SIGNAL], self.__start_profile)
+        notify_listener = NotifyListener(self.notify_path)
+        self.loop.add_reader(notify_listener.fileno(), self.__on_notify, notify_listener)
+
+        self.event_log.start()
+        self.gpu_manager.start()
+        self.gpu_manager.load_topology()
+        self.scheduler = get_scheduler(SCHEDULER, self.gpu_manager.get_placement())
+        self.policy = SchedulingPolicy(self.scheduler, self.fair_share, PREEMPT_PRIORITY if PREEMPTION else None,
+                                       self.gpu_manager.get_domain)
+        self.__recover_tasks(running_tasks)
+        self.rpc_server.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        workers = [asyncio.create_task(self.gpu_manager.sample_loop()),
+                   asyncio.create_task(self.gpu_manager.telemetry_loop()), asyncio.create_task(self.__persist_loop())]
+        try:
+            await self.__schedule_loop()
+        finally:
+            self.logger.info("stop requested")
+            self.rpc_server.stop()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+            self.loop.remove_reader(notify_listener.fileno())
+            notify_listener.close()
+            # running tasks are left running, they are adopted at the next start
+            for worker in workers + list(self.supervisors.values()):
+                worker.cancel()
+            await self.__run_db()
+            for _ in range(DB_STOP_RETRIES):
+                if len(self.failed_writes) == 0:
+                    break
+                await asyncio.sleep(DB_RETRY_DELAY)
+                await self.__run_db()
+            if len(self.failed_writes) > 0:
+                self.logger.error(f"{len(self.failed_writes)} task changes are not written, "
+                                  f"the tasks still running in task.db are recovered from their status files")
+            self.gpu_manager.stop()
+            self.db_executor.shutdown()
+            self.event_log.stop()
+
+    def __publish(self, event, **data):
+        # to the watching clients and to the event log
+        self.rpc_server.publish(event, **data)
+        self.event_log.emit(event, **data)
+
     def __stop(self, *args):
         self.is_stop_requested = True
-                
+        self.schedule_event.set()
+
+    def __start_profile(self):
+        # everything run by the event loop is profiled, the database thread is not
+        if self.profiler is not None:
+            return
+        self.logger.info(f"profile the next {PROFILE_TICKS} scheduling passes")
+        self.profiler = cProfile.Profile()
+        self.profile_ticks = PROFILE_TICKS
+        self.profiler.enable()
+
+    def __count_profiled_tick(self):
+        self.profile_ticks -= 1
+        if self.profile_ticks > 0:
+            return
+
+        self.profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"server-{os.getpid()}-{int(time.time())}.prof")
+        self.profiler.dump_stats(path)
+        self.profiler = None
+        self.logger.info(f"profile written to {path}, read it with `python -m pstats {path}`")
+
+    def __request_schedule(self):
+        # thread safe, e.g. called by the gpu sampling or the rpc threads
+        try:
+            self.loop.call_soon_threadsafe(self.schedule_event.set)
+        except (AttributeError, RuntimeError):
+            # not started or already stopped
+            pass
+
+    def __on_notify(self, notify_listener):
+        # sent by the clients which changed task.db themselves
+        notify_listener.drain()
+        self.is_changed_locally = True
+        self.schedule_event.set()
+
+    def __handle_request(self, method, params, uid):
+        # called from the rpc threads, changes wake up the scheduling loop and are published to watchers
+        # new tasks are owned by the user of the client process, whatever owner the client sent, and users other than
+        # the admins only change their own tasks and sweeps
+        owner = get_user_name(uid)
+        if method in ["add_task", "add_sweep"]:
+            params = dict(params, owner=owner)
+        elif method == "add_tasks":
+            params = dict(params, tasks=[dict(task, owner=owner) for task in params.get("tasks", [])])
+        elif method in ["remove_queuing_task", "update_task_priority", "stop_sweep", "remove_all"]:
+            params = dict(params, owner=None if owner in ADMIN_USERS else owner)
+        future = asyncio.run_coroutine_threadsafe(
+            self.__run_db(handle_database_request, self.db, method, params), self.loop)
+        result = future.result()
+
+        if method == "add_task":
+            self.__publish("submitted", task_ids=[result])
+        elif method == "add_tasks" and result is not None:
+            self.__publish("submitted", first_id=result[0], last_id=result[1])
+        elif method == "add_sweep":
+            self.__publish("sweep_submitted", sweep_id=result)
+        elif method == "stop_sweep" and result is not None:
+            self.__publish("sweep_stopped", sweep_id=params["sweep_id"], task_ids=result, reason="stopped by user")
+        elif method == "remove_queuing_task" and result in (STATE.QUEUING, STATE.RETRYING):
+            self.__publish("deleted", task_ids=[params["task_id"]])
+            asyncio.run_coroutine_threadsafe(self.__run_db(self.__on_tasks_deleted, [params["task_id"]]),
+                                             self.loop).result()
+        elif method == "update_task_priority" and result is not None:
+            self.__publish("priority", task_ids=[params["task_id"]], priority=params["priority"])
+            self.loop.call_soon_threadsafe(self.__update_running_priority, params["task_id"], params["priority"])
+        elif method == "remove_all" and len(result) > 0:
+            self.__publish("deleted", task_ids=result)
+            asyncio.run_coroutine_threadsafe(self.__run_db(self.__on_tasks_deleted, result), self.loop).result()
+
+        if method not in ["list_tasks", "list_sweeps", "count_tasks", "get_task_log", "get_task_usage",
+                          "list_user_usage"]:
+            self.__request_schedule()
+        return result
+
+    async def __schedule_loop(self):
+        while not self.is_stop_requested:
+            start = time.perf_counter()
+            await self.__schedule()
+            self.metrics.schedule_duration.observe(time.perf_counter() - start)
+            if self.profiler is not None:
+                self.__count_profiled_tick()
+            # sleep until a task is submitted or finished or a retrying task is due,
+            # poll for gpus released by others as a fallback
+            timeout = DELAY
+            if self.next_retry_time is not None:
+                timeout = min(timeout, max(0, (self.next_retry_time - datetime.datetime.utcnow()).total_seconds()))
+            try:
+                await asyncio.wait_for(self.schedule_event.wait(), timeout)
+                self.metrics.wakeups.inc(cause="event")
+            except asyncio.TimeoutError:
+                self.metrics.wakeups.inc(cause="timeout")
+                if timeout == DELAY:
+                    await self.__run_db(self.__compact_history)
+                    # in case a notification was lost
+                    self.is_changed_locally = True
+            self.schedule_event.clear()
+
+    async def __schedule(self):
+        is_changed_locally, self.is_changed_locally = self.is_changed_locally, False
+        try:
+            queue = await self.__run_db(self.__load_queue, len(self.gpu_manager.get_available_gpus()),
+                                        self.gpu_manager.get_free_memory(), is_changed_locally)
+        except orm.OperationalError as e:
+            # task.db is busy, schedule again after a while
+            self.logger.error(f"failed to load the queue: {e}")
+            self.is_changed_locally = self.is_changed_locally or is_changed_locally
+            self.loop.call_later(DB_RETRY_DELAY, self.schedule_event.set)
+            return
+        if len(queue) == 0:
+            return
+
+        jobs = [job for job, _, _ in queue]
+        running = [job for job, _ in self.running.values()]
+        free_gpus = self.gpu_manager.get_available_gpus()
+        free_memory = self.gpu_manager.get_free_memory()
+        # one preemption at a time, the gpus of its victims are free once they exited
+        plan = self.policy.plan(jobs, running, free_gpus, time.time(), free_memory,
+                                can_preempt=len(self.preemptions) == 0)
+        reservation = plan.reservation
+
+        commands = {job.id: command for job, command, _ in queue}
+        for job, gpu_ids in plan.launches:
+            await self.__launch(job, commands[job.id], gpu_ids)
+
+        if len(plan.victims) > 0:
+            self.__preempt(reservation.job, plan.victims)
+
+        for job, _, state in queue:
+            if job.id in self.running:
+                continue
+            if state == STATE.PENDING and (reservation is None or reservation.job.id != job.id):
+                self.__write(self.__set_state, job.id, STATE.QUEUING)
+            elif state != STATE.PENDING and reservation is not None and reservation.job.id == job.id:
+                self.logger.info("change task %s from %s to %s", job.id, STATE.get_state_str(state),
+                                 STATE.get_state_str(STATE.PENDING))
+                self.__write(self.__set_state, job.id, STATE.PENDING)
+                self.__publish("pending", task_ids=[job.id])
+                if reservation.start_time == inf:
+                    self.logger.info("task %s can not be reserved, requires %s gpus", job.id, job.num_gpus)
+                else:
+                    self.logger.info("task %s reserved gpus %s at %s", job.id, reservation.gpu_ids,
+                                     datetime.datetime.fromtimestamp(reservation.start_time))
+
+    async def __launch(self, job, command, gpu_ids):
+        self.logger.info("launch task %s on gpus %s: %s", job.id, gpu_ids, command)
+        try:
+            process = await self.gpu_manager.launch(job, command, gpu_ids)
+        except OSError as e:
+            # e.g. the command does not exist, or the agent of the gpus is lost
+            self.logger.error("failed to launch task %s: %s", job.id, e)
+            self.metrics.launch_failures.inc()
+            self.__write(self.__set_finished, job.id, job, None, str(e), datetime.datetime.utcnow(),
+                         self.gpu_manager.all_gpus)
+            return
+
+        self.running[job.id] = (job._replace(start_time=time.time(), gpu_ids=gpu_ids), process)
+        self.metrics.launches.inc()
+        self.gpu_manager.update_gpu_process(gpu_ids, process, job.id, job.memory)
+        self.__write(self.__set_running, job.id, gpu_ids, process.pid, process.start_time, process.log_path,
+                     datetime.datetime.utcnow())
+        self.supervisors[job.id] = asyncio.create_task(self.__supervise(job.id, process))
+
+    async def __supervise(self, task_id, process):
+        exit_code, error = self.gpu_manager.read_exit(process, await process.wait())
+
+        job, _ = self.running.pop(task_id)
+        del self.supervisors[task_id]
+        self.gpu_manager.release_gpus(process)
+        if self.fair_share is not None:
+            now = time.time()
+            self.fair_share.charge(job.owner, len(job.gpu_ids) * max(0, now - job.start_time), now)
+        preemption = self.preemptions.pop(task_id, None)
+        kind, _ = describe_failure(exit_code, error)
+        self.metrics.exits.inc(outcome="preempted" if preemption is not None else kind or "done")
+        if preemption is not None:
+            preemptor_id, timer = preemption
+            timer.cancel()
+            self.__write(self.__set_preempted, task_id, preemptor_id, exit_code, datetime.datetime.utcnow())
+        else:
+            self.__write(self.__set_finished, task_id, job, exit_code, error, datetime.datetime.utcnow(),
+                         self.gpu_manager.all_gpus)
+        self.schedule_event.set()
+
+    def __preempt(self, job, victims):
+        # stop the `victims` so that `job` fits, they are queued again when they exit
+        victims = [victim for victim in victims if victim.id in self.running]
+        if len(victims) == 0:
+            return
+
+        victim_ids = [victim.id for victim in victims]
+        self.logger.info("preempt tasks %s for task %s, stop them in %ss", victim_ids, job.id, PREEMPT_GRACE_PERIOD)
+        for victim in victims:
+            _, process = self.running[victim.id]
+            self.gpu_manager.send_signal(process, signal.Signals[PREEMPT_SIGNAL])
+            timer = self.loop.call_later(PREEMPT_GRACE_PERIOD, self.__stop_victim, victim.id, process, signal.SIGTERM)
+            self.preemptions[victim.id] = (job.id, timer)
+        self.__publish("preempting", task_ids=victim_ids, preemptor_id=job.id)
+
+    def __stop_victim(self, task_id, process, signum):
+        # a victim still running after the grace period receives SIGTERM, and SIGKILL after another one if it ignores
+        # SIGTERM, otherwise no other preemption could run and the task it is preempted for would wait forever
+        preemptor_id, _ = self.preemptions[task_id]
+        self.logger.info("task %s preempted for task %s is still running, send %s", task_id, preemptor_id,
+                         signal.Signals(signum).name)
+        self.gpu_manager.send_signal(process, signum)
+        if signum == signal.SIGTERM:
+            timer = self.loop.call_later(PREEMPT_GRACE_PERIOD, self.__stop_victim, task_id, process, signal.SIGKILL)
+            self.preemptions[task_id] = (preemptor_id, timer)
+
+    def __update_running_priority(self, task_id, priority):
+        # running jobs are only preempted for jobs of a higher priority
+        if task_id in self.running:
+            job, process = self.running[task_id]
+            self.running[task_id] = (job._replace(priority=priority), process)
+
+    def __to_job(self, task):
+        start_time = None
+        if task.execute_time is not None:
+            start_time = task.execute_time.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+        return Job(task.id, task.num_gpus_required, list(task.exclude_gpus or []), task.estimated_runtime,
+                   start_time, list(task.occupied_gpus or []), task.memory_required, task.owner, task.priority,
+                   task.preemptible)
+
+    def __load_usage(self):
+        # usage of the users from the tasks finished within the last 10 half lives, older ones count for < 0.1%
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=10 * FAIR_SHARE_HALF_LIFE)
+        for owner, num_gpus, execute_time, finish_time in self.db.list_usage(since):
+            finish_time = finish_time.replace(tzinfo=datetime.timezone.utc).timestamp()
+            start_time = execute_time.replace(tzinfo=datetime.timezone.utc).timestamp()
+            self.fair_share.charge(owner, num_gpus * max(0, finish_time - start_time), finish_time)
+
+    async def __persist_loop(self):
+        while True:
+            await self.write_event.wait()
+            self.write_event.clear()
+            await self.__run_db()
+            if len(self.failed_writes) > 0:
+                await asyncio.sleep(DB_RETRY_DELAY)
+                self.write_event.set()
+
+    def __write(self, func, task_id, *args):
+        # applied later by the database thread, together with the other pending writes
+        self.pending_writes.append((func, task_id, args))
+        self.write_event.set()
+
+    async def __run_db(self, func=None, *args):
+        # run `func` in the database thread after the pending writes, so that it sees them
+        writes, self.pending_writes = self.pending_writes, []
+        return await self.loop.run_in_executor(self.db_executor, self.__run_in_db_thread, writes, func, args)
+
+    def __run_in_db_thread(self, writes, func, args):
+        # the writes are never dropped while task.db is busy, otherwise it would not match the running tasks, e.g. a
+        # task left running in task.db would run again at the next start
+        writes, self.failed_writes = self.failed_writes + writes, []
+        if len(writes) > 0:
+            start = time.perf_counter()
+            try:
+                self.__apply_writes(writes)
+                self.metrics.db_write_duration.observe(time.perf_counter() - start)
+                self.__on_written(writes)
+            except orm.OperationalError as e:
+                # e.g. "database is locked" after DB_BUSY_TIMEOUT, by a client using task.db or by a compaction
+                self.logger.error(f"failed to write {len(writes)} task changes, retry them: {e}")
+                self.failed_writes = writes
+            except Exception as e:
+                # e.g. when committing
+                self.logger.error(f"failed to write {len(writes)} task changes, write them one by one: {e}")
+                self.__apply_writes_one_by_one(writes)
+
+        if func is not None:
+            return func(*args)
+
+    def __apply_writes_one_by_one(self, writes):
+        # so that a change which can never be written does not drop the others
+        for i, (func, task_id, args) in enumerate(writes):
+            try:
+                self.__apply_writes([(func, task_id, args)])
+                self.__on_written([(func, task_id, args)])
+            except orm.OperationalError as e:
+                self.logger.error(f"failed to write {len(writes) - i} task changes, retry them: {e}")
+                self.failed_writes = writes[i:]
+                return
+            except Exception as e:
+                self.logger.exception(f"failed to write {func.__name__} of task {task_id}: {e}")
+
+    def __on_written(self, writes):
+        # the status files of the runs whose end is in task.db are not read by `__recover_tasks` anymore
+        for func, task_id, _ in writes:
+            if func in (self.__set_finished, self.__set_preempted):
+                self.gpu_manager.remove_exit_status(task_id)
+
+    @orm.db_session(immediate=True)
+    def __apply_writes(self, writes):
+        # in a single transaction which takes the write lock of task.db first: if task.db is busy, nothing is applied,
+        # neither the changes of the tasks nor the changes of the server made with them (events, dependencies...)
+        for func, task_id, args in writes:
+            task = self.db.get_task_by_id(task_id)
+            if task is None:
+                # deleted by a client in the meantime
+                continue
+            try:
+                func(task, *args)
+            except orm.OperationalError:
+                raise
+            except Exception as e:
+                # a change which can not be applied does not drop the others
+                self.logger.exception(f"failed to write {func.__name__} of task {task_id}: {e}")
+
+    @orm.db_session(immediate=True)
+    def __load_queue(self, num_free_gpus, free_memory, is_changed_locally=False):
+        # with the write lock first, like `__apply_writes`, since the changes of the dependencies are not rolled back
+        requeued, self.next_retry_time = self.db.requeue_retrying_tasks(datetime.datetime.utcnow())
+        if len(requeued) > 0:
+            self.logger.info("retry tasks %s", requeued)
+        # points of the sweeps for the free gpus, another pass follows to expand more of them if they all fitted
+        expanded = self.db.expand_sweeps(num_free_gpus, free_memory)
+        for sweep_id, task_ids in expanded.items():
+            self.logger.info("expand sweep %s into tasks %s", sweep_id, task_ids)
+            self.__publish("submitted", task_ids=task_ids, sweep_id=sweep_id)
+        if len(expanded) > 0:
+            self.__request_schedule()
+
+        # tasks waiting for their dependencies are not scheduled
+        queue = []
+        cancelled = set(self.__check_parents() if is_changed_locally else [])
+        num_tasks = {STATE.get_state_str(state): 0 for state in [STATE.PENDING, STATE.QUEUING]}
+        for task in self.db.find_schedulable_tasks():
+            if task.id in cancelled:
+                continue
+            if len(task.after or []) > 0 and task.id not in self.dependencies_loaded:
+                cancelled.update(self.__load_dependencies(task))
+                if task.id in cancelled:
+                    continue
+            num_tasks[STATE.get_state_str(task.state)] += 1
+            if not self.dependencies.is_blocked(task.id):
+                queue.append((self.__to_job(task), task.command, task.state))
+
+        num_tasks[STATE.get_state_str(STATE.RUNNING)] = len(self.running)
+        self.metrics.tasks.set_all(num_tasks, "state")
+        return queue
+
+    def __load_dependencies(self, task):
+        # add a task to the dependency graph the first time it is queued, return the ids of the cancelled tasks:
+        # the task and its dependents if one of its dependencies failed or was deleted
+        unfinished = []
+        for parent_id in task.after:
+            if self.db.get_task_by_id(parent_id) is not None:
+                unfinished.append(parent_id)
+                continue
+
+            parent = self.db.get_history_by_id(parent_id)
+            if parent is None or parent.state != STATE.DONE:
+                self.__set_cancelled(task, parent_id)
+                return [task.id] + self.__cancel_dependents(task.id)
+
+        self.dependencies.add(task.id, unfinished)
+        self.dependencies_loaded.add(task.id)
+        return []
+
+    def __check_parents(self):
+        # the parents of the blocked tasks deleted by a client without the server (--local) are found in a single
+        # query, their dependents are cancelled like on `remove_queuing_task`, return the ids of the cancelled tasks
+        parent_ids = list(self.dependencies.children)
+        queued = set(self.db.find_task_ids(parent_ids))
+        cancelled = []
+        for parent_id in parent_ids:
+            if parent_id in queued:
+                continue
+            parent = self.db.get_history_by_id(parent_id)
+            if parent is not None and parent.state == STATE.DONE:
+                self.dependencies.set_done(parent_id)
+            else:
+                self.logger.info("task %s was deleted by a client", parent_id)
+                cancelled += self.__cancel_dependents(parent_id)
+        return cancelled
+
+    def __cancel_dependents(self, task_id):
+        # the tasks depending on `task_id` directly or not can never run, return their ids
+        cancelled = self.dependencies.set_failed(task_id)
+        for child_id in cancelled:
+            self.dependencies_loaded.discard(child_id)
+            child = self.db.get_task_by_id(child_id)
+            if child is not None:
+                self.__set_cancelled(child, task_id)
+        return cancelled
+
     @orm.db_session
-    def __check_if_task_done(self):
-        self.logger.info("check done task")
-        for task in self.db.find_tasks_by_state(STATE.RUNNING):
-            if self.gpu_manager.release_gpus(task.system_pid) or not is_pid_alive(task.system_pid):
-                self.logger.info(f"task {task.id} is done")
-                task.state = STATE.DONE
-    
+    def __on_tasks_deleted(self, task_ids):
+        for task_id in task_ids:
+            self.dependencies_loaded.discard(task_id)
+            self.__cancel_dependents(task_id)
+
+    def __set_state(self, task, state):
+        task.state = state
+
+    def __set_running(self, task, gpu_ids, pid, process_start_time, log_path, execute_time):
+        task.occupied_gpus = gpu_ids
+        task.state = STATE.RUNNING
+        task.system_pid = pid
+        task.process_start_time = process_start_time
+        task.log_path = log_path
+        task.execute_time = execute_time
+        # since it was submitted, or queued again after a failed or preempted run
+        queued_time = max(t for t in [task.submit_time, task.finish_time, task.retry_time] if t is not None)
+        wait = max(0, (execute_time - queued_time).total_seconds())
+        self.metrics.queue_wait.observe(wait)
+        self.__publish("launched", task_ids=[task.id], gpus=gpu_ids, pid=pid, wait=wait)
+
+    def __set_finished(self, task, job, exit_code, error, finish_time, all_gpus):
+        # record the end of a run, a failed task is retried according to the retry policy,
+        # the decision is made here since it depends on the number of retries stored with the task
+        kind, reason = describe_failure(exit_code, error)
+        if task.sweep_id is not None and self.db.is_sweep_stop_code(task.sweep_id, exit_code):
+            kind, reason = None, None
+        runtime = self.__add_gpu_time(task, finish_time)
+        task.exit_code = exit_code
+        task.failure_reason = reason
+        task.finish_time = finish_time
+        if kind is None:
+            self.logger.info("task %s is done with exit code %s", task.id, exit_code)
+            task.state = STATE.DONE
+            self.__finish_sweep_point(task, True)
+            self.db.archive_task(task)
+            self.__publish("done", task_ids=[task.id], exit_code=exit_code, runtime=runtime)
+            self.dependencies_loaded.discard(task.id)
+            self.dependencies.set_done(task.id)
+            return
+
+        num_retries = task.num_retries or 0
+        retry = self.retry_policy.decide(job, kind, num_retries, time.time(), all_gpus)
+        if retry is None:
+            self.logger.info("task %s failed after %s runs: %s", task.id, num_retries + 1, reason)
+            task.state = STATE.FAILED
+            self.__finish_sweep_point(task, False)
+            self.db.archive_task(task)
+            self.__publish("failed", task_ids=[task.id], exit_code=exit_code, reason=reason, runtime=runtime)
+            self.dependencies_loaded.discard(task.id)
+            self.__cancel_dependents(task.id)
+            return
+
+        retry_time = datetime.datetime.utcfromtimestamp(retry.retry_time)
+        self.logger.info("task %s failed: %s, retry %s at %s with %s gpus, exclude gpus %s, memory %s", task.id, reason,
+                         num_retries + 1, retry_time, retry.num_gpus, retry.exclude_gpus, retry.memory)
+        task.state = STATE.RETRYING
+        task.num_retries = num_retries + 1
+        task.retry_time = retry_time
+        task.num_gpus_required = retry.num_gpus
+        task.exclude_gpus = retry.exclude_gpus
+        task.memory_required = retry.memory
+        task.occupied_gpus = []
+        task.system_pid = None
+        task.process_start_time = None
+        self.__publish("retrying", task_ids=[task.id], exit_code=exit_code, reason=reason, retry_time=retry_time,
+                       runtime=runtime)
+
+    def __finish_sweep_point(self, task, is_done):
+        if task.sweep_id is None:
+            return
+        stopped = self.db.finish_sweep_point(task, is_done)
+        if stopped is not None:
+            reason, deleted = stopped
+            self.logger.info("sweep %s is stopped: %s, delete its queued tasks %s", task.sweep_id, reason, deleted)
+            self.__publish("sweep_stopped", sweep_id=task.sweep_id, task_ids=deleted, reason=reason)
+
+    def __set_preempted(self, task, preemptor_id, exit_code, finish_time):
+        # queued again whatever its exit code, in its original place in the queue, it resumes from its checkpoint
+        reason = f"preempted for task {preemptor_id}"
+        self.logger.info("task %s is %s with exit code %s, queue it again", task.id, reason, exit_code)
+        runtime = self.__add_gpu_time(task, finish_time)
+        task.state = STATE.QUEUING
+        task.exit_code = exit_code
+        task.failure_reason = reason
+        task.finish_time = finish_time
+        task.occupied_gpus = []
+        task.system_pid = None
+        task.process_start_time = None
+        self.__publish("preempted", task_ids=[task.id], exit_code=exit_code, preemptor_id=preemptor_id,
+                       runtime=runtime)
+
+    def __add_gpu_time(self, task, finish_time):
+        # gpu seconds of all the runs of the task, return the seconds of this run, None if it failed to launch
+        # since it has no pid
+        if task.system_pid is None or task.execute_time is None:
+            return None
+        run_time = max(0, (finish_time - task.execute_time).total_seconds())
+        task.gpu_time = (task.gpu_time or 0) + len(task.occupied_gpus or []) * run_time
+        return run_time
+
+    def __set_cancelled(self, task, parent_id):
+        reason = f"dependency {parent_id} failed or was deleted"
+        self.logger.info("task %s is cancelled: %s", task.id, reason)
+        task.state = STATE.FAILED
+        task.failure_reason = reason
+        task.finish_time = datetime.datetime.utcnow()
+        self.db.archive_task(task)
+        self.__publish("failed", task_ids=[task.id], exit_code=None, reason=reason)
+
+    def __compact_history(self):
+        # run while the server is idle, at most once per COMPACTION_INTERVAL
+        if time.time() - self.last_compaction_time < COMPACTION_INTERVAL:
+            return
+
+        self.last_compaction_time = time.time()
+        if HISTORY_RETENTION_DAYS is not None:
+            num_removed = self.db.remove_expired_history(HISTORY_RETENTION_DAYS)
+            self.logger.info(f"removed {num_removed} tasks finished more than {HISTORY_RETENTION_DAYS} days ago")
+
+        self.logger.info("compact database")
+        self.db.compact()
+
     @orm.db_session
     def __rollback_tasks(self):
+        # return the tasks which were running when the server stopped, as (Job, pid, process start time)
+        num_archived = self.db.archive_done_tasks()
+        if num_archived > 0:
+            self.logger.info(f"archived {num_archived} done tasks")
+
         self.logger.info("rollback pending tasks")
         for task in self.db.find_tasks_by_state(STATE.PENDING):
             self.logger.info(f"change state of task {task.id} \
                                 from {STATE.get_state_str(task.state)} to {STATE.get_state_str(STATE.QUEUING)}")
             task.state = STATE.QUEUING
-        
-        self.logger.info("roll back running tasks")
-        for task in self.db.find_tasks_by_state(STATE.RUNNING):
-            self.logger.info(f"change state of task {task.id} \
-                                from {STATE.get_state_str(task.state)} to {STATE.get_state_str(STATE.QUEUING)}")
-            task.state = STATE.QUEUING
 
-    def __run_background_process(self, cmd, gpu_ids):
-        env = os.environ.copy()
-        env['CUDA_VISIBLE_DEVICES'] = ",".join([str(gpu) for gpu in gpu_ids])
-        proc = subprocess.Popen(cmd, env=env)
-        return proc
-    
+        return [(self.__to_job(task), task.system_pid, task.process_start_time)
+                for task in self.db.find_tasks_by_state(STATE.RUNNING)]
+
+    def __recover_tasks(self, tasks):
+        # tasks still running are adopted, tasks which exited meanwhile are done,
+        # the others (e.g. killed with the host) are queued again
+        self.logger.info("recover running tasks")
+        for job, pid, start_time in tasks:
+            process = None if pid is None else self.gpu_manager.adopt(job, pid, start_time)
+            if process is not None:
+                self.logger.info(f"task {job.id} is still running with pid {pid}")
+                self.running[job.id] = (job, process)
+                self.gpu_manager.update_gpu_process(job.gpu_ids, process, job.id, job.memory)
+                self.supervisors[job.id] = asyncio.create_task(self.__supervise(job.id, process))
+                continue
+
+            status = self.gpu_manager.read_exit_status(job.id)
+            if status is not None:
+                self.logger.info(f"task {job.id} exited with exit code {status[0]} while the server was stopped")
+                self.__write(self.__set_finished, job.id, job, status[0], status[1], datetime.datetime.utcnow(),
+                             self.gpu_manager.all_gpus)
+            else:
+                self.logger.info(f"task {job.id} is gone, change its state to {STATE.get_state_str(STATE.QUEUING)}")
+                self.__write(self.__set_state, job.id, STATE.QUEUING)
 
     def start(self):
         can_start = False
@@ -241,7 +1110,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     db = get_database()
-    logger = get_logger(LOG_PATH)
+    logger = get_logger(LOG_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN)
     server = GPUTaskManagerServer(db, logger)
     
     if args.mode == "start":
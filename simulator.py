@@ -0,0 +1,348 @@
+import math
+import time
+import heapq
+import bisect
+import random
+import sqlite3
+import argparse
+import datetime
+from collections import namedtuple
+
+from tabulate import tabulate
+
+from retry import FAILURE_EXIT, RetryPolicy
+from scheduler import Job, FIFOScheduler, EasyBackfillScheduler, FairShare, SchedulingPolicy
+
+
+# Discrete-event simulation of the scheduling of the server: `SchedulingPolicy`, the retry policy and the
+# preemptions run on a virtual clock with virtual devices, for synthetic workloads or the history of a task.db
+# only the scheduling decisions are simulated, not the database, the gpu probes or the processes
+
+
+# a task of the workload: submitted at `submit_time`, runs for `runtime` seconds of work, its first `failures`
+# runs fail half way with an exit code and are retried by the retry policy of the server
+Arrival = namedtuple("Arrival", ["submit_time", "runtime", "job", "failures"], defaults=[0])
+
+
+def generate_workload(num_tasks, num_gpus, interval=900, seed=0, num_users=1, sweep_size=0, duration=None,
+                      max_job_gpus=None, failure_rate=0, urgent_rate=0):
+    # mix of large multi-gpu training jobs and many short single-gpu evaluation jobs submitted by `num_users`
+    # users, plus a sweep of `sweep_size` single-gpu jobs submitted at once by another user
+    # tasks are submitted until `num_tasks` or `duration` seconds, whichever comes first (None for no limit)
+    # multi-gpu jobs use at most `max_job_gpus` gpus (`num_gpus` by default), each run fails with probability
+    # `failure_rate`, and a fraction `urgent_rate` of the jobs have priority 1, the others are preemptible then
+    rng = random.Random(seed)
+    max_job_gpus = min(num_gpus, max_job_gpus or num_gpus)
+    tasks = []
+    submit_time = 0
+    task_id = 0
+    while num_tasks is None or task_id < num_tasks:
+        submit_time += rng.expovariate(1 / interval)
+        if duration is not None and submit_time > duration:
+            break
+        task_id += 1
+        if rng.random() < 0.1:
+            num = max_job_gpus
+            runtime = rng.uniform(1800, 7200)
+        elif rng.random() < 0.3:
+            num = max(1, max_job_gpus // 2)
+            runtime = rng.uniform(600, 3600)
+        else:
+            num = 1
+            runtime = rng.uniform(60, 900)
+        # users overestimate the runtime
+        estimated_runtime = int(runtime * rng.uniform(1.0, 2.0))
+        owner = f"user{rng.randrange(num_users)}"
+        failures = 0
+        while failure_rate > 0 and rng.random() < failure_rate:
+            failures += 1
+        job = Job(task_id, num, [], estimated_runtime, owner=owner)
+        if urgent_rate > 0:
+            job = job._replace(priority=1) if rng.random() < urgent_rate else job._replace(preemptible=True)
+        tasks.append(Arrival(submit_time, runtime, job, failures))
+
+    for task_id in range(task_id + 1, task_id + sweep_size + 1):
+        runtime = rng.uniform(1800, 3600)
+        tasks.append(Arrival(0, runtime, Job(task_id, 1, [], int(runtime * 1.5), owner="sweep")))
+
+    return tasks
+
+
+def load_workload(path):
+    # the finished tasks of a task.db, submitted and running as long as their last run did, and failing as many
+    # times as they were retried
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(
+            'SELECT "id", "submit_time", "execute_time", "finish_time", "num_gpus_required", "estimated_runtime", '
+            '"owner", "priority", "preemptible", "num_retries" FROM "TaskHistory" '
+            'WHERE "execute_time" IS NOT NULL AND "finish_time" IS NOT NULL ORDER BY "submit_time"').fetchall()
+    finally:
+        connection.close()
+    if len(rows) == 0:
+        raise ValueError(f"no finished task in {path}")
+
+    first_submit_time = datetime.datetime.fromisoformat(rows[0][1])
+    tasks = []
+    for task_id, submit_time, execute_time, finish_time, num_gpus, estimated_runtime, owner, priority, preemptible, \
+            num_retries in rows:
+        submit_time = (datetime.datetime.fromisoformat(submit_time) - first_submit_time).total_seconds()
+        runtime = (datetime.datetime.fromisoformat(finish_time) -
+                   datetime.datetime.fromisoformat(execute_time)).total_seconds()
+        job = Job(task_id, num_gpus, [], estimated_runtime, owner=owner, priority=priority,
+                  preemptible=bool(preemptible))
+        tasks.append(Arrival(submit_time, max(runtime, 1), job, num_retries or 0))
+    return tasks
+
+
+def get_policies(half_life=7 * 24 * 3600, quota=None, preempt_priority=None):
+    # the configurations of the server to compare, new instances since fair share keeps the usage of the users
+    # preemption is only compared if `preempt_priority` is given
+    policies = {
+        "fifo": SchedulingPolicy(FIFOScheduler()),
+        "backfill": SchedulingPolicy(EasyBackfillScheduler(default_runtime=24 * 3600)),
+        "backfill+fairshare": SchedulingPolicy(EasyBackfillScheduler(default_runtime=24 * 3600),
+                                               FairShare(half_life, 24 * 3600, default_quota=quota)),
+    }
+    if preempt_priority is not None:
+        policies["backfill+fairshare+preemption"] = SchedulingPolicy(
+            EasyBackfillScheduler(default_runtime=24 * 3600), FairShare(half_life, 24 * 3600, default_quota=quota),
+            preempt_priority)
+    return policies
+
+
+def get_retry_policy():
+    # the defaults of config.py
+    return RetryPolicy(max_attempts=3, backoff=30, max_backoff=3600, max_per_minute=10)
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[max(0, math.ceil(p * len(values)) - 1)]
+
+
+def mean(values):
+    return sum(values) / len(values) if len(values) > 0 else 0
+
+
+def simulate(policy, workload, num_gpus, retry_policy=None, checkpoint_time=60):
+    # discrete-event simulation of the server on `num_gpus` virtual devices and a virtual clock: the events
+    # (submissions, exits, retries due) are processed in time order, and a scheduling pass of `policy` runs after
+    # those of each point in time, as the server woken up by them
+    # the queue is in the order of the server (priority, submit time, id), failed runs are retried by
+    # `retry_policy` (never if None) and preempted jobs exit `checkpoint_time` seconds after the signal, then
+    # resume from their checkpoint
+    # the cpu time of the scheduling passes is measured, the rest is bookkeeping of the simulation
+    tasks = {arrival.job.id: arrival for arrival in workload}
+    # (time, sequence number, kind, job id)
+    events = [(arrival.submit_time, i, "submit", arrival.job.id) for i, arrival in enumerate(workload)]
+    heapq.heapify(events)
+    sequence = len(events)
+    all_gpus = list(range(num_gpus))
+
+    # job id -> job with its current requirements, seconds of work left and runs left to fail
+    jobs = {job_id: arrival.job for job_id, arrival in tasks.items()}
+    remaining = {job_id: arrival.runtime for job_id, arrival in tasks.items()}
+    failures = {job_id: arrival.failures for job_id, arrival in tasks.items()}
+    num_retries = {}
+    # sorted (priority, submit time, id) of the queued jobs and the time they were queued
+    queue = []
+    queued_time = {}
+    # job id -> (running job, sequence number of its exit event, exit time, outcome of the run)
+    running = {}
+    preempting = set()
+    free_gpus = list(all_gpus)
+
+    waits = []
+    pass_times = []
+    busy_gpu_time = 0
+    counts = {"done": 0, "failed": 0, "retried": 0, "preempted": 0}
+    # owner -> waits and gpu time
+    user_waits = {}
+    user_gpu_time = {}
+    first_time = events[0][0] if len(events) > 0 else 0
+    now = first_time
+
+    def push(time, kind, job_id):
+        nonlocal sequence
+        sequence += 1
+        heapq.heappush(events, (time, sequence, kind, job_id))
+        return sequence
+
+    def enqueue(job_id):
+        job = jobs[job_id]
+        bisect.insort(queue, (job.priority, tasks[job_id].submit_time, job_id))
+        queued_time[job_id] = now
+
+    def finish(job_id, outcome):
+        nonlocal busy_gpu_time
+        job, _, _, _ = running.pop(job_id)
+        preempting.discard(job_id)
+        free_gpus.extend(job.gpu_ids)
+        free_gpus.sort()
+        gpu_time = len(job.gpu_ids) * (now - job.start_time)
+        busy_gpu_time += gpu_time
+        user_gpu_time[job.owner] = user_gpu_time.get(job.owner, 0) + gpu_time
+        if policy.fair_share is not None:
+            policy.fair_share.charge(job.owner, gpu_time, now)
+
+        if outcome == "done":
+            counts["done"] += 1
+        elif outcome == "preempted":
+            counts["preempted"] += 1
+            remaining[job_id] -= now - job.start_time
+            enqueue(job_id)
+        else:
+            failures[job_id] -= 1
+            retry = None
+            if retry_policy is not None:
+                retry = retry_policy.decide(job, FAILURE_EXIT, num_retries.get(job_id, 0), now, all_gpus)
+            if retry is None:
+                counts["failed"] += 1
+                return
+            counts["retried"] += 1
+            num_retries[job_id] = num_retries.get(job_id, 0) + 1
+            jobs[job_id] = jobs[job_id]._replace(num_gpus=retry.num_gpus, exclude_gpus=retry.exclude_gpus,
+                                                 memory=retry.memory)
+            push(retry.retry_time, "retry", job_id)
+
+    def launch(job, gpu_ids):
+        queue.remove((job.priority, tasks[job.id].submit_time, job.id))
+        for gpu in gpu_ids:
+            free_gpus.remove(gpu)
+        wait = now - queued_time.pop(job.id)
+        waits.append(wait)
+        user_waits.setdefault(job.owner, []).append(wait)
+        # a failing run fails half way
+        if failures[job.id] > 0:
+            end_time, outcome = now + remaining[job.id] / 2, "failed"
+        else:
+            end_time, outcome = now + remaining[job.id], "done"
+        running[job.id] = (job._replace(start_time=now, gpu_ids=gpu_ids), push(end_time, "exit", job.id), end_time,
+                           outcome)
+
+    def preempt(job_id):
+        job, _, exit_time, _ = running[job_id]
+        end_time = now + checkpoint_time
+        if end_time >= exit_time:
+            # exits before it checkpointed
+            return
+        preempting.add(job_id)
+        running[job_id] = (job, push(end_time, "exit", job_id), end_time, "preempted")
+
+    while len(events) > 0:
+        now = events[0][0]
+        while len(events) > 0 and events[0][0] <= now:
+            _, event_sequence, kind, job_id = heapq.heappop(events)
+            if kind == "exit":
+                # otherwise replaced by the exit of a preemption
+                run = running.get(job_id)
+                if run is not None and run[1] == event_sequence:
+                    finish(job_id, run[3])
+            else:
+                enqueue(job_id)
+
+        if len(queue) == 0:
+            continue
+        queued_jobs = [jobs[job_id] for _, _, job_id in queue]
+        running_jobs = [job for job, _, _, _ in running.values()]
+        start = time.process_time()
+        plan = policy.plan(queued_jobs, running_jobs, free_gpus, now, can_preempt=len(preempting) == 0)
+        pass_times.append(time.process_time() - start)
+
+        for job, gpu_ids in plan.launches:
+            launch(job, gpu_ids)
+        for victim in plan.victims:
+            if victim.id in running:
+                preempt(victim.id)
+
+    makespan = max(now - first_time, 1)
+    return {
+        "makespan": makespan,
+        "utilization": busy_gpu_time / (makespan * num_gpus),
+        "mean_wait": mean(waits),
+        "p99_wait": percentile(waits, 0.99),
+        "max_wait": max(waits, default=0),
+        "num_tasks": len(tasks),
+        # never fit, e.g. more gpus than `num_gpus`
+        "unfinished": len(tasks) - counts["done"] - counts["failed"],
+        **counts,
+        "num_passes": len(pass_times),
+        "scheduler_cpu": sum(pass_times),
+        "p99_pass_cpu": percentile(pass_times, 0.99),
+        "users": {owner: {"num_tasks": len(user_waits[owner]),
+                          "utilization": user_gpu_time[owner] / (makespan * num_gpus),
+                          "mean_wait": mean(user_waits[owner]),
+                          "max_wait": max(user_waits[owner])}
+                  for owner in user_waits},
+    }
+
+
+def format_results(results):
+    # one row per configuration, `results`: name -> (result of `simulate`, wall time of the simulation)
+    table = []
+    for name, (result, wall_time) in results.items():
+        table.append([name, result["num_tasks"], result["done"], result["failed"], result["unfinished"],
+                      result["retried"], result["preempted"], f"{result['makespan'] / 3600:.1f}h",
+                      f"{result['utilization'] * 100:.1f}%", f"{result['mean_wait'] / 60:.1f}min",
+                      f"{result['p99_wait'] / 60:.1f}min", f"{result['max_wait'] / 60:.1f}min", result["num_passes"],
+                      f"{result['scheduler_cpu']:.2f}s", f"{result['p99_pass_cpu'] * 1000:.2f}ms", f"{wall_time:.2f}s"])
+    return tabulate(table, headers=["POLICY", "TASKS", "DONE", "FAILED", "UNFINISHED", "RETRIES", "PREEMPTIONS",
+                                    "MAKESPAN", "UTILIZATION", "MEAN_WAIT", "P99_WAIT", "MAX_WAIT", "PASSES",
+                                    "SCHED_CPU", "P99_PASS_CPU", "WALL_TIME"])
+
+
+def run_all(policies, workload, num_gpus, checkpoint_time=60):
+    # name -> (result, wall time) of each policy, with the retry policy of the server
+    results = {}
+    for name, policy in policies.items():
+        start = time.perf_counter()
+        result = simulate(policy, workload, num_gpus, get_retry_policy(), checkpoint_time)
+        results[name] = (result, time.perf_counter() - start)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("GPU Task Manager Simulator")
+    parser.add_argument("--num-tasks", type=int, default=None, help="1000 by default, unless --days is given")
+    parser.add_argument("--days", type=float, default=None, help="submit tasks for this number of days")
+    parser.add_argument("--num-gpus", type=int, default=8)
+    parser.add_argument("--max-job-gpus", type=int, default=None, help="gpus of the largest jobs, all by default")
+    parser.add_argument("--interval", type=float, default=900, help="mean seconds between submissions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num-users", type=int, default=1)
+    parser.add_argument("--sweep", type=int, default=0, help="number of jobs of a sweep submitted at once by one user")
+    parser.add_argument("--failure-rate", type=float, default=0, help="probability that a run fails")
+    parser.add_argument("--urgent-rate", type=float, default=0,
+                        help="fraction of jobs of priority 1, the others are preemptible")
+    parser.add_argument("--replay", type=str, default=None, help="replay the finished tasks of a task.db instead")
+    parser.add_argument("--half-life", type=float, default=7 * 24 * 3600, help="half life of the fair share usage")
+    parser.add_argument("--quota", type=int, default=None, help="gpus each user runs at most with fair share")
+    parser.add_argument("--preempt-priority", type=int, default=None,
+                        help="also compare preempting jobs for the jobs of at most this priority")
+    parser.add_argument("--checkpoint-time", type=float, default=60,
+                        help="seconds a preempted job takes to checkpoint and exit")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        workload = load_workload(args.replay)
+    else:
+        if args.num_tasks is None and args.days is None:
+            args.num_tasks = 1000
+        workload = generate_workload(args.num_tasks, args.num_gpus, args.interval, args.seed, args.num_users,
+                                     args.sweep, None if args.days is None else args.days * 24 * 3600,
+                                     args.max_job_gpus, args.failure_rate, args.urgent_rate)
+    policies = get_policies(args.half_life, args.quota, args.preempt_priority)
+    results = run_all(policies, workload, args.num_gpus, args.checkpoint_time)
+
+    user_table = []
+    for name, (result, _) in results.items():
+        for owner, user in sorted(result["users"].items(), key=lambda x: str(x[0])):
+            user_table.append([name, owner, user["num_tasks"], f"{user['utilization'] * 100:.1f}%",
+                               f"{user['mean_wait'] / 60:.1f}min", f"{user['max_wait'] / 60:.1f}min"])
+
+    print(format_results(results))
+    print()
+    print(tabulate(user_table, headers=["POLICY", "OWNER", "LAUNCHES", "UTILIZATION", "MEAN_WAIT", "MAX_WAIT"]))
@@ -0,0 +1,123 @@
+import re
+import math
+import random
+
+
+# Parameter sweeps: a command template and its parameter axes are stored once, the points of the sweep are
+# expanded into tasks by the server only when there are gpus to run them, see `GPUTaskDatabase.expand_sweeps`
+# a point is computed from its index without enumerating the others, so that submitting and storing a sweep
+# does not depend on its size
+# only the standard library is imported, it is loaded by the client
+
+# {name} in the command template, other braces (e.g. ${HOME} in shell) are left as they are
+PLACEHOLDER = re.compile(r"(?<!\$)\{(\w+)\}")
+KINDS = ["grid", "list", "random"]
+# distributions of the parameters of random sweeps, a list is a uniform choice of its values
+DISTRIBUTIONS = ["uniform", "log_uniform", "int"]
+
+
+def get_kind(axes):
+    return next(kind for kind in KINDS if kind in axes)
+
+
+def get_size(axes):
+    # number of points
+    kind = get_kind(axes)
+    if kind == "grid":
+        return math.prod(len(values) for values in axes["grid"].values())
+    elif kind == "list":
+        return len(axes["list"])
+    else:
+        return axes["random"]["samples"]
+
+
+def get_names(axes):
+    kind = get_kind(axes)
+    if kind == "grid":
+        return list(axes["grid"])
+    elif kind == "list":
+        return sorted(set(name for point in axes["list"] for name in point))
+    else:
+        return list(axes["random"]["params"])
+
+
+def get_point(axes, index):
+    # parameters of the point `index` in [0, size): the last axis of a grid varies the fastest, a random point
+    # only depends on the seed and its index
+    kind = get_kind(axes)
+    if kind == "grid":
+        params = {}
+        for name, values in reversed(list(axes["grid"].items())):
+            index, i = divmod(index, len(values))
+            params[name] = values[i]
+        return dict(reversed(list(params.items())))
+    elif kind == "list":
+        return dict(axes["list"][index])
+
+    rng = random.Random(f"{axes['random'].get('seed', 0)}:{index}")
+    params = {}
+    for name, distribution in axes["random"]["params"].items():
+        if isinstance(distribution, list):
+            params[name] = rng.choice(distribution)
+        elif "uniform" in distribution:
+            params[name] = rng.uniform(*distribution["uniform"])
+        elif "log_uniform" in distribution:
+            low, high = distribution["log_uniform"]
+            params[name] = math.exp(rng.uniform(math.log(low), math.log(high)))
+        else:
+            params[name] = rng.randint(*distribution["int"])
+    return params
+
+
+def render(template, params):
+    return PLACEHOLDER.sub(lambda m: str(params[m.group(1)]) if m.group(1) in params else m.group(0), template)
+
+
+def parse_axes(item):
+    # the axes of a sweep given by exactly one of:
+    # - "grid": {"lr": [0.1, 0.01], "bs": [32, 64]}, all the combinations of the values
+    # - "list": [{"lr": 0.1, "bs": 32}, {"lr": 0.01, "bs": 64}], the given points
+    # - "random": {"samples": 100, "seed": 0, "params": {"lr": {"log_uniform": [1e-5, 0.1]},
+    #   "dropout": {"uniform": [0, 0.5]}, "layers": {"int": [2, 8]}, "bs": [32, 64]}}, points drawn at random
+    kinds = [kind for kind in KINDS if kind in item]
+    if len(kinds) != 1:
+        raise ValueError(f"requires exactly one of {', '.join(KINDS)}")
+    kind = kinds[0]
+    axes = {kind: item[kind]}
+
+    if kind == "grid":
+        if not isinstance(item["grid"], dict) or len(item["grid"]) == 0:
+            raise ValueError("grid requires an object of parameter values")
+        for name, values in item["grid"].items():
+            if not isinstance(values, list) or len(values) == 0:
+                raise ValueError(f"grid parameter `{name}` requires a non-empty list of values")
+    elif kind == "list":
+        if not isinstance(item["list"], list) or len(item["list"]) == 0 or \
+                not all(isinstance(point, dict) for point in item["list"]):
+            raise ValueError("list requires a non-empty list of objects")
+    else:
+        sample = item["random"]
+        if not isinstance(sample, dict) or not isinstance(sample.get("params"), dict) or len(sample["params"]) == 0:
+            raise ValueError("random requires the distributions of its params")
+        if int(sample.get("samples", 0)) < 1:
+            raise ValueError("random requires a positive number of samples")
+        axes = {"random": {"samples": int(sample["samples"]), "seed": int(sample.get("seed", 0)),
+                           "params": sample["params"]}}
+        for name, distribution in sample["params"].items():
+            if isinstance(distribution, list) and len(distribution) > 0:
+                continue
+            if not isinstance(distribution, dict) or len(distribution) != 1 or \
+                    list(distribution)[0] not in DISTRIBUTIONS or len(list(distribution.values())[0]) != 2:
+                raise ValueError(f"random parameter `{name}` requires a list of values or one of "
+                                 f"{', '.join(DISTRIBUTIONS)} with [low, high]")
+            low, high = list(distribution.values())[0]
+            if low > high or ("log_uniform" in distribution and low <= 0):
+                raise ValueError(f"random parameter `{name}` has an invalid range [{low}, {high}]")
+    return axes
+
+
+def check_template(template, axes):
+    # every placeholder of the command is a parameter
+    unknown = sorted(set(PLACEHOLDER.findall(template)) - set(get_names(axes)))
+    if len(unknown) > 0:
+        raise ValueError(f"unknown parameters in the command: {', '.join(unknown)}")
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+
+
+# Output of the tasks: written by launcher.py to TASK_LOG_DIR/<id>.log and rotated by size, followed by
+# `client.py --tail`
+# only the standard library is imported, it is loaded by the launcher of every task
+
+
+def get_backup_path(path, index, compress):
+    return f"{path}.{index}.gz" if compress else f"{path}.{index}"
+
+
+def compress_file(path):
+    # replace `path` by `path.gz`
+    import gzip
+    import shutil
+
+    tmp_path = f"{path}.gz.tmp"
+    with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, f"{path}.gz")
+    os.remove(path)
+
+
+class RotatingLogWriter(object):
+    # append to `path`, once it would exceed `max_bytes` it is renamed to `path.1` and older backups are
+    # shifted up to `path.<backup_count>`, backups are gzipped by a background thread if `compress`
+    # `max_bytes` 0 never rotates
+    def __init__(self, path, max_bytes=0, backup_count=0, compress=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+
+        self.compressor = None
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.size = os.fstat(self.fd).st_size
+
+    def write(self, data):
+        if self.max_bytes > 0 and self.size > 0 and self.size + len(data) > self.max_bytes:
+            self.rotate()
+
+        written = 0
+        while written < len(data):
+            written += os.write(self.fd, data[written:])
+        self.size += len(data)
+
+    def rotate(self):
+        os.close(self.fd)
+        # the previous backup must be compressed before it is shifted
+        if self.compressor is not None:
+            self.compressor.join()
+            self.compressor = None
+
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                backup_path = get_backup_path(self.path, index, self.compress)
+                if os.path.exists(backup_path):
+                    os.replace(backup_path, get_backup_path(self.path, index + 1, self.compress))
+            os.replace(self.path, f"{self.path}.1")
+            if self.compress:
+                self.compressor = threading.Thread(target=compress_file, args=(f"{self.path}.1",))
+                self.compressor.start()
+            flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        else:
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND
+
+        self.fd = os.open(self.path, flags, 0o644)
+        self.size = 0
+
+    def close(self):
+        os.close(self.fd)
+        if self.compressor is not None:
+            self.compressor.join()
+
+
+def read_last_lines(f, num_lines, block_size=65536):
+    # the last `num_lines` lines of the open binary file, read backwards from its end, which is left as position
+    end = f.seek(0, os.SEEK_END)
+    position = end
+    data = b""
+    # a trailing newline does not start a line
+    while position > 0 and data.count(b"\n", 0, len(data) - 1) < num_lines:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        data = f.read(read_size) + data
+    f.seek(end)
+
+    if num_lines == 0:
+        return b""
+    lines = data.split(b"\n")
+    trailing = lines[-1] == b""
+    if trailing:
+        lines = lines[:-1]
+    return b"\n".join(lines[-num_lines:]) + (b"\n" if trailing else b"")
+
+
+def follow_log(path, num_lines, is_finished, poll_interval=0.2, check_interval=1):
+    # yield the last `num_lines` lines of the log, then what is appended to it until `is_finished()`,
+    # which is checked every `check_interval` seconds without new output
+    # the file is read from the last position only, and reopened when it is rotated
+    f = None
+    last_check_time = time.time()
+    while f is None:
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            if is_finished():
+                return
+            time.sleep(poll_interval)
+
+    try:
+        yield read_last_lines(f, num_lines)
+        while True:
+            data = f.read(65536)
+            if len(data) > 0:
+                yield data
+                continue
+
+            try:
+                stat = os.stat(path)
+                if stat.st_ino != os.fstat(f.fileno()).st_ino:
+                    # rotated, the writer does not append to the old file anymore
+                    yield f.read()
+                    f.close()
+                    f = open(path, 'rb')
+                    continue
+                if stat.st_size < f.tell():
+                    # truncated in place, rotated without backups
+                    f.close()
+                    f = open(path, 'rb')
+                    continue
+            except FileNotFoundError:
+                pass
+
+            if time.time() - last_check_time >= check_interval:
+                last_check_time = time.time()
+                if is_finished():
+                    yield f.read()
+                    return
+            time.sleep(poll_interval)
+    finally:
+        f.close()
@@ -0,0 +1,161 @@
+import os
+import math
+import struct
+from collections import namedtuple
+
+
+# Resource usage of the running tasks over time: sampled by the server every TELEMETRY_INTERVAL seconds and
+# appended as fixed-width records to TELEMETRY_DIR/<id>.bin, read by `client.py --stats`
+# only the standard library is imported, it is loaded by the client
+
+# one sample of a task:
+# - time: unix time
+# - gpu_load: mean load of the gpus of the task in [0, 1]
+# - gpu_memory: gpu memory used by the task in MB
+# - cpu: cores used by the processes of the task since the previous sample, nan for the first sample
+# - rss: resident memory of the processes of the task in MB
+Sample = namedtuple("Sample", ["time", "gpu_load", "gpu_memory", "cpu", "rss"])
+RECORD = struct.Struct("<dffff")
+
+
+def get_telemetry_path(directory, task_id):
+    return os.path.join(directory, f"{task_id}.bin")
+
+
+def read_samples(path):
+    # all samples of the file, [] if there is none, a partial record being appended is ignored
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    return [Sample(*values) for values in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size])]
+
+
+def mean(values):
+    values = [value for value in values if not math.isnan(value)]
+    return sum(values) / len(values) if len(values) > 0 else math.nan
+
+
+def peak(values):
+    values = [value for value in values if not math.isnan(value)]
+    return max(values) if len(values) > 0 else math.nan
+
+
+def downsample(samples, factor):
+    # merge each `factor` consecutive samples at the time of the first one: mean load and cpu, peak memory
+    merged = []
+    for i in range(0, len(samples), factor):
+        group = samples[i:i + factor]
+        merged.append(Sample(group[0].time, mean([s.gpu_load for s in group]), peak([s.gpu_memory for s in group]),
+                             mean([s.cpu for s in group]), peak([s.rss for s in group])))
+    return merged
+
+
+def summarize(samples):
+    # load and cpu averaged over time, each sample lasting until the next one, and peak memory
+    # None if there is no sample
+    if len(samples) == 0:
+        return None
+
+    durations = [b.time - a.time for a, b in zip(samples, samples[1:])]
+    # the last sample lasts as long as the one before
+    durations.append(durations[-1] if len(durations) > 0 else 0)
+
+    def weighted_mean(values):
+        pairs = [(value, duration) for value, duration in zip(values, durations) if not math.isnan(value)]
+        total = sum(duration for _, duration in pairs)
+        if total == 0:
+            return mean([value for value, _ in pairs])
+        return sum(value * duration for value, duration in pairs) / total
+
+    return {
+        "start_time": samples[0].time,
+        "end_time": samples[-1].time,
+        "num_samples": len(samples),
+        "gpu_load": weighted_mean([s.gpu_load for s in samples]),
+        "gpu_memory": peak([s.gpu_memory for s in samples]),
+        "cpu": weighted_mean([s.cpu for s in samples]),
+        "rss": peak([s.rss for s in samples]),
+    }
+
+
+def scan_processes(session_ids):
+    # session id -> (cpu ticks of its processes including their waited children, resident pages, pids)
+    # for the given sessions, read from /proc in a single pass
+    usage = {}
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return usage
+
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", 'rb') as f:
+                stat = f.read()
+        except OSError:
+            # exited meanwhile
+            continue
+        # fields after the command name in parentheses, which may contain spaces, starting with the state
+        fields = stat[stat.rindex(b")") + 2:].split()
+        session_id = int(fields[3])
+        if session_id not in session_ids:
+            continue
+        ticks, pages, session_pids = usage.get(session_id, (0, 0, []))
+        session_pids.append(int(pid))
+        usage[session_id] = (ticks + sum(int(field) for field in fields[11:15]), pages + int(fields[21]),
+                             session_pids)
+    return usage
+
+
+class TelemetryRecorder(object):
+    # appends a sample of each running task to its file, a file is downsampled by 2 in place once it holds
+    # 2 * `max_samples` samples, so that it stays small whatever the runtime of the task
+    def __init__(self, directory, max_samples):
+        self.directory = directory
+        self.max_samples = max_samples
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        # task id -> (cpu ticks, time) of the previous sample
+        self.last_cpu = {}
+
+    def record(self, tasks, now):
+        # tasks: task id -> (session id of its launcher, devices), devices: (load, memory used, number of tasks,
+        # processes) of each gpu of the task, processes: (pid, memory) on the gpu, None if not reported
+        # the gpu memory of a task is that of its processes if they are reported, otherwise its part of the memory
+        # used on its gpus
+        os.makedirs(self.directory, exist_ok=True)
+        usage = scan_processes(set(session_id for session_id, _ in tasks.values()))
+        for task_id, (session_id, devices) in tasks.items():
+            ticks, pages, pids = usage.get(session_id, (0, 0, []))
+            pids = set(pids)
+            gpu_memory = 0
+            for _, memory_used, num_tasks, processes in devices:
+                if processes is None:
+                    gpu_memory += memory_used / max(num_tasks, 1)
+                else:
+                    gpu_memory += sum(memory for pid, memory in processes if pid in pids)
+
+            cpu = math.nan
+            last = self.last_cpu.get(task_id)
+            if last is not None and now > last[1]:
+                cpu = max(0, ticks - last[0]) / self.clock_ticks / (now - last[1])
+            self.last_cpu[task_id] = (ticks, now)
+            self.__append(task_id, Sample(now, mean([device[0] for device in devices]), gpu_memory, cpu,
+                                          pages * self.page_size / 1024 ** 2))
+
+        for task_id in set(self.last_cpu) - set(tasks):
+            del self.last_cpu[task_id]
+
+    def __append(self, task_id, sample):
+        path = get_telemetry_path(self.directory, task_id)
+        with open(path, 'ab') as f:
+            f.write(RECORD.pack(*sample))
+            num_samples = f.tell() // RECORD.size
+
+        if num_samples >= 2 * self.max_samples:
+            samples = downsample(read_samples(path), 2)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(b"".join(RECORD.pack(*sample) for sample in samples))
+            os.replace(tmp_path, path)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+
+# the modules of the repository are imported as top-level modules, like server.py and client.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from fake_server import Server
+
+
+@pytest.fixture
+def make_server(tmp_path):
+    # starts `Server`s with the given config, they are stopped with their tasks after the test
+    servers = []
+
+    def make_server(**config):
+        server = Server(str(tmp_path), **config)
+        servers.append(server)
+        server.start()
+        return server
+
+    yield make_server
+    for server in servers:
+        server.stop()
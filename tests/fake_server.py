@@ -0,0 +1,155 @@
+import os
+import re
+import sys
+import json
+import time
+import signal
+import sqlite3
+import subprocess
+
+from client import make_task
+from rpc import connect_server
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# the server on fake gpus, all its files in the directory given as first argument, and the config values given as
+# json in the second one
+SERVER_SCRIPT = """
+import os
+import sys
+import json
+
+import server
+from database import get_database
+from devices import FakeDeviceProvider
+from eventlog import EventLog
+from server import GPUManager, GPUTaskManagerServer
+from util import get_logger
+
+tmp_dir, config = sys.argv[1], json.loads(sys.argv[2])
+num_gpus = config.pop("NUM_FAKE_GPUS")
+for name, value in config.items():
+    setattr(server, name, value)
+logger = get_logger(os.path.join(tmp_dir, "server.log"))
+gpu_manager = GPUManager(logger, FakeDeviceProvider(num_gpus), task_status_dir=os.path.join(tmp_dir, "tasks"),
+                         task_log_dir=os.path.join(tmp_dir, "tasks"), telemetry_dir=os.path.join(tmp_dir, "telemetry"))
+GPUTaskManagerServer(get_database(os.path.join(tmp_dir, "task.db")), logger, gpu_manager,
+                     rpc_path=os.path.join(tmp_dir, "server_rpc.sock"),
+                     notify_path=os.path.join(tmp_dir, "server.sock"),
+                     event_log=EventLog(os.path.join(tmp_dir, "events.jsonl"))).start()
+"""
+
+TASK_COLUMNS = ["state", "system_pid", "exit_code", "failure_reason", "num_retries", "num_gpus_required",
+                "exclude_gpus", "memory_required", "owner"]
+
+
+def wait_for(predicate, timeout=15):
+    # the last result of `predicate`, once true or after `timeout` seconds
+    deadline = time.time() + timeout
+    while True:
+        result = predicate()
+        if result or time.time() > deadline:
+            return result
+        time.sleep(0.1)
+
+
+def get_processes(text):
+    # pids of the processes whose command line contains `text`
+    pids = []
+    for name in os.listdir("/proc"):
+        # not /proc/self and the like
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/cmdline", 'rb') as f:
+                cmdline = f.read().decode(errors="replace")
+        except OSError:
+            continue
+        if text in cmdline and int(name) != os.getpid():
+            pids.append(int(name))
+    return pids
+
+
+def get_children(pid):
+    children = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        if int(stat[stat.rindex(')') + 2:].split()[1]) == pid:
+            children.append(int(name))
+    return children
+
+
+def kill(pid, sig=signal.SIGKILL):
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+class Server(object):
+    # a server in its own process, so that it can be killed like a crash would, `config` overrides config.py
+    def __init__(self, tmp_dir, **config):
+        self.tmp_dir = tmp_dir
+        self.config = dict({"NUM_FAKE_GPUS": 4}, **config)
+        self.process = None
+
+    def start(self):
+        rpc_path = os.path.join(self.tmp_dir, "server_rpc.sock")
+        if os.path.exists(rpc_path):
+            os.remove(rpc_path)
+        self.process = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT, self.tmp_dir, json.dumps(self.config)],
+                                        cwd=ROOT)
+        assert wait_for(lambda: os.path.exists(rpc_path)), "the server did not start"
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        # running tasks are left running by the server, their launchers have their status file in `tmp_dir`
+        for pid in get_processes(self.tmp_dir):
+            for child in get_children(pid):
+                kill(child)
+            kill(pid)
+
+    def call(self, method, **params):
+        return connect_server(os.path.join(self.tmp_dir, "server_rpc.sock")).call(method, **params)
+
+    def add_tasks(self, commands, **options):
+        # ids of the new tasks, `options` are the ones of `make_task`
+        first_id, last_id = self.call("add_tasks", tasks=[make_task(command, **options) for command in commands])
+        return list(range(first_id, last_id + 1))
+
+    def get_task(self, task_id):
+        # from task.db, like the client with --local
+        with sqlite3.connect(os.path.join(self.tmp_dir, "task.db")) as connection:
+            for table in ["Task", "TaskHistory"]:
+                row = connection.execute(f"select {', '.join(TASK_COLUMNS)} from {table} where id = ?",
+                                         (task_id,)).fetchone()
+                if row is not None:
+                    task = dict(zip(TASK_COLUMNS, row))
+                    task["pid"] = task.pop("system_pid")
+                    task["exclude_gpus"] = json.loads(task["exclude_gpus"] or "[]")
+                    return task
+
+    def wait_state(self, task_id, state):
+        # the task once it is in `state`, False if it did not get there
+        return wait_for(lambda: self.get_task(task_id)["state"] == state and self.get_task(task_id))
+
+    def read_log(self):
+        with open(os.path.join(self.tmp_dir, "server.log"), 'r') as f:
+            return f.read()
+
+    def get_launch_gpus(self, task_id):
+        # gpus of each run of the task
+        return [json.loads(gpus) for gpus in re.findall(rf"launch task {task_id} on gpus (\[.*?\])", self.read_log())]
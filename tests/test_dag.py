@@ -0,0 +1,164 @@
+import os
+import sqlite3
+
+import pytest
+
+import client
+from client import GPUTaskManagerClient, parse_after, parse_jsonl_line, parse_task_line
+from constant import STATE
+from dag import DependencyGraph
+from notify import notify_server
+
+
+def test_ready_once_all_parents_are_done():
+    # 1 -> 3, 2 -> 3, 3 -> 4
+    graph = DependencyGraph()
+    graph.add(1, [])
+    graph.add(3, [1, 2])
+    graph.add(4, [3])
+    assert not graph.is_blocked(1)
+    assert graph.is_blocked(3) and graph.is_blocked(4)
+
+    assert graph.set_done(1) == []
+    assert graph.set_done(2) == [3]
+    assert not graph.is_blocked(3)
+    assert graph.set_done(3) == [4]
+    assert graph.parents == {} and graph.children == {}
+
+
+def test_failure_cancels_all_dependents():
+    # diamond 1 -> 2, 1 -> 3, 2 -> 4, 3 -> 4, and 5 -> 4, 5 -> 6
+    graph = DependencyGraph()
+    graph.add(2, [1])
+    graph.add(3, [1])
+    graph.add(4, [2, 3, 5])
+    graph.add(6, [5])
+
+    assert sorted(graph.set_failed(1)) == [2, 3, 4]
+    assert not any(graph.is_blocked(task_id) for task_id in [2, 3, 4])
+    # the other dependents of 5 are not affected
+    assert graph.is_blocked(6)
+    assert graph.set_done(5) == [6]
+    assert graph.parents == {} and graph.children == {}
+
+
+def test_failure_of_a_blocked_task():
+    # e.g. deleted while it waits for its own dependencies
+    graph = DependencyGraph()
+    graph.add(2, [1])
+    graph.add(3, [2])
+
+    assert graph.set_failed(2) == [3]
+    assert graph.set_done(1) == []
+    assert graph.parents == {} and graph.children == {}
+
+
+def test_parse_after():
+    assert parse_after(["12", "#1", " #3 ", ""]) == ([12], [0, 2])
+    assert parse_after([12, "#2"]) == ([12], [1])
+    with pytest.raises(ValueError):
+        parse_after(["#x"])
+
+
+def test_parse_task_line():
+    task = parse_task_line("python train.py --lr 0.1 ; 2 ; ; ; 7, #1 #2")
+    assert task["command"] == "python train.py --lr 0.1"
+    assert task["num_gpus_required"] == 2
+    assert task["after"] == [7]
+    assert task["after_tasks"] == [0, 1]
+
+    task = parse_jsonl_line('{"command": "python eval.py", "after": [12, "#1"]}')
+    assert task["after"] == [12]
+    assert task["after_tasks"] == [0]
+
+
+class Database(object):
+    def __init__(self):
+        self.tasks = []
+
+    def add_tasks(self, tasks):
+        self.tasks.extend(tasks)
+        return 1, len(tasks)
+
+
+@pytest.fixture
+def task_client(monkeypatch):
+    monkeypatch.setattr(client, "notify_server", lambda path: None)
+    return GPUTaskManagerClient(Database())
+
+
+def test_submit_from_file(tmp_path, task_client):
+    path = tmp_path / "tasks.txt"
+    path.write_text("# train then evaluate\npython train.py;2\n\npython eval.py;1;;;#1\npython report.py;1;;;#1,#2\n")
+    task_client.submit_from_file(str(path))
+    assert [task["after_tasks"] for task in task_client.db.tasks] == [[], [0], [0, 1]]
+
+
+@pytest.mark.parametrize("after", ["#2", "#0"])
+def test_submit_from_file_only_references_earlier_tasks(tmp_path, task_client, after):
+    path = tmp_path / "tasks.txt"
+    path.write_text(f"python train.py\npython eval.py;1;;;{after}\n")
+    with pytest.raises(ValueError, match=r"tasks.txt:2: .*only earlier tasks"):
+        task_client.submit_from_file(str(path))
+    # nothing is submitted
+    assert task_client.db.tasks == []
+
+
+def add_file_tasks(server, tasks):
+    # (command, indices of the earlier tasks it depends on) like a task file
+    first_id, last_id = server.call("add_tasks", tasks=[
+        dict(client.make_task(command), after_tasks=after_tasks) for command, after_tasks in tasks])
+    return list(range(first_id, last_id + 1))
+
+
+def is_after(server, first_text, then_text):
+    log = server.read_log()
+    return first_text in log and then_text in log and log.index(first_text) < log.index(then_text)
+
+
+def test_run_after_dependencies(make_server):
+    server = make_server()
+    train_id, eval_id, report_id = add_file_tasks(server, [("sleep 1", []), ("sleep 0", [0]), ("sleep 0", [0, 1])])
+
+    assert server.wait_state(report_id, STATE.DONE)
+    assert is_after(server, f"task {train_id} is done", f"launch task {eval_id} ")
+    assert is_after(server, f"task {eval_id} is done", f"launch task {report_id} ")
+
+
+def test_cancel_dependents_of_failed_task(make_server):
+    server = make_server()
+    train_id, eval_id, report_id = add_file_tasks(server, [("no-such-command", []), ("sleep 0", [0]),
+                                                           ("sleep 0", [1])])
+
+    for task_id in [eval_id, report_id]:
+        task = server.wait_state(task_id, STATE.FAILED)
+        assert task["failure_reason"] == f"dependency {train_id} failed or was deleted"
+    assert server.get_launch_gpus(eval_id) == [] and server.get_launch_gpus(report_id) == []
+
+
+def test_cancel_dependents_of_deleted_task(make_server):
+    server = make_server()
+    running_id, train_id, eval_id = add_file_tasks(server, [("sleep 300", []), ("sleep 0", [0]), ("sleep 0", [1])])
+    assert server.wait_state(running_id, STATE.RUNNING)
+
+    assert server.call("remove_queuing_task", task_id=train_id) == STATE.QUEUING
+    task = server.wait_state(eval_id, STATE.FAILED)
+    assert task["failure_reason"] == f"dependency {train_id} failed or was deleted"
+    # the others are not affected
+    assert server.get_task(running_id)["state"] == STATE.RUNNING
+
+
+def test_cancel_dependents_of_task_deleted_locally(make_server):
+    # by a client with --local, which only notifies the server
+    server = make_server()
+    # the dependencies are loaded by the pass launching the first task
+    running_id, train_id, eval_id = add_file_tasks(server, [("sleep 300", []), ("sleep 0", [0]), ("sleep 0", [1])])
+    assert server.wait_state(running_id, STATE.RUNNING)
+
+    with sqlite3.connect(os.path.join(server.tmp_dir, "task.db")) as connection:
+        connection.execute("delete from Task where id = ?", (train_id,))
+    notify_server(os.path.join(server.tmp_dir, "server.sock"))
+    task = server.wait_state(eval_id, STATE.FAILED)
+    assert task["failure_reason"] == f"dependency {train_id} failed or was deleted"
+    assert f"task {train_id} was deleted by a client" in server.read_log()
+    assert server.get_task(running_id)["state"] == STATE.RUNNING
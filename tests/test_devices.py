@@ -0,0 +1,198 @@
+import ctypes
+
+import pytest
+
+import devices
+from devices import (NVML_ERROR_INSUFFICIENT_SIZE, NVML_SUCCESS, DeviceSample, DeviceState, FakeDeviceProvider,
+                     GPUtilProvider, NVMLError, NVMLProvider, Occupant, get_device_provider)
+from scheduler import Job, allocate, first_fit
+
+
+MB = 1024 ** 2
+NVML_ERROR_NOT_SUPPORTED = 3
+
+
+class StubNVML(object):
+    # libnvidia-ml as seen through ctypes: out parameters are passed by reference, arrays as is
+    # devices: list of (load in %, used MB, total MB, [(pid, MB)] or None if processes are not supported)
+    def __init__(self, devices, init_error=NVML_SUCCESS):
+        self.devices = devices
+        self.init_error = init_error
+        self.is_initialized = False
+        # number of processes started between the two calls of nvmlDeviceGetComputeRunningProcesses_v2
+        self.started_processes = 0
+
+    def nvmlInit_v2(self):
+        self.is_initialized = self.init_error == NVML_SUCCESS
+        return self.init_error
+
+    def nvmlShutdown(self):
+        self.is_initialized = False
+        return NVML_SUCCESS
+
+    def nvmlErrorString(self, ret):
+        return f"stub error {ret}".encode()
+
+    def nvmlDeviceGetCount_v2(self, count):
+        count._obj.value = len(self.devices)
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetHandleByIndex_v2(self, idx, handle):
+        # handles are 1-based so that none is NULL
+        handle._obj.value = idx + 1
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetUtilizationRates(self, handle, utilization):
+        utilization._obj.gpu = self.devices[handle.value - 1][0]
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetMemoryInfo(self, handle, memory):
+        _, used, total, _ = self.devices[handle.value - 1]
+        memory._obj.total = total * MB
+        memory._obj.used = used * MB
+        memory._obj.free = (total - used) * MB
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetComputeRunningProcesses_v2(self, handle, count, infos):
+        processes = self.devices[handle.value - 1][3]
+        if processes is None:
+            return NVML_ERROR_NOT_SUPPORTED
+        if infos is None:
+            count._obj.value = len(processes)
+            # the caller allocates the array, processes may start meanwhile
+            processes.extend((1000 + i, 1) for i in range(self.started_processes))
+            return NVML_SUCCESS if len(processes) == 0 else NVML_ERROR_INSUFFICIENT_SIZE
+        if count._obj.value < len(processes):
+            count._obj.value = len(processes)
+            return NVML_ERROR_INSUFFICIENT_SIZE
+        for i, (pid, used) in enumerate(processes):
+            infos[i].pid = pid
+            infos[i].usedGpuMemory = used * MB
+        count._obj.value = len(processes)
+        return NVML_SUCCESS
+
+
+def test_nvml_probe():
+    lib = StubNVML([(50, 1024, 81920, [(10, 1000), (11, 24)]), (0, 0, 40960, [])])
+    provider = NVMLProvider(lib)
+    assert lib.is_initialized
+
+    assert provider.probe() == [DeviceSample(0, 0.5, 1024, 81920, [(10, 1000), (11, 24)]),
+                                DeviceSample(1, 0.0, 0, 40960, [])]
+    provider.close()
+    assert not lib.is_initialized
+
+
+def test_nvml_processes_started_while_probing():
+    lib = StubNVML([(0, 0, 81920, [(10, 1)])])
+    lib.started_processes = 6
+    provider = NVMLProvider(lib)
+
+    assert [pid for pid, _ in provider.probe()[0].processes] == [10] + [1000 + i for i in range(6)]
+
+
+def test_nvml_processes_not_supported():
+    provider = NVMLProvider(StubNVML([(10, 512, 16384, None)]))
+
+    assert provider.probe() == [DeviceSample(0, 0.1, 512, 16384, None)]
+
+
+def test_nvml_error():
+    with pytest.raises(NVMLError, match="stub error 9"):
+        NVMLProvider(StubNVML([], init_error=9))
+
+
+def test_fall_back_to_gputil_without_library(monkeypatch):
+    def load_library(name):
+        raise OSError(f"{name}: cannot open shared object file")
+
+    monkeypatch.setattr(devices.ctypes, "CDLL", load_library)
+    assert isinstance(get_device_provider("nvml"), GPUtilProvider)
+
+
+def test_fall_back_to_gputil_on_nvml_error(monkeypatch):
+    messages = []
+
+    class Logger(object):
+        def warning(self, message):
+            messages.append(message)
+
+    monkeypatch.setattr(devices, "NVMLProvider", lambda: NVMLProvider(StubNVML([], init_error=9)))
+    assert isinstance(get_device_provider("nvml", logger=Logger()), GPUtilProvider)
+    assert len(messages) == 1 and "fall back to GPUtil" in messages[0]
+
+
+def test_get_device_provider():
+    provider = get_device_provider("fake", 4)
+    assert isinstance(provider, FakeDeviceProvider)
+    assert [sample.id for sample in provider.probe()] == [0, 1, 2, 3]
+    with pytest.raises(ValueError):
+        get_device_provider("cuda")
+
+
+class Process(object):
+    def __init__(self, returncode=None):
+        self.returncode = returncode
+
+
+def make_device(memory_used, occupants=(), memory_total=81920, load=0.0):
+    device = DeviceState(0)
+    device.update(DeviceSample(0, load, memory_used, memory_total), 0)
+    device.occupants = list(occupants)
+    return device
+
+
+def test_device_free_memory():
+    # memory reserved by the tasks counts until they allocate it
+    device = make_device(1000, [Occupant(1, Process(), 20000), Occupant(2, Process(), 10000)])
+    assert device.is_shareable()
+    assert device.get_free_memory() == 81920 - 30000
+
+    device = make_device(50000, [Occupant(1, Process(), 20000)])
+    assert device.get_free_memory() == 81920 - 50000
+
+    # exited tasks do not count
+    device = make_device(0, [Occupant(1, Process(returncode=0), 20000)])
+    assert not device.is_occupied()
+    assert device.get_free_memory() == 81920
+
+
+def test_device_shared_with_whole_device_task():
+    device = make_device(0, [Occupant(1, Process(), 20000), Occupant(2, Process(), None)])
+    assert device.is_occupied()
+    assert not device.is_shareable()
+
+
+def test_device_idle():
+    assert make_device(0).is_idle(max_load=0.1, max_memory=0.1)
+    assert not make_device(0, load=0.5).is_idle(max_load=0.1, max_memory=0.1)
+    assert not make_device(float("nan")).is_idle(max_load=0.1, max_memory=0.1)
+
+
+def test_memory_packing_best_fit():
+    job = Job(1, 1, [], None, memory=10000)
+    free_memory = {0: 30000, 1: 12000, 2: 81920}
+    # the device with the least memory left after placing the job
+    assert first_fit(job, [2], free_memory) == [1]
+    assert first_fit(job._replace(num_gpus=2), [2], free_memory) == [0, 1]
+    assert first_fit(job._replace(exclude_gpus=[1]), [2], free_memory) == [0]
+    assert first_fit(job._replace(memory=40000), [2], free_memory) == [2]
+    assert first_fit(job._replace(memory=90000), [2], free_memory) is None
+
+
+def test_memory_packing_allocate():
+    job = Job(1, 1, [], None, memory=10000)
+    free_gpus, free_memory = allocate(job, [2], [2, 3], {1: 12000, 2: 81920, 3: 81920})
+    # a device shared by a memory job is not idle anymore but keeps its free memory for others
+    assert free_gpus == [3]
+    assert free_memory == {1: 12000, 2: 71920, 3: 81920}
+
+    free_gpus, free_memory = allocate(job._replace(memory=None), [3], free_gpus, free_memory)
+    assert free_gpus == []
+    assert free_memory == {1: 12000, 2: 71920}
+
+
+def test_whole_device_jobs_ignore_shared_devices():
+    job = Job(1, 2, [0], None)
+    assert first_fit(job, [0, 1, 2, 3], {0: 81920, 5: 81920}) == [1, 2]
+    assert first_fit(job, [0, 1], {}) is None
@@ -0,0 +1,124 @@
+import os
+import sys
+import signal
+
+import pytest
+
+from constant import STATE
+from rpc import get_user_name
+from scheduler import Job, select_victims
+
+
+# a preemptible task: "checkpoint" exits when asked to stop by PREEMPT_SIGNAL, "ignore" keeps running until SIGTERM,
+# "trap" until SIGKILL
+VICTIM_SCRIPT = """
+import sys
+import time
+import signal
+
+if sys.argv[1] == "checkpoint":
+    signal.signal(signal.SIGUSR1, lambda sig, frame: sys.exit(0))
+else:
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+if sys.argv[1] == "trap":
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+time.sleep(300)
+"""
+
+
+def running(job_id, gpu_ids, start_time, priority=100, preemptible=True, memory=None):
+    return Job(job_id, len(gpu_ids), [], None, start_time, gpu_ids, memory, None, priority, preemptible)
+
+
+def test_victims_lose_the_least_gpu_time():
+    job = Job(1, 2, [], None, priority=1)
+    jobs = [running(2, [0, 1], 0), running(3, [2], 90), running(4, [3], 80), running(5, [4], 0)]
+    # 2 gpus for 10s and 20s rather than 2 gpus for 100s or 1 gpu for 100s
+    assert select_victims(job, jobs, [], 100) == [jobs[1], jobs[2]]
+    # fewer victims for the same loss
+    jobs = [running(2, [0, 1], 90), running(3, [2], 80), running(4, [3], 80)]
+    assert select_victims(job, jobs, [], 100) == [jobs[0]]
+    # with a free gpu
+    assert select_victims(job, jobs, [5], 100) == [jobs[0]]
+    assert select_victims(job, jobs, [5, 6], 100) == []
+
+
+def test_only_preemptible_jobs_of_lower_priority_on_whole_gpus():
+    job = Job(1, 1, [], None, priority=10)
+    assert select_victims(job, [running(2, [0], 0, preemptible=False)], [], 100) is None
+    assert select_victims(job, [running(2, [0], 0, priority=10)], [], 100) is None
+    assert select_victims(job, [running(2, [0], 0, memory=1000)], [], 100) is None
+    assert select_victims(job._replace(exclude_gpus=[0]), [running(2, [0], 0)], [], 100) is None
+    assert select_victims(job, [running(2, [0], 0, priority=11)], [], 100) == [running(2, [0], 0, priority=11)]
+
+
+def test_victims_in_one_domain():
+    # the gpus of a job are on one host
+    job = Job(1, 2, [], None, priority=1)
+    jobs = [running(2, [0], 90), running(3, [100], 90), running(4, [101], 0)]
+    assert select_victims(job, jobs, [], 100, get_domain=lambda gpu: gpu // 100) == [jobs[1], jobs[2]]
+    assert select_victims(job, jobs, [1], 100, get_domain=lambda gpu: gpu // 100) == [jobs[0]]
+
+
+@pytest.fixture
+def victim_script(tmp_path):
+    path = tmp_path / "victim.py"
+    path.write_text(VICTIM_SCRIPT)
+    return f"{sys.executable} {path}"
+
+
+# only admins give tasks a priority above the default one
+ADMIN_USERS = [get_user_name(os.getuid())]
+
+
+def preempt_for_urgent_task(server):
+    urgent_id, = server.add_tasks(["sleep 0"])
+    server.call("update_task_priority", task_id=urgent_id, priority=1)
+    return urgent_id
+
+
+def test_sigterm_after_grace_period(make_server, victim_script):
+    server = make_server(NUM_FAKE_GPUS=1, PREEMPTION=True, PREEMPT_GRACE_PERIOD=1,
+                         ADMIN_USERS=ADMIN_USERS)
+    victim_id, = server.add_tasks([f"{victim_script} ignore"], preemptible=True)
+    assert server.wait_state(victim_id, STATE.RUNNING)
+
+    urgent_id = preempt_for_urgent_task(server)
+    assert server.wait_state(urgent_id, STATE.DONE)
+    # queued again, then run again once the urgent task is done
+    task = server.wait_state(victim_id, STATE.RUNNING)
+    assert task["exit_code"] == -signal.SIGTERM
+    assert task["failure_reason"] == f"preempted for task {urgent_id}"
+    assert f"preempt tasks [{victim_id}] for task {urgent_id}, stop them in 1s" in server.read_log()
+
+
+def test_sigkill_after_another_grace_period(make_server, victim_script):
+    server = make_server(NUM_FAKE_GPUS=1, PREEMPTION=True, PREEMPT_GRACE_PERIOD=1, ADMIN_USERS=ADMIN_USERS)
+    victim_id, = server.add_tasks([f"{victim_script} trap"], preemptible=True)
+    assert server.wait_state(victim_id, STATE.RUNNING)
+
+    urgent_id = preempt_for_urgent_task(server)
+    assert server.wait_state(urgent_id, STATE.DONE)
+    task = server.wait_state(victim_id, STATE.RUNNING)
+    # killed with its launcher, which could not write its status file
+    assert task["exit_code"] == -signal.SIGKILL
+    assert task["failure_reason"] == f"preempted for task {urgent_id}"
+    assert f"task {victim_id} preempted for task {urgent_id} is still running, send SIGKILL" in server.read_log()
+
+
+def test_victim_requeued_at_its_position(make_server, victim_script):
+    server = make_server(NUM_FAKE_GPUS=1, PREEMPTION=True, PREEMPT_GRACE_PERIOD=60,
+                         ADMIN_USERS=ADMIN_USERS)
+    victim_id, = server.add_tasks([f"{victim_script} checkpoint"], preemptible=True)
+    assert server.wait_state(victim_id, STATE.RUNNING)
+    # submitted after the victim
+    waiting_id, = server.add_tasks(["sleep 0"])
+
+    urgent_id = preempt_for_urgent_task(server)
+    assert server.wait_state(urgent_id, STATE.DONE)
+    # the victim runs again before the task submitted after it
+    task = server.wait_state(victim_id, STATE.RUNNING)
+    assert task["exit_code"] == 0
+    assert task["failure_reason"] == f"preempted for task {urgent_id}"
+    assert len(server.get_launch_gpus(victim_id)) == 2
+    assert server.get_launch_gpus(waiting_id) == []
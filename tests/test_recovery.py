@@ -0,0 +1,89 @@
+import os
+import sys
+import signal
+import subprocess
+
+from constant import STATE
+from fake_server import ROOT, get_children, kill, wait_for
+from launcher import read_status
+
+
+LAUNCHER_PATH = os.path.join(ROOT, "launcher.py")
+
+
+def run_launcher(tmp_path, command):
+    status_path = str(tmp_path / "status.json")
+    process = subprocess.run([sys.executable, LAUNCHER_PATH, status_path] + command, stderr=subprocess.DEVNULL)
+    return process.returncode, read_status(status_path)
+
+
+def test_launcher_exits_like_the_task(tmp_path):
+    assert run_launcher(tmp_path, ["sh", "-c", "exit 3"]) == (3, (3, None))
+    assert run_launcher(tmp_path, ["sh", "-c", "kill -TERM $$"]) == (-signal.SIGTERM, (-signal.SIGTERM, None))
+    assert run_launcher(tmp_path, ["no-such-command"]) == (127, (127, None))
+    assert run_launcher(tmp_path, ["sh", "-c", "echo CUDA out of memory; exit 1"]) == (1, (1, "oom"))
+
+
+def test_launcher_of_task_killed_by_sigkill(tmp_path):
+    # e.g. by the oom killer, the signal can not be raised again by the launcher
+    assert run_launcher(tmp_path, ["sh", "-c", "kill -KILL $$"]) == (128 + signal.SIGKILL, (-signal.SIGKILL, None))
+
+
+def test_task_killed_by_sigkill(make_server):
+    server = make_server()
+    task_id, = server.add_tasks(["sleep 300"])
+    pid = server.wait_state(task_id, STATE.RUNNING)["pid"]
+    child, = wait_for(lambda: get_children(pid))
+
+    kill(child)
+    task = server.wait_state(task_id, STATE.RETRYING)
+    assert task["exit_code"] == -signal.SIGKILL
+    assert task["failure_reason"] == "killed by SIGKILL"
+    assert task["num_retries"] == 1
+
+
+def test_status_file_removed_once_task_is_done(make_server):
+    server = make_server()
+    done_id, retrying_id = server.add_tasks(["sleep 0", "false"])
+    assert server.wait_state(done_id, STATE.DONE)
+    assert server.wait_state(retrying_id, STATE.RETRYING)
+    for task_id in [done_id, retrying_id]:
+        assert wait_for(lambda: not os.path.exists(os.path.join(server.tmp_dir, "tasks", f"{task_id}.json")))
+
+
+def test_recover_tasks_after_server_is_killed(make_server):
+    server = make_server()
+    exited_id, adopted_id, gone_id = server.add_tasks(["sleep 2", "sleep 300", "sleep 300"])
+    pids = {task_id: server.wait_state(task_id, STATE.RUNNING)["pid"]
+            for task_id in [exited_id, adopted_id, gone_id]}
+
+    server.kill()
+    # gone without status file, e.g. killed with the host: the launcher first so that it does not write it
+    gone_child, = wait_for(lambda: get_children(pids[gone_id]))
+    kill(pids[gone_id])
+    kill(gone_child)
+    # exits while the server is stopped
+    assert wait_for(lambda: os.path.exists(os.path.join(server.tmp_dir, "tasks", f"{exited_id}.json")))
+
+    server.start()
+    task = server.wait_state(exited_id, STATE.DONE)
+    assert task["exit_code"] == 0
+    assert wait_for(lambda: not os.path.exists(os.path.join(server.tmp_dir, "tasks", f"{exited_id}.json")))
+
+    # queued again and launched again
+    task = wait_for(lambda: server.get_task(gone_id)["pid"] not in [None, pids[gone_id]] and server.get_task(gone_id))
+    assert task["state"] == STATE.RUNNING
+
+    task = server.get_task(adopted_id)
+    assert task["state"] == STATE.RUNNING and task["pid"] == pids[adopted_id]
+    log = server.read_log()
+    assert f"task {adopted_id} is still running with pid {pids[adopted_id]}" in log
+    assert f"task {exited_id} exited with exit code 0 while the server was stopped" in log
+    assert f"task {gone_id} is gone" in log
+
+    # the adopted task is supervised, its exit code is read from the status file of the launcher
+    adopted_child, = get_children(pids[adopted_id])
+    kill(adopted_child)
+    task = server.wait_state(adopted_id, STATE.RETRYING)
+    assert task["exit_code"] == -signal.SIGKILL
+    assert task["failure_reason"] == "killed by SIGKILL"
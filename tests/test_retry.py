@@ -0,0 +1,150 @@
+import signal
+
+import pytest
+
+from constant import STATE
+from retry import (FAILURE_COMMAND, FAILURE_EXIT, FAILURE_LAUNCH, FAILURE_LOST, FAILURE_OOM, FAILURE_SIGNAL,
+                   RetryPolicy, describe_failure)
+from scheduler import Job
+
+
+# exits with the code given as argument, or fails like a task of a real workload
+TASK_SCRIPT = """
+case $1 in
+    oom) echo "RuntimeError: CUDA out of memory. Tried to allocate 2.00 GiB"; exit 1;;
+    signal) kill -TERM $$;;
+    *) exit $1;;
+esac
+"""
+
+
+def test_describe_failure():
+    assert describe_failure(0) == (None, None)
+    assert describe_failure(1) == (FAILURE_EXIT, "exit code 1")
+    assert describe_failure(126) == (FAILURE_COMMAND, "command can not run, exit code 126")
+    assert describe_failure(127) == (FAILURE_COMMAND, "command can not run, exit code 127")
+    assert describe_failure(-signal.SIGKILL) == (FAILURE_SIGNAL, "killed by SIGKILL")
+    assert describe_failure(-99) == (FAILURE_SIGNAL, "killed by signal 99")
+    assert describe_failure(1, "oom") == (FAILURE_OOM, "out of gpu memory, exit code 1")
+    # a task out of memory which handled the error
+    assert describe_failure(0, "oom") == (None, None)
+    assert describe_failure(-1, "lost") == (FAILURE_LOST, "lost with its agent")
+    assert describe_failure(None, "OSError: disk full") == (FAILURE_LAUNCH, "failed to launch: OSError: disk full")
+
+
+def test_retry_backoff():
+    policy = RetryPolicy(max_attempts=5, backoff=30, max_backoff=100, max_per_minute=60)
+    job = Job(1, 1, [], None)
+    assert [policy.decide(job, FAILURE_EXIT, n, 1000 * n, [0]).retry_time for n in range(4)] == [30, 1060, 2100, 3100]
+    # the last attempt
+    assert policy.decide(job, FAILURE_EXIT, 4, 0, [0]) is None
+    assert RetryPolicy(1, 30, 100, 60).decide(job, FAILURE_EXIT, 0, 0, [0]) is None
+
+
+def test_retry_rate_limit():
+    policy = RetryPolicy(max_attempts=3, backoff=10, max_backoff=100, max_per_minute=6)
+    times = [policy.decide(Job(i, 1, [], None), FAILURE_SIGNAL, 0, 0, [0]).retry_time for i in range(3)]
+    assert times == [10, 20, 30]
+
+
+def test_command_not_retried():
+    policy = RetryPolicy(max_attempts=3, backoff=10, max_backoff=100, max_per_minute=6)
+    assert policy.decide(Job(1, 1, [], None), FAILURE_COMMAND, 0, 0, [0]) is None
+
+
+@pytest.mark.parametrize("on_oom, job, expected", [
+    # shared gpus: whole gpus
+    ("exclude_gpus", Job(1, 1, [], None, gpu_ids=[2], memory=1000), (1, [], None)),
+    ("more_gpus", Job(1, 1, [], None, gpu_ids=[2], memory=1000), (1, [], None)),
+    ("exclude_gpus", Job(1, 1, [3], None, gpu_ids=[2]), (1, [2, 3], None)),
+    # unless too few gpus would be left
+    ("exclude_gpus", Job(1, 2, [0, 1], None, gpu_ids=[2, 3]), (2, [0, 1], None)),
+    ("more_gpus", Job(1, 2, [], None, gpu_ids=[2, 3]), (4, [], None)),
+    ("more_gpus", Job(1, 3, [], None, gpu_ids=[0, 1, 2]), (4, [], None)),
+    (None, Job(1, 1, [], None, gpu_ids=[2]), (1, [], None)),
+])
+def test_retry_out_of_memory(on_oom, job, expected):
+    policy = RetryPolicy(max_attempts=3, backoff=10, max_backoff=100, max_per_minute=6, on_oom=on_oom)
+    retry = policy.decide(job, FAILURE_OOM, 0, 0, [0, 1, 2, 3])
+    assert (retry.num_gpus, retry.exclude_gpus, retry.memory) == expected
+
+
+@pytest.fixture
+def task_script(tmp_path):
+    path = tmp_path / "task.sh"
+    path.write_text(TASK_SCRIPT)
+    return f"sh {path}"
+
+
+def test_failed_after_max_attempts(make_server, task_script):
+    server = make_server(RETRY_MAX_ATTEMPTS=3, RETRY_BACKOFF=0, RETRY_MAX_PER_MINUTE=600)
+    task_id, = server.add_tasks([f"{task_script} 1"])
+
+    task = server.wait_state(task_id, STATE.FAILED)
+    assert task["exit_code"] == 1
+    assert task["failure_reason"] == "exit code 1"
+    assert task["num_retries"] == 2
+    assert len(server.get_launch_gpus(task_id)) == 3
+
+
+@pytest.mark.parametrize("exit_code", [126, 127])
+def test_command_can_not_run(make_server, task_script, exit_code):
+    server = make_server(RETRY_BACKOFF=0)
+    task_id, = server.add_tasks([f"{task_script} {exit_code}"])
+
+    task = server.wait_state(task_id, STATE.FAILED)
+    assert task["exit_code"] == exit_code
+    assert task["failure_reason"] == f"command can not run, exit code {exit_code}"
+    assert not task["num_retries"]
+    assert len(server.get_launch_gpus(task_id)) == 1
+
+
+def test_command_not_found(make_server):
+    server = make_server(RETRY_BACKOFF=0)
+    task_id, = server.add_tasks(["no-such-command --help"])
+
+    task = server.wait_state(task_id, STATE.FAILED)
+    assert task["exit_code"] == 127
+
+
+def test_retry_killed_by_signal(make_server, task_script):
+    # backoff long enough to see the task waiting for its retry
+    server = make_server(RETRY_BACKOFF=600)
+    task_id, = server.add_tasks([f"{task_script} signal"])
+
+    task = server.wait_state(task_id, STATE.RETRYING)
+    assert task["exit_code"] == -signal.SIGTERM
+    assert task["failure_reason"] == "killed by SIGTERM"
+    assert task["num_retries"] == 1
+
+
+def test_retry_out_of_memory_on_other_gpus(make_server, task_script):
+    server = make_server(RETRY_BACKOFF=600, RETRY_ON_OOM="exclude_gpus")
+    task_id, = server.add_tasks([f"{task_script} oom"])
+
+    task = server.wait_state(task_id, STATE.RETRYING)
+    assert task["failure_reason"] == "out of gpu memory, exit code 1"
+    assert task["exclude_gpus"] == server.get_launch_gpus(task_id)[0]
+    assert task["num_gpus_required"] == 1
+
+
+def test_retry_out_of_memory_with_more_gpus(make_server, task_script):
+    server = make_server(RETRY_BACKOFF=600, RETRY_ON_OOM="more_gpus")
+    task_id, = server.add_tasks([f"{task_script} oom"], num_gpus=2)
+
+    task = server.wait_state(task_id, STATE.RETRYING)
+    assert task["failure_reason"] == "out of gpu memory, exit code 1"
+    assert task["num_gpus_required"] == 4
+    assert task["exclude_gpus"] == []
+
+
+def test_retry_out_of_memory_on_whole_gpus(make_server, task_script):
+    server = make_server(RETRY_BACKOFF=0, RETRY_MAX_PER_MINUTE=600, RETRY_ON_OOM="more_gpus")
+    task_id, = server.add_tasks([f"{task_script} oom"], memory=1000)
+
+    task = server.wait_state(task_id, STATE.FAILED)
+    assert task["num_retries"] == 2
+    assert task["memory_required"] is None
+    # then with more gpus
+    assert task["num_gpus_required"] == 2
+    assert [len(gpus) for gpus in server.get_launch_gpus(task_id)] == [1, 1, 2]
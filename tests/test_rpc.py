@@ -0,0 +1,110 @@
+import os
+import sys
+import sqlite3
+import subprocess
+
+import pytest
+
+from client import parse_sweep
+from constant import STATE
+from fake_server import ROOT
+from rpc import RPCError, RPCServer, connect_server, get_user_name
+from util import get_logger
+
+
+def test_requests_are_handled_for_the_client_user(tmp_path):
+    requests = []
+
+    def handle_request(method, params, uid):
+        requests.append((method, params, uid))
+        return len(requests)
+
+    rpc_server = RPCServer(str(tmp_path / "rpc.sock"), handle_request, get_logger(str(tmp_path / "rpc.log")))
+    rpc_server.start()
+    try:
+        assert connect_server(str(tmp_path / "rpc.sock")).call("add_task", command="sleep 1", owner="root") == 1
+    finally:
+        rpc_server.stop()
+    # the uid is the one of the process, the owner sent by the client is only a parameter
+    assert requests == [("add_task", {"command": "sleep 1", "owner": "root"}, os.getuid())]
+
+
+def test_user_name_without_passwd_entry():
+    assert get_user_name(0) == "root"
+    assert get_user_name(2 ** 31 - 2) == str(2 ** 31 - 2)
+
+
+def test_owner_of_tasks_is_the_client_user(make_server):
+    # whatever the client claims
+    server = make_server()
+    task_id = server.call("add_task", command="sleep 0", num_gpus_required=1, exclude_gpus=[], owner="mallory")
+    first_id, last_id = server.call("add_tasks", tasks=[{"command": "sleep 0", "owner": "mallory"}] * 2)
+    server.call("add_sweep", **dict(parse_sweep('{"command": "sleep {t}", "grid": {"t": [0]}}'), owner="mallory"))
+
+    user = get_user_name(os.getuid())
+    assert [server.get_task(i)["owner"] for i in [task_id, first_id, last_id]] == [user] * 3
+    assert [sweep["owner"] for sweep in server.call("list_sweeps", active=False)] == [user]
+
+
+def set_owner(server, table, item_id, owner):
+    with sqlite3.connect(os.path.join(server.tmp_dir, "task.db")) as connection:
+        connection.execute(f"update {table} set owner = ? where id = ?", (owner, item_id))
+
+
+def test_users_only_change_their_own_tasks(make_server):
+    server = make_server(ADMIN_USERS=[])
+    running_id, = server.add_tasks(["sleep 300"])
+    assert server.wait_state(running_id, STATE.RUNNING)
+    # queuing until the running task is done
+    own_id, other_id = server.add_tasks(["sleep 0", "sleep 0"], after=[running_id])
+    set_owner(server, "Task", other_id, "mallory")
+    sweep_id = server.call("add_sweep", **parse_sweep('{"command": "sleep {t}", "grid": {"t": [0]}}'))
+    set_owner(server, "Sweep", sweep_id, "mallory")
+
+    for method, params in [("remove_queuing_task", dict(task_id=other_id)),
+                           ("update_task_priority", dict(task_id=other_id, priority=200)),
+                           ("stop_sweep", dict(sweep_id=sweep_id))]:
+        with pytest.raises(RPCError, match="is owned by mallory"):
+            server.call(method, **params)
+    # nor put their tasks before the fair share
+    with pytest.raises(RPCError, match="only allowed to admins"):
+        server.call("update_task_priority", task_id=own_id, priority=1)
+    assert server.call("update_task_priority", task_id=own_id, priority=200) == 100
+
+    deleted = server.call("remove_all")
+    assert own_id in deleted and other_id not in deleted and running_id not in deleted
+    assert server.get_task(other_id)["state"] == STATE.QUEUING
+    assert server.get_task(running_id)["state"] == STATE.RUNNING
+    assert [sweep["stop_reason"] for sweep in server.call("list_sweeps", active=False)] == [None]
+
+
+@pytest.mark.parametrize("method, params", [
+    ("add_task", dict(command="sleep 0", num_gpus_required=-1, exclude_gpus=[])),
+    ("add_task", dict(command="sleep 0", num_gpus_required=1, exclude_gpus=[], memory_required=-1)),
+    ("add_tasks", dict(tasks=[{"command": "sleep 0"}, {"command": "sleep 0", "num_gpus_required": 0}])),
+    ("add_sweep", dict(parse_sweep('{"command": "sleep {t}", "grid": {"t": [0]}}'), size=1000)),
+    ("update_task_priority", dict(task_id=1, priority=-1)),
+])
+def test_requests_are_checked_by_the_server(make_server, method, params):
+    # like the client does, for the clients which do not
+    server = make_server()
+    with pytest.raises(RPCError, match="ValueError"):
+        server.call(method, **params)
+    assert server.call("count_tasks", states=[STATE.QUEUING, STATE.PENDING, STATE.RUNNING]) == 0
+
+
+def run_client(server, *args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, "client.py"), "--rpc-path",
+                           os.path.join(server.tmp_dir, "server_rpc.sock"), *args], capture_output=True, text=True)
+
+
+def test_client_prints_errors(make_server):
+    server = make_server(ADMIN_USERS=[])
+    task_id, = server.add_tasks(["sleep 300"])
+
+    # checked by the client, then by the server
+    for args, error in [(["-c", "sleep", "0", "-n", "0"], "num_gpus requires positive int"),
+                        (["-p", str(task_id), "1"], "only allowed to admins")]:
+        process = run_client(server, *args)
+        assert process.returncode == 1
+        assert error in process.stderr and "Traceback" not in process.stderr
@@ -0,0 +1,35 @@
+import re
+
+from client import parse_sweep
+from constant import STATE
+from fake_server import wait_for
+
+
+def add_sweep(server, text):
+    return server.call("add_sweep", **parse_sweep(text))
+
+
+def get_expansions(server, sweep_id):
+    # ids of the tasks expanded at each scheduling pass
+    return [[int(task_id) for task_id in task_ids.split(", ")]
+            for task_ids in re.findall(rf"expand sweep {sweep_id} into tasks \[(.*?)\]", server.read_log())]
+
+
+def test_expand_for_free_gpus(make_server):
+    server = make_server(NUM_FAKE_GPUS=2)
+    sweep_id = add_sweep(server, '{"command": "sleep 300 {i}", "grid": {"i": [0, 1, 2, 3, 4]}, "num_gpus": 1}')
+
+    # the points which run, and one queued to keep the place of the sweep in the queue
+    assert wait_for(lambda: len(get_expansions(server, sweep_id)) == 2)
+    assert get_expansions(server, sweep_id) == [[1, 2], [3]]
+    assert [server.get_task(task_id)["state"] for task_id in [1, 2]] == [STATE.RUNNING] * 2
+
+
+def test_expand_for_free_memory(make_server):
+    # 4 points of 20000 MB fit on a fake gpu of 81920 MB, they are expanded in one pass
+    server = make_server(NUM_FAKE_GPUS=1)
+    sweep_id = add_sweep(server, '{"command": "sleep 300 {i}", "grid": {"i": [0, 1, 2, 3, 4, 5]}, "memory": 20000}')
+
+    assert wait_for(lambda: len(get_expansions(server, sweep_id)) == 2)
+    assert get_expansions(server, sweep_id) == [[1, 2, 3, 4], [5]]
+    assert wait_for(lambda: all(server.get_task(task_id)["state"] == STATE.RUNNING for task_id in [1, 2, 3, 4]))
@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import random
+import itertools
+import subprocess
+
+from scheduler import Job, first_fit
+
+
+# cost of a link between two gpus as reported by `nvidia-smi topo -m`, smaller is closer
+LINK_COSTS = {
+    "PIX": 10,
+    "PXB": 20,
+    "PHB": 30,
+    "NODE": 40,
+    "SYS": 50,
+}
+# above this number of subsets, fall back to a greedy search
+MAX_EXHAUSTIVE_SUBSETS = 5000
+
+
+def get_link_cost(link):
+    if link.startswith("NV"):
+        # NV# is a bonded set of # nvlinks, more links are closer
+        return 5 / int(link[2:])
+    return LINK_COSTS.get(link, LINK_COSTS["SYS"])
+
+
+def parse_topology(text):
+    # parse the matrix printed by `nvidia-smi topo -m`, nic rows and columns are ignored
+    text = re.sub(r"\x1b\[[0-9;]*m", "", text)
+    lines = [line for line in text.splitlines() if line.strip() != '']
+
+    header = lines[0].split()
+    num_gpus = len([h for h in header if re.fullmatch(r"GPU\d+", h)])
+
+    costs = {}
+    for line in lines[1:]:
+        items = line.split()
+        if not re.fullmatch(r"GPU\d+", items[0]):
+            continue
+
+        gpu = int(items[0][3:])
+        for other, link in enumerate(items[1:num_gpus + 1]):
+            if other != gpu:
+                costs[(gpu, other)] = get_link_cost(link)
+
+    return Topology(costs)
+
+
+def load_topology(path=None):
+    # from a saved `nvidia-smi topo -m` output, or by running it, None if not available
+    if path is not None:
+        with open(path, 'r') as f:
+            return parse_topology(f.read())
+
+    try:
+        output = subprocess.run(["nvidia-smi", "topo", "-m"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return parse_topology(output)
+
+
+class Topology(object):
+    def __init__(self, costs):
+        # costs: {(gpu_a, gpu_b): link cost}
+        self.costs = costs
+
+    def get_cost(self, gpu_a, gpu_b):
+        return self.costs.get((gpu_a, gpu_b), LINK_COSTS["SYS"])
+
+    def select(self, candidates, num_gpus):
+        # choose the tightest connected subset of `candidates`, among equally tight subsets prefer the one
+        # loosely connected to the remaining candidates so that compact blocks stay free for large tasks
+        if len(candidates) < num_gpus:
+            return None
+
+        if num_gpus == len(candidates):
+            return sorted(candidates)
+
+        num_subsets = 1
+        for i in range(num_gpus):
+            num_subsets = num_subsets * (len(candidates) - i) // (i + 1)
+
+        if num_subsets > MAX_EXHAUSTIVE_SUBSETS:
+            subsets = self.__greedy_subsets(candidates, num_gpus)
+        else:
+            subsets = itertools.combinations(sorted(candidates), num_gpus)
+
+        best = min(subsets, key=lambda subset: self.__score(subset, candidates))
+        return sorted(best)
+
+    def get_internal_cost(self, gpu_ids):
+        return sum(self.get_cost(a, b) for a, b in itertools.combinations(gpu_ids, 2))
+
+    def __score(self, subset, candidates):
+        remaining = [gpu for gpu in candidates if gpu not in subset]
+        closeness = sum(1 / self.get_cost(a, b) for a in subset for b in remaining)
+        return self.get_internal_cost(subset), closeness
+
+    def __greedy_subsets(self, candidates, num_gpus):
+        # grow one subset from each candidate by adding the closest gpu
+        for seed in candidates:
+            subset = [seed]
+            while len(subset) < num_gpus:
+                others = [gpu for gpu in candidates if gpu not in subset]
+                subset.append(min(others, key=lambda gpu: sum(self.get_cost(gpu, s) for s in subset)))
+            yield tuple(subset)
+
+
+class TopologyPlacement(object):
+    # placement for the schedulers: tasks using whole gpus get the tightest connected free subset
+    def __init__(self, topology):
+        self.topology = topology
+
+    def __call__(self, job, free_gpus, free_memory):
+        if job.memory is not None:
+            return first_fit(job, free_gpus, free_memory)
+
+        candidates = [gpu for gpu in free_gpus if gpu not in job.exclude_gpus]
+        return self.topology.select(candidates, job.num_gpus)
+
+
+if __name__ == "__main__":
+    # compare the placement with first fit on random free sets of the dgx-1 topology
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_scripts", "topo_dgx1.txt")
+    topology = load_topology(path)
+    placement = TopologyPlacement(topology)
+    rng = random.Random(0)
+
+    for num_gpus in [2, 4]:
+        first_fit_cost, topology_cost, elapsed, num_trials = 0, 0, 0, 1000
+        for _ in range(num_trials):
+            free_gpus = sorted(rng.sample(range(8), rng.randint(num_gpus, 8)))
+            job = Job(0, num_gpus, [])
+
+            start = time.perf_counter()
+            gpu_ids = placement(job, free_gpus, {})
+            elapsed += time.perf_counter() - start
+
+            topology_cost += topology.get_internal_cost(gpu_ids)
+            first_fit_cost += topology.get_internal_cost(free_gpus[:num_gpus])
+
+        print(f"{num_gpus} gpus: mean link cost first fit {first_fit_cost / num_trials:.2f}, "
+              f"topology {topology_cost / num_trials:.2f}, {elapsed / num_trials * 1e6:.0f}us per placement")
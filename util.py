@@ -1,5 +1,9 @@
 import os
+import sys
+import queue
+import atexit
 import logging
+import logging.handlers
 
 
 def is_pid_alive(pid):
@@ -11,18 +15,56 @@ def is_pid_alive(pid):
         return True
 
 
-def get_logger(log_path):
+def get_process_start_time(pid):
+    # start time of a process in clock ticks since boot, tells it apart from a later process reusing the pid,
+    # None if not available (not running or no /proc)
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the second field is the command name in parentheses, which may contain spaces
+    return int(stat[stat.rindex(")") + 2:].split()[19])
+
+
+def get_process_cmdline(pid):
+    # arguments of a process, None if not available
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            return [arg.decode(errors="replace") for arg in f.read().split(b"\0")[:-1]]
+    except OSError:
+        return None
+
+
+def get_logger(log_path, max_bytes=0, backup_count=0, when=None):
+    # the log is written by a background thread: rotated every `when` (e.g. "midnight", see
+    # `TimedRotatingFileHandler`) if given, otherwise once it reaches `max_bytes` (0 never rotates), keeping
+    # `backup_count` backups
+    # it is also printed to stderr when it is a terminal, not when it is redirected by main.sh
     log_dir = os.path.dirname(log_path)
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
-        
-    logging.basicConfig(
-            level=logging.INFO, 
-            format='%(asctime)s %(levelname)s: %(message)s',
-            handlers=[
-                logging.FileHandler(log_path, mode='a'),
-                logging.StreamHandler()
-                ]
-            )
+
+    if when is not None:
+        file_handler = logging.handlers.TimedRotatingFileHandler(log_path, when=when, backupCount=backup_count)
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count)
+    handlers = [file_handler]
+    if sys.stderr.isatty():
+        handlers.append(logging.StreamHandler())
+    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # the message of a record is rendered by the caller when it is queued, like `QueueHandler.prepare` does, so that
+    # arguments changed after the call are logged as they were and errors of their `__str__` are reported in the caller
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # write the pending records at exit
+    atexit.register(listener.stop)
     logger = logging.getLogger(__name__)
-    return logger
\ No newline at end of file
+    return logger